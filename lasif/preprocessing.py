@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The processing applied to the data before it is compared to synthetics.
+
+The data of every station is trimmed, detrended, tapered, instrument
+corrected, resampled onto the time axis of the synthetics and bandpass
+filtered without phase shift. Used by the data synthetic iterator and by
+the batch preprocessing which stores the results in
+DATA/EVENT_NAME/processed_HASH/. The hash is derived from the tag of the
+processed data and all parameters influencing the result, see
+get_processing_tag(). The size, modification time and inode of the waveform
+and station file of every channel are stored in a hidden file next to the
+processed file. It is only used as long as they do not change, see
+is_processed().
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import cPickle
+import hashlib
+import os
+import warnings
+
+from lasif.tools.file_info_cache import get_file_stat, write_pickle
+
+
+# Change whenever the processing changes so old results are not reused.
+PROCESSING_VERSION = 4
+
+# The prefix of the tags of processed data.
+PROCESSED_TAG_PREFIX = "processed_"
+
+# Instances reused by all stations processed in a worker process.
+_WORKER_STATE = {}
+
+
+def get_processing_tag(data_tag, starttime, npts, delta, highpass, lowpass):
+    """
+    Returns the tag of the processed data, e.g. "processed_3f2a9c01d4b7".
+
+    :param data_tag: The tag of the data that is processed, e.g. "raw".
+    :param starttime: The start time of the synthetics.
+    :param npts: The number of samples of the synthetics.
+    :param delta: The sample spacing of the synthetics.
+    :param highpass: The upper corner frequency of the bandpass or None.
+    :param lowpass: The lower corner frequency of the bandpass or None.
+    """
+    parameters = repr((PROCESSING_VERSION, str(data_tag),
+        float(starttime.timestamp), int(npts), float(delta), highpass,
+        lowpass))
+    return PROCESSED_TAG_PREFIX + hashlib.md5(parameters).hexdigest()[:12]
+
+
+def get_responses(data, response_cache):
+    """
+    Returns the response of every trace for the InstrumentCorrector. The
+    station file of every trace must be set in trace.stats.station_file and
+    the block in RESP files in trace.stats.station_file_block.
+    """
+    responses = []
+    for trace in data:
+        station_file = trace.stats.station_file
+        if "/SEED/" in station_file or "/StationXML/" in station_file:
+            responses.append({"paz": response_cache.get_paz(station_file,
+                trace.id, trace.stats.starttime)})
+        elif "/RESP/" in station_file:
+            offset, length = trace.stats.station_file_block
+            responses.append({"seedresp": {"filename": station_file,
+                "units": "VEL", "date": trace.stats.starttime,
+                "offset": offset, "length": length}})
+        else:
+            raise NotImplementedError
+    return responses
+
+
+def preprocess_traces(data, starttime, npts, delta, highpass, lowpass,
+        response_cache, instrument_corrector, resampler,
+        correction_lock=None):
+    """
+    Processes the traces of a station in place. Afterwards they share the
+    time axis of the synthetics.
+
+    :param data: The Stream. See get_responses() for the required stats.
+    :param starttime: The start time of the synthetics.
+    :param npts: The number of samples of the synthetics.
+    :param delta: The sample spacing of the synthetics.
+    :param highpass: The upper corner frequency of the bandpass.
+    :param lowpass: The lower corner frequency of the bandpass. No bandpass
+        is applied if either is None. It is applied forwards and backwards
+        so the phases are not shifted. The synthetics have to be filtered
+        the same way.
+    :param response_cache: The ResponseCache.
+    :param instrument_corrector: The InstrumentCorrector.
+    :param resampler: The Resampler. Also acts as the anti-aliasing filter.
+    :param correction_lock: Optional lock acquired during the instrument
+        correction if the caches are shared between threads.
+    """
+    from lasif.tools import signal_processing
+
+    endtime = starttime + (npts - 1) * delta
+    sampling_rate = 1.0 / delta
+
+    len_synth = endtime - starttime
+    data.trim(starttime - len_synth * 0.05, endtime + len_synth * 0.05)
+    if data:
+        max_length = max([tr.stats.npts for tr in data])
+    else:
+        max_length = 0
+    if max_length == 0:
+        msg = ("Warning: After trimming the waveform data to "
+            "the time window of the synthetics, no more data is "
+            "left. The reference time is the one given in the "
+            "QuakeML file. Make sure it is correct and that "
+            "the waveform data actually contains data in that "
+            "time span.")
+        warnings.warn(msg)
+    # Detrend and taper all traces at once.
+    signal_processing.detrend_traces(data)
+    signal_processing.taper_traces(data, max_percentage=0.05)
+
+    # Remove the instrument responses of all traces at once.
+    if correction_lock is not None:
+        correction_lock.acquire()
+    try:
+        instrument_corrector.correct_traces(data,
+            get_responses(data, response_cache))
+    finally:
+        if correction_lock is not None:
+            correction_lock.release()
+
+    # Samples of the synthetics not covered by the data are set to zero.
+    resampler.resample_traces(data, starttime, npts, sampling_rate,
+        fill_value=0.0)
+
+    if highpass is not None and lowpass is not None:
+        signal_processing.filter_traces(data, "bandpass", freqmin=lowpass,
+            freqmax=highpass, zerophase=True)
+    return data
+
+
+def preprocess_station(task):
+    """
+    Processes the data of one station and writes one MiniSEED file per
+    channel to the output folder. Intended to be run in a worker process.
+
+    Returns a tuple (station_id, number of written files, error message or
+    None).
+
+    :param task: Dictionary with the keys "station_id", "channels" (list of
+        (waveform filename, station file, station file block) tuples),
+        "output_folder", "response_cache_folder", "starttime", "npts",
+        "delta", "highpass" and "lowpass".
+    """
+    from lasif.tools.instrument_correction import InstrumentCorrector
+    from lasif.tools.resampling import Resampler
+    from lasif.tools.response_cache import ResponseCache
+    from obspy import read, Stream
+
+    # The cached responses are reused for all stations of a process.
+    if _WORKER_STATE.get("response_cache_folder") != \
+            task["response_cache_folder"]:
+        _WORKER_STATE["response_cache_folder"] = \
+            task["response_cache_folder"]
+        _WORKER_STATE["response_cache"] = ResponseCache(
+            task["response_cache_folder"])
+        _WORKER_STATE["instrument_corrector"] = InstrumentCorrector()
+        _WORKER_STATE["resampler"] = Resampler()
+
+    try:
+        data = Stream()
+        input_stats = {}
+        for filename, station_file, station_file_block in task["channels"]:
+            # Before reading so changes in the meanwhile are not missed.
+            stats = get_input_stats(filename, station_file)
+            data += read(filename)[0]
+            data[-1].stats.station_file = station_file
+            data[-1].stats.station_file_block = station_file_block
+            input_stats[data[-1].id] = stats
+        preprocess_traces(data, task["starttime"], task["npts"],
+            task["delta"], task["highpass"], task["lowpass"],
+            _WORKER_STATE["response_cache"],
+            _WORKER_STATE["instrument_corrector"],
+            _WORKER_STATE["resampler"])
+        for trace in data:
+            _write_trace(trace, task["output_folder"],
+                input_stats[trace.id])
+    except Exception as e:
+        return task["station_id"], 0, "%s: %s" % (e.__class__.__name__,
+            str(e))
+    return task["station_id"], len(data), None
+
+
+def get_processed_filename(output_folder, channel_id):
+    return os.path.join(output_folder, "%s.mseed" % channel_id)
+
+
+def get_input_stats(filename, station_file):
+    """
+    Returns the stats of the waveform and the station file of a channel. See
+    get_file_stat().
+    """
+    return (get_file_stat(filename), get_file_stat(station_file))
+
+
+def is_processed(output_folder, channel_id, filename, station_file):
+    """
+    Returns True if the processed file of a channel exists and has been
+    computed from the current waveform and station file.
+
+    :param output_folder: The folder with the processed data.
+    :param channel_id: The id of the channel.
+    :param filename: The waveform file of the channel.
+    :param station_file: The station file of the channel.
+    """
+    if not os.path.exists(get_processed_filename(output_folder, channel_id)):
+        return False
+    try:
+        with open(_get_input_stats_filename(output_folder, channel_id),
+                "rb") as open_file:
+            input_stats = cPickle.load(open_file)
+        return input_stats == get_input_stats(filename, station_file)
+    except Exception:
+        # Missing, corrupt or one of the input files is gone.
+        return False
+
+
+def _get_input_stats_filename(output_folder, channel_id):
+    # Hidden so it is not mistaken for a waveform file.
+    return os.path.join(output_folder, ".%s.inputs.pickle" % channel_id)
+
+
+def _write_trace(trace, output_folder, input_stats):
+    """
+    Writes the trace to a temporary file first so nobody ever reads a
+    partially written file. The stats of the input files are written
+    afterwards so an interrupted write never results in a processed file
+    that appears up-to-date.
+    """
+    import numpy as np
+
+    filename = get_processed_filename(output_folder, trace.id)
+    temp_filename = os.path.join(output_folder,
+        ".%s.tmp" % os.path.basename(filename))
+    trace.data = np.require(trace.data, dtype=np.float64,
+        requirements=["C"])
+    try:
+        trace.write(temp_filename, format="MSEED")
+        os.rename(temp_filename, filename)
+    finally:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+    write_pickle(_get_input_stats_filename(output_folder, trace.id),
+        input_stats)
@@ -21,6 +21,11 @@ import sys
 import warnings
 
 
+# The coordinate columns of get_station_coordinate_arrays().
+COORDINATE_KEYS = ["latitude", "longitude", "elevation_in_m",
+    "local_depth_in_m"]
+
+
 class LASIFException(Exception):
     pass
 
@@ -256,6 +261,21 @@ class Project(object):
                 if not os.path.exists(filename):
                     break
             return filename
+        if format == "StationXML":
+            def stationxml_filename_generator():
+                i = 0
+                while True:
+                    filename = os.path.join(self.paths["station_xml"],
+                        "station.{network}_{station}".format(network=network,
+                        station=station))
+                    if i:
+                        filename += ".%i" % i
+                    i += 1
+                    yield filename + ".xml"
+            for filename in stationxml_filename_generator():
+                if not os.path.exists(filename):
+                    break
+            return filename
         else:
             raise NotImplementedError
 
@@ -349,13 +369,7 @@ class Project(object):
         Returns a dictonary with all events in the project, the keys are the
         event names and the values the full paths to each event.
         """
-        events = {}
-        for event in glob.iglob(os.path.join(self.paths["events"],
-                "*%sxml" % os.extsep)):
-            event = os.path.abspath(event)
-            event_name = os.path.splitext(os.path.basename(event))[0]
-            events[event_name] = event
-        return events
+        return self.event_catalog.get_event_filenames()
 
     def plot_domain(self):
         """
@@ -420,14 +434,13 @@ class Project(object):
             msg = "Event '%s' not found in project." % event_name
             raise ValueError(msg)
 
-        event = self.get_event(event_name)
         event_info = self.get_event_info(event_name)
 
-        stations = self.get_stations_for_event(event_name)
+        stations = self.get_station_coordinate_arrays(event_name)
         visualization.plot_stations_for_event(map_object=map,
             station_dict=stations, event_info=event_info)
         # Plot the beachball for one event.
-        visualization.plot_events([event], map_object=map)
+        visualization.plot_events([event_info], map_object=map)
 
         plt.show()
 
@@ -445,7 +458,7 @@ class Project(object):
             rotation_axis=self.domain["rotation_axis"],
             rotation_angle_in_degree=self.domain["rotation_angle"],
             plot_simulation_domain=False, show_plot=False, zoom=True)
-        events = self.get_all_events()
+        events = self.event_catalog.get_event_infos().values()
         visualization.plot_events(events, map_object=map)
         plt.show()
 
@@ -467,19 +480,18 @@ class Project(object):
             plot_simulation_domain=False, show_plot=False, zoom=True,
             resolution="l")
 
+        event_infos = self.event_catalog.get_event_infos()
         event_stations = []
-        for event_name in self.get_event_dict().keys():
-            event = self.get_event(event_name)
-            stations = self.get_stations_for_event(event_name)
-            event_stations.append((event, stations))
+        for event_name, event_info in event_infos.iteritems():
+            stations = self.get_station_coordinate_arrays(event_name)
+            event_stations.append((event_info, stations))
 
         visualization.plot_raydensity(map, event_stations,
             bounds["minimum_latitude"], bounds["maximum_latitude"],
             bounds["minimum_longitude"], bounds["maximum_longitude"],
             self.domain["rotation_axis"], self.domain["rotation_angle"])
 
-        events = self.get_all_events()
-        visualization.plot_events(events, map_object=map)
+        visualization.plot_events(event_infos.values(), map_object=map)
 
         plt.tight_layout()
 
@@ -491,34 +503,18 @@ class Project(object):
     def get_event_info(self, event_name):
         """
         Returns a dictionary with information about one, specific event.
-        """
-        from obspy.core.util import FlinnEngdahl
 
+        Taken from the event catalog so the QuakeML file is only parsed if it
+        changed. See EventCatalog.get_event_infos() for the keys.
+        """
         all_events = self.get_event_dict()
         if event_name not in all_events:
             msg = "Event '%s' not found in project." % event_name
             raise ValueError(msg)
-        event = self.get_event(event_name)
-        mag = event.preferred_magnitude() or event.magnitudes[0]
-        org = event.preferred_origin() or event.origins[0]
-
-        if org.depth is None:
-            warnings.warn("Origin contains no depth. Will be assumed to be 0")
-            org.depth = 0.0
-
-        if mag.magnitude_type is None:
-            warnings.warn("Magnitude has no specified type. Will be assumed "
-                "to be Mw")
-            mag.magnitude_type = "Mw"
-
-        info = {
-            "latitude": org.latitude,
-            "longitude": org.longitude,
-            "origin_time": org.time,
-            "depth_in_km": org.depth / 1000.0,
-            "magnitude": mag.mag,
-            "region": FlinnEngdahl().get_region(org.longitude, org.latitude),
-            "magnitude_type": mag.magnitude_type}
+        info = self.event_catalog.get_event_info(event_name)
+        if info is None:
+            msg = "Event '%s' could not be read." % event_name
+            raise ValueError(msg)
         return info
 
     def generate_input_files(self, event_name, template_name, simulation_type,
@@ -645,7 +641,8 @@ class Project(object):
             return self._station_cache
         self._station_cache = StationCache(os.path.join(self.paths["cache"],
             "station_cache.sqlite"), self.paths["dataless_seed"],
-            self.paths["resp"])
+            self.paths["resp"], self.paths["station_xml"],
+            update_policy="on_first_query")
         return self._station_cache
 
     @station_cache.setter
@@ -653,19 +650,62 @@ class Project(object):
         msg = "Not allowed. Please update the StationCache instance instead."
         raise Exception(msg)
 
+    @property
+    def event_catalog(self):
+        """
+        Instance wide EventCatalog with the most important information about
+        all events of the project.
+        """
+        from lasif.tools.event_catalog import EventCatalog
+        if not hasattr(self, "_event_catalog"):
+            self._event_catalog = EventCatalog(os.path.join(
+                self.paths["cache"], "event_catalog.sqlite"),
+                self.paths["events"], update_policy="on_first_query")
+        return self._event_catalog
+
+    @property
+    def response_cache(self):
+        """
+        Instance wide ResponseCache storing the parsed instrument responses
+        in the cache folder.
+        """
+        from lasif.tools.response_cache import ResponseCache
+        if not hasattr(self, "_response_cache"):
+            self._response_cache = ResponseCache(os.path.join(
+                self.paths["cache"], "responses"))
+        return self._response_cache
+
+    @property
+    def waveform_cache(self):
+        """
+        Instance wide ProjectWaveformCache indexing the waveforms of all
+        events and tags.
+        """
+        from lasif.tools.waveform_cache import ProjectWaveformCache
+        if hasattr(self, "_waveform_cache"):
+            return self._waveform_cache
+        # Waveform files are not changed in place so folders whose
+        # modification time did not change do not have to be scanned.
+        self._waveform_cache = ProjectWaveformCache(os.path.join(
+            self.paths["cache"], "waveform_cache.sqlite"), self.paths["data"],
+            update_policy="on_first_query", use_directory_mtimes=True)
+        return self._waveform_cache
+
+    @waveform_cache.setter
+    def waveform_cache(self, value):
+        msg = ("Not allowed. Please update the ProjectWaveformCache instance "
+            "instead.")
+        raise Exception(msg)
+
     def _get_waveform_cache_file(self, event_name, tag):
         """
-        Helper function returning the waveform cache file for the data from a
-        specific event and a certain tag.
+        Helper function returning the waveform cache for the data from a
+        specific event and a certain tag. It is a view of the project wide
+        waveform cache.
         Example to return the cache for the original data for 'event_1':
         _get_waveform_cache_file("event_1", "raw")
         """
-        from lasif.tools.waveform_cache import WaveformCache
-
-        waveform_db_file = os.path.join(self.paths["data"], event_name,
-            "%s_cache.sqlite" % tag)
-        data_path = os.path.join(self.paths["data"], event_name, tag)
-        return WaveformCache(waveform_db_file, data_path)
+        return self.waveform_cache.get_partition(event_name, tag)
 
     def get_stations_for_event(self, event_name):
         """
@@ -676,9 +716,37 @@ class Project(object):
         file and an existing waveform file.
 
         Will return an empty dictionary if nothing is found.
+
+        The result is memoized per event and only computed again once the
+        waveform or the station cache changed. See
+        get_station_coordinate_arrays() for the same information as arrays.
         """
-        from lasif.tools.inventory_db import get_station_coordinates
+        import numpy as np
+
+        arrays = self.get_station_coordinate_arrays(event_name)
+        stations = {}
+        for _i, station_id in enumerate(arrays["station_id"].tolist()):
+            values = [arrays[key][_i] for key in COORDINATE_KEYS]
+            values = [float(_j) if not np.isnan(_j) else None
+                for _j in values]
+            stations[str(station_id)] = {
+                "latitude": values[0],
+                "longitude": values[1],
+                "elevation": values[2],
+                "local_depth": values[3]}
+        return stations
 
+    def get_station_coordinate_arrays(self, event_name):
+        """
+        Returns the coordinates of all stations available for a given event,
+        see get_stations_for_event(), as a dictionary of column arrays with
+        the keys "station_id", "latitude", "longitude", "elevation_in_m" and
+        "local_depth_in_m". Missing values are NaN. The stations are sorted
+        by their ids.
+
+        Memoized like get_stations_for_event(). The arrays must not be
+        modified.
+        """
         all_events = self.get_event_dict()
         if event_name not in all_events:
             msg = "Event '%s' not found in project." % event_name
@@ -686,85 +754,318 @@ class Project(object):
 
         data_path = os.path.join(self.paths["data"], event_name, "raw")
         if not os.path.exists(data_path):
-            return {}
+            return _get_empty_station_arrays()
+
+        token = (self.waveform_cache.get_change_token(),
+            self.station_cache.get_change_token())
+        if not hasattr(self, "_stations_for_event"):
+            self._stations_for_event = {}
+        memoized = self._stations_for_event.get(event_name)
+        if memoized is None or memoized[0] != token:
+            arrays = self._compute_stations_for_event(event_name)
+            for value in arrays.itervalues():
+                value.flags.writeable = False
+            memoized = (token, arrays)
+            self._stations_for_event[event_name] = memoized
+        return memoized[1]
+
+    def _compute_stations_for_event(self, event_name):
+        """
+        Joins the waveform index of an event with the channels of the station
+        cache. The coordinates of a station are taken from the first waveform
+        with coordinates (in the case of SAC files), then from its channel in
+        the station cache and finally from the inventory database.
+        """
+        from lasif.tools.inventory_db import \
+            get_station_coordinates_batch
+        import numpy as np
 
-        waveforms = self._get_waveform_cache_file(event_name, "raw")
+        waveforms = self._get_waveform_cache_file(event_name, "raw")\
+            .get_column_arrays(columns=["network", "station", "channel_id",
+            "latitude", "longitude", "elevation_in_m", "local_depth_in_m"])
+        channel_ids, channels = self._get_station_channels()
+        if not len(waveforms["channel_id"]) or not len(channel_ids):
+            return _get_empty_station_arrays()
+
+        # Check if a corresponding station file exists for every waveform.
+        index = np.searchsorted(channel_ids, waveforms["channel_id"])
+        index[index == len(channel_ids)] = 0
+        has_station_file = channel_ids[index] == waveforms["channel_id"]
+
+        def has_coordinates(latitudes):
+            return ~np.isnan(latitudes) & (latitudes != 0.0)
+
+        from_waveform = has_station_file & \
+            has_coordinates(waveforms["latitude"])
+        from_channel = has_station_file & ~from_waveform & \
+            has_coordinates(channels["latitude"][index])
+        station_ids = np.char.add(np.char.add(waveforms["network"], u"."),
+            waveforms["station"])
+
+        # The first waveform with coordinates of every station.
+        resolved = np.nonzero(from_waveform | from_channel)[0]
+        resolved = resolved[np.unique(station_ids[resolved],
+            return_index=True)[1]]
+        stations = {"station_id": station_ids[resolved]}
+        for key in COORDINATE_KEYS:
+            stations[key] = np.where(from_waveform, waveforms[key],
+                channels[key][index])[resolved].astype(np.float64)
+
+        # Now check if the station coordinates of the remaining stations are
+        # available in the inventory DB and use those.
+        missing = np.nonzero(has_station_file)[0]
+        missing = missing[np.unique(station_ids[missing],
+            return_index=True)[1]]
+        missing = missing[~np.in1d(station_ids[missing],
+            stations["station_id"])]
+        if not len(missing):
+            return stations
+
+        all_coords = get_station_coordinates_batch(
+            self.paths["inv_db_file"],
+            [str(_i) for _i in station_ids[missing]])
+        found = []
+        for _i in missing.tolist():
+            coords = all_coords[str(station_ids[_i])]
+            if coords:
+                found.append((station_ids[_i], coords))
+            else:
+                msg = "No coordinates available for waveform file '%s'" % \
+                    waveforms["filename"][_i]
+                warnings.warn(msg)
+        if not found:
+            return stations
+        stations["station_id"] = np.concatenate([stations["station_id"],
+            np.array([_i[0] for _i in found], dtype=station_ids.dtype)])
+        for key in COORDINATE_KEYS:
+            stations[key] = np.concatenate([stations[key], np.array(
+                [_i[1][key] for _i in found], dtype=np.float64)])
+        order = np.argsort(stations["station_id"])
+        return {key: value[order] for key, value in stations.iteritems()}
+
+    def _get_station_channels(self):
+        """
+        Returns the sorted unique channel ids of the station cache and a
+        dictionary of coordinate arrays with the coordinates of the first
+        epoch of every channel. Memoized until the station cache changes.
+        """
+        import numpy as np
+
+        token = self.station_cache.get_change_token()
+        memoized = getattr(self, "_station_channels", None)
+        if memoized is not None and memoized[0] == token:
+            return memoized[1]
+
+        channels = self.station_cache.get_column_arrays(columns=[
+            "channel_id", "latitude", "longitude", "elevation_in_m",
+            "local_depth_in_m"])
+        channel_ids, first_index = np.unique(channels.pop("channel_id"),
+            return_index=True)
+        channels.pop("filename")
+        channels = {key: value[first_index] for key, value in
+            channels.iteritems()}
+        self._station_channels = (token, (channel_ids, channels))
+        return channel_ids, channels
+
+    def _get_synthetics_index(self, event_name, synthetic_tag):
+        """
+        Returns a dictionary mapping the station ids to dictionaries mapping
+        the components to the synthetic files of an event and tag. The index
+        is stored in the cache folder and only built again once files are
+        added or removed.
+        """
+        from lasif.tools.synthetics_index import get_synthetics_index
+
+        return get_synthetics_index(os.path.join(self.paths["synthetics"],
+            event_name, synthetic_tag), os.path.join(self.paths["cache"],
+            "synthetics_index"))
+
+    def _get_synthetic_time_axis(self, event_name, synthetic_tag):
+        """
+        Returns the time axis of the synthetics as a tuple (starttime, npts,
+        delta) or None if there are no synthetics. All synthetics of an
+        event and tag share the same time axis starting at the origin time of
+        the event.
+        """
+        from obspy import read
+
+        filenames = sorted(glob.glob(os.path.join(self.paths["synthetics"],
+            event_name, synthetic_tag, "*")))
+        if not filenames:
+            return None
+        synthetic = read(filenames[0], headonly=True)[0]
+        return (self.get_event_info(event_name)["origin_time"],
+            synthetic.stats.npts, synthetic.stats.delta)
+
+    def preprocess_data(self, event_name, data_tag, synthetic_tag,
+            highpass=None, lowpass=None, workers=None):
+        """
+        Processes the data of all stations of an event just like
+        data_synthetic_iterator() and stores the results in
+        DATA/EVENT_NAME/processed_HASH/ with one MiniSEED file per channel.
+        The hash is derived from the data tag, the processing parameters and
+        the time axis of the synthetics. The data_synthetic_iterator() uses
+        these files if they exist. Stations processed before are skipped.
+
+        Returns a dictionary with the number of "processed", "skipped" and
+        "failed" stations.
+
+        :param event_name: The name of the event.
+        :param data_tag: The tag of the data to process, usually "raw".
+        :param synthetic_tag: The tag of the synthetics. Their time axis is
+            the one of the processed data.
+        :param highpass: The upper corner frequency of the bandpass in Hz.
+        :param lowpass: The lower corner frequency of the bandpass in Hz.
+        :param workers: The number of processes. Defaults to the number of
+            CPUs.
+        """
+        from lasif import preprocessing
+        import multiprocessing
 
-        # Query the station cache for a list of all channels.
-        available_channels = self.station_cache.get_channels()
+        all_events = self.get_event_dict()
+        if event_name not in all_events:
+            msg = "Event '%s' not found in project." % event_name
+            raise ValueError(msg)
+
+        time_axis = self._get_synthetic_time_axis(event_name, synthetic_tag)
+        if time_axis is None:
+            msg = "No synthetics with tag '%s' found for event '%s'." % (
+                synthetic_tag, event_name)
+            raise ValueError(msg)
+        starttime, npts, delta = time_axis
+        output_folder = os.path.join(self.paths["data"], event_name,
+            preprocessing.get_processing_tag(data_tag, starttime, npts,
+            delta, highpass, lowpass))
+        if not os.path.exists(output_folder):
+            os.makedirs(output_folder)
+
+        # Resolve the station files of all channels at once.
+        waveforms = self._get_waveform_cache_file(event_name, data_tag)\
+            .get_values(columns=["network", "station", "channel_id",
+            "starttime_timestamp"])
+        station_file_blocks = self.station_cache.get_station_file_blocks(
+            [_i["channel_id"] for _i in waveforms],
+            [_i["starttime_timestamp"] for _i in waveforms])
+
+        counts = {"processed": 0, "skipped": 0, "failed": 0}
         stations = {}
-        for waveform in waveforms.get_values():
-            station = "%s.%s" % (waveform["network"], waveform["station"])
-            # Do not add if already exists.
-            if station in stations:
+        for waveform, block in zip(waveforms, station_file_blocks):
+            if block is None:
+                msg = "No station file for '%s'." % waveform["channel_id"]
+                warnings.warn(msg)
                 continue
-            # Check if a corresponding station file exists, otherwise skip.
-            chan_id = waveform["channel_id"]
-            if chan_id not in available_channels:
+            station_id = "%s.%s" % (waveform["network"], waveform["station"])
+            stations.setdefault(station_id, {})[waveform["channel_id"]] = \
+                (waveform["filename"], block[0], block[1:])
+
+        tasks = []
+        for station_id, channels in sorted(stations.iteritems()):
+            # Processed again if the waveform or station file changed.
+            if all(preprocessing.is_processed(output_folder, key,
+                    value[0], value[1]) for key, value in
+                    channels.iteritems()):
+                counts["skipped"] += 1
                 continue
-            waveform_channel = available_channels[chan_id][0]
-            # Now check if the waveform has coordinates (in the case of SAC
-            # files).
-            if waveform["latitude"]:
-                stations[station] = {
-                    "latitude": waveform["latitude"],
-                    "longitude": waveform["longitude"],
-                    "elevation": waveform["elevation_in_m"],
-                    "local_depth": waveform["local_depth_in_m"]}
-            elif waveform_channel["latitude"]:
-                stations[station] = {
-                    "latitude": waveform_channel["latitude"],
-                    "longitude": waveform_channel["longitude"],
-                    "elevation": waveform_channel["elevation_in_m"],
-                    "local_depth": waveform_channel["local_depth_in_m"]}
-            else:
-                # Now check if the station_coordinates are available in the
-                # inventory DB and use those.
-                coords = get_station_coordinates(self.paths["inv_db_file"],
-                    station)
-
-                if coords:
-                    stations[station] = {
-                        "latitude": coords["latitude"],
-                        "longitude": coords["longitude"],
-                        "elevation": coords["elevation_in_m"],
-                        "local_depth": coords["local_depth_in_m"]}
-                else:
-                    msg = "No coordinates available for waveform file '%s'" % \
-                        waveform["filename"]
-                    warnings.warn(msg)
+            tasks.append({
+                "station_id": station_id,
+                "channels": channels.values(),
+                "output_folder": output_folder,
+                "response_cache_folder": os.path.join(self.paths["cache"],
+                    "responses"),
+                "starttime": starttime,
+                "npts": npts,
+                "delta": delta,
+                "highpass": highpass,
+                "lowpass": lowpass})
+
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if workers > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(workers, len(tasks)))
+            try:
+                results = list(pool.imap_unordered(
+                    preprocessing.preprocess_station, tasks))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = map(preprocessing.preprocess_station, tasks)
 
-        return stations
+        for station_id, _, error in results:
+            if error is None:
+                counts["processed"] += 1
+                continue
+            counts["failed"] += 1
+            msg = "Could not process station '%s': %s" % (station_id, error)
+            warnings.warn(msg)
+        # Index the new files.
+        if counts["processed"]:
+            self.waveform_cache.update()
+        return counts
 
     def data_synthetic_iterator(self, event_name, data_tag, synthetic_tag,
             highpass, lowpass):
-        from lasif import rotations
-        import numpy as np
-        from obspy import read, Stream, UTCDateTime
-        from obspy.xseed import Parser
-        from scipy.interpolate import interp1d
+        import copy
+        from itertools import izip
+        from lasif import preprocessing, rotations
+        from lasif.tools import signal_processing
+        from lasif.tools.instrument_correction import InstrumentCorrector
+        from lasif.tools.prefetcher import Prefetcher
+        from lasif.tools.resampling import Resampler
+        from obspy import read, Stream
+        import threading
 
         event_info = self.get_event_info(event_name)
 
         stations = self.get_stations_for_event(event_name)
-        waveforms = \
-            self._get_waveform_cache_file(event_name, data_tag).get_values()
+        waveforms = self._get_waveform_cache_file(event_name, data_tag)
 
-        synthetics_path = os.path.join(self.paths["synthetics"], event_name,
+        # Maps the station ids to the synthetics of all components.
+        synthetic_files = self._get_synthetics_index(event_name,
             synthetic_tag)
-        synthetic_files = {os.path.basename(_i).replace("_", ""): _i for _i in
-            glob.iglob(os.path.join(synthetics_path, "*"))}
 
         SYNTH_MAPPING = {"X": "N", "Y": "E", "Z": "Z"}
 
         station_cache = self.station_cache
+        response_cache = self.response_cache
+        # Caches the inverted responses for the lifetime of the iterator.
+        instrument_corrector = InstrumentCorrector()
+        resampler = Resampler()
+        correction_lock = threading.Lock()
+
+        # The data processed by preprocess_data() with the same parameters.
+        processed_folder = None
+        time_axis = self._get_synthetic_time_axis(event_name, synthetic_tag)
+        if time_axis is not None:
+            processed_folder = os.path.join(self.paths["data"], event_name,
+                preprocessing.get_processing_tag(data_tag,
+                *(time_axis + (highpass, lowpass))))
+            if not os.path.isdir(processed_folder):
+                processed_folder = None
 
         class TwoWayIter(object):
-            def __init__(self, rot_angle=0.0, rot_axis=[0.0, 0.0, 1.0]):
+            """
+            Iterates over the stations in both directions. While a station
+            is looked at, its neighbours are processed in background threads
+            so moving to them is usually instantaneous.
+
+            :param prefetch_count: The number of stations prepared in each
+                direction.
+            :param max_workers: The number of background threads.
+            """
+            def __init__(self, rot_angle=0.0, rot_axis=[0.0, 0.0, 1.0],
+                    prefetch_count=3, max_workers=2):
                 self.items = stations.items()
                 self.current_index = -1
                 self.rot_angle = rot_angle
                 self.rot_axis = rot_axis
+                self.prefetch_count = prefetch_count
+                # The files of every station. Only queried in this thread as
+                # SQLite connections cannot be shared between threads.
+                self._station_files = {}
+                self._prefetcher = Prefetcher(self._process,
+                    max_workers=max_workers,
+                    max_results=2 * prefetch_count + 2)
 
             def next(self):
                 self.current_index += 1
@@ -781,21 +1082,64 @@ class Project(object):
                 return self.get_value()
 
             def get_value(self):
-                station_id, coordinates = self.items[self.current_index]
+                index = self.current_index
+                station_files = self._get_station_files(index)
+                if station_files is None:
+                    value = None
+                else:
+                    value = self._prefetcher.get(index, station_files)
+
+                # Prepare the neighbours, the next ones first. Everything
+                # else still queued is cancelled.
+                tasks = []
+                for offset in xrange(1, self.prefetch_count + 1):
+                    for neighbour in (index + offset, index - offset):
+                        if not 0 <= neighbour < len(self.items):
+                            continue
+                        neighbour_files = self._get_station_files(neighbour)
+                        if neighbour_files is not None:
+                            tasks.append((neighbour, neighbour_files))
+                self._prefetcher.prefetch(tasks)
+
+                # The cached result must not be modified.
+                return copy.deepcopy(value)
+
+            def close(self):
+                """
+                Stops the background threads.
+                """
+                self._prefetcher.close()
+
+            def _get_station_files(self, index):
+                if index not in self._station_files:
+                    self._station_files[index] = \
+                        self._query_station_files(index)
+                return self._station_files[index]
+
+            def _query_station_files(self, index):
+                """
+                Returns the station id, the coordinates, the waveform
+                information including the station files, the synthetics
+                filenames of a station and whether or not processed data is
+                available or None if something is missing.
+                """
+                station_id, coordinates = self.items[index]
 
-                data = Stream()
                 # Now get the actual waveform files. Also find the
                 # corresponding station file and check the coordinates.
-                this_waveforms = {_i["channel_id"]: _i for _i in waveforms
-                    if _i["channel_id"].startswith(station_id + ".")}
+                network, station = station_id.split(".")
+                this_waveforms = {_i["channel_id"]: _i for _i in
+                    waveforms.iter_values(network=network, station=station)}
+                # Resolve the station files of all channels at once.
+                station_file_blocks = station_cache.get_station_file_blocks(
+                    [_i["channel_id"] for _i in this_waveforms.itervalues()],
+                    [_i["starttime_timestamp"] for _i in
+                     this_waveforms.itervalues()])
                 marked_for_deletion = []
-                for key, value in this_waveforms.iteritems():
-                    value["trace"] = read(value["filename"])[0]
-                    data += value["trace"]
-                    value["station_file"] = \
-                        station_cache.get_station_filename(
-                            value["channel_id"],
-                            UTCDateTime(value["starttime_timestamp"]))
+                for (key, value), block in izip(
+                        this_waveforms.iteritems(), station_file_blocks):
+                    value["station_file"] = block[0] \
+                        if block is not None else None
                     if value["station_file"] is None:
                         marked_for_deletion.append(key)
                         msg = ("Warning: Data and station information for '%s'"
@@ -804,7 +1148,7 @@ class Project(object):
                                "and retrieve the correct station file.")
                         warnings.warn(msg % value["channel_id"])
                         continue
-                    data[-1].stats.station_file = value["station_file"]
+                    value["station_file_block"] = block[1:]
                 for key in marked_for_deletion:
                     del this_waveforms[key]
                 if not this_waveforms:
@@ -813,10 +1157,8 @@ class Project(object):
                     warnings.warn(msg)
                     return None
                 # Now attempt to get the synthetics.
-                synthetics_filenames = []
-                for name, path in synthetic_files.iteritems():
-                    if (station_id + ".") in name:
-                        synthetics_filenames.append(path)
+                synthetics_filenames = [_i[1] for _i in sorted(
+                    synthetic_files.get(station_id, {}).iteritems())]
 
                 if len(synthetics_filenames) != 3:
                     msg = "Found %i not 3 synthetics for station '%s'." % (
@@ -824,6 +1166,37 @@ class Project(object):
                     warnings.warn(msg)
                     return None
 
+                # Use the results of preprocess_data() if all channels have
+                # been processed with the same parameters from the current
+                # waveform and station files.
+                is_processed = processed_folder is not None and all(
+                    preprocessing.is_processed(processed_folder, key,
+                        value["filename"], value["station_file"])
+                    for key, value in this_waveforms.iteritems())
+                if is_processed:
+                    for key, value in this_waveforms.iteritems():
+                        value["processed_filename"] = \
+                            preprocessing.get_processed_filename(
+                                processed_folder, key)
+                return (station_id, coordinates, this_waveforms.values(),
+                    synthetics_filenames, is_processed)
+
+            def _process(self, station_id, coordinates, this_waveforms,
+                    synthetics_filenames, is_processed):
+                """
+                Reads and processes the data and synthetics of a station.
+                Usually runs in a background thread.
+                """
+                data = Stream()
+                for value in this_waveforms:
+                    if is_processed:
+                        data += read(value["processed_filename"])[0]
+                        continue
+                    data += read(value["filename"])[0]
+                    data[-1].stats.station_file = value["station_file"]
+                    data[-1].stats.station_file_block = \
+                        value["station_file_block"]
+
                 synthetics = Stream()
                 # Read all synthetics.
                 for filename in synthetics_filenames:
@@ -834,80 +1207,16 @@ class Project(object):
                     synth.stats.channel = SYNTH_MAPPING[synth.stats.channel]
                     synth.stats.starttime = event_info["origin_time"]
 
-                # Process the data.
-                len_synth = synthetics[0].stats.endtime - \
-                    synthetics[0].stats.starttime
-                data.trim(synthetics[0].stats.starttime - len_synth * 0.05,
-                    synthetics[0].stats.endtime + len_synth * 0.05)
-                if data:
-                    max_length = max([tr.stats.npts for tr in data])
-                else:
-                    max_length = 0
-                if max_length == 0:
-                    msg = ("Warning: After trimming the waveform data to "
-                        "the time window of the synthetics, no more data is "
-                        "left. The reference time is the one given in the "
-                        "QuakeML file. Make sure it is correct and that "
-                        "the waveform data actually contains data in that "
-                        "time span.")
-                    warnings.warn(msg)
-                data.detrend("linear")
-                data.taper()
-
-                new_time_array = np.linspace(
-                    synthetics[0].stats.starttime.timestamp,
-                    synthetics[0].stats.endtime.timestamp,
-                    synthetics[0].stats.npts)
-
-                # Simulate the traces.
-                for trace in data:
-                    # Decimate in case there is a large difference between
-                    # synthetic sampling rate and sampling_rate of the data.
-                    # XXX: Ugly filter, change!
-                    if trace.stats.sampling_rate > (6 *
-                            synth.stats.sampling_rate):
-                        new_nyquist = trace.stats.sampling_rate / 2.0 / 5.0
-                        trace.filter("lowpass", freq=new_nyquist, corners=4,
-                            zerophase=True)
-                        trace.decimate(factor=5, no_filter=None)
-
-                    station_file = trace.stats.station_file
-                    if "/SEED/" in station_file:
-                        paz = Parser(station_file).getPAZ(trace.id,
-                            trace.stats.starttime)
-                        trace.simulate(paz_remove=paz)
-                    elif "/RESP/" in station_file:
-                        trace.simulate(seedresp={"filename": station_file,
-                            "units": "VEL", "date": trace.stats.starttime})
-                    else:
-                        raise NotImplementedError
-
-                    # Make sure that the data array is at least as long as the
-                    # synthetics array. Also add some buffer sample for the
-                    # spline interpolation to work in any case.
-                    buf = synth.stats.delta * 5
-                    if synth.stats.starttime < (trace.stats.starttime + buf):
-                        trace.trim(starttime=synth.stats.starttime - buf,
-                            pad=True, fill_value=0.0)
-                    if synth.stats.endtime > (trace.stats.endtime - buf):
-                        trace.trim(endtime=synth.stats.endtime + buf, pad=True,
-                            fill_value=0.0)
-
-                    old_time_array = np.linspace(
-                        trace.stats.starttime.timestamp,
-                        trace.stats.endtime.timestamp,
-                        trace.stats.npts)
-
-                    # Interpolation.
-                    trace.data = interp1d(old_time_array, trace.data,
-                        kind=1)(new_time_array)
-                    trace.stats.starttime = synthetics[0].stats.starttime
-                    trace.stats.sampling_rate = \
-                        synthetics[0].stats.sampling_rate
-
-                data.filter("bandpass", freqmin=lowpass, freqmax=highpass)
-                synthetics.filter("bandpass", freqmin=lowpass,
-                    freqmax=highpass)
+                # Process the data unless it has already been processed.
+                if not is_processed:
+                    preprocessing.preprocess_traces(data,
+                        synthetics[0].stats.starttime,
+                        synthetics[0].stats.npts, synthetics[0].stats.delta,
+                        highpass, lowpass, response_cache,
+                        instrument_corrector, resampler, correction_lock)
+                # Filtered just like the data.
+                signal_processing.filter_traces(synthetics, "bandpass",
+                    freqmin=lowpass, freqmax=highpass, zerophase=True)
 
                 # Rotate the synthetics if nessesary.
                 if self.rot_angle:
@@ -938,3 +1247,25 @@ class Project(object):
         it's filename actually has a corresponding station file.
         """
         return self.station_cache.station_info_available(channel_id, time)
+
+    def has_station_files(self, channel_ids, times):
+        """
+        Checks for many channels at once if they have a corresponding
+        station file. Returns a list of booleans.
+
+        :param channel_ids: The channel ids.
+        :param times: One time per channel id or a single time for all of
+            them.
+        """
+        return self.station_cache.station_infos_available(channel_ids, times)
+
+
+def _get_empty_station_arrays():
+    """
+    Returns the station coordinate arrays without any station.
+    """
+    import numpy as np
+
+    arrays = {key: np.empty(0, dtype=np.float64) for key in COORDINATE_KEYS}
+    arrays["station_id"] = np.empty(0, dtype="U1")
+    return arrays
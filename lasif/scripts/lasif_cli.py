@@ -207,8 +207,10 @@ def lasif_download_stations(args):
     channels_to_download = []
 
     # Filter for channel not actually available
-    for channel in channels:
-        if proj.has_station_file(channel["channel_id"], time):
+    available = proj.has_station_files([_i["channel_id"] for _i in channels],
+        time)
+    for channel, is_available in zip(channels, available):
+        if is_available:
             continue
         channels_to_download.append(channel)
 
@@ -521,6 +523,69 @@ def lasif_launch_misfit_gui(args):
         event_name)
 
     MisfitGUI(event, iterator, proj, window_manager)
+    # Stop preparing stations once the window is closed.
+    iterator.close()
+
+
+def lasif_preprocess_data(args):
+    """
+    Usage: lasif preprocess_data EVENT_NAME DATA_TAG SYNTHETIC_TAG
+                                 [--highpass=HP] [--lowpass=LP] [--workers=N]
+
+    Processes the data with the tag DATA_TAG, usually "raw", of all stations
+    of an event for the comparison with the synthetics of the given tag and
+    stores it in DATA/EVENT_NAME/processed_HASH. The Misfit GUI uses it if it
+    has been processed with the same DATA_TAG, HP and LP. EVENT_NAME can
+    also be "all" to process all events.
+
+    HP and LP are the high- and lowpass filter values in seconds, just like
+    for the Misfit GUI. N is the number of processes and defaults to the
+    number of CPUs.
+    """
+    import getopt
+
+    try:
+        options, args = getopt.gnu_getopt(args, "",
+            ["highpass=", "lowpass=", "workers="])
+    except getopt.GetoptError as e:
+        raise LASIFCommandLineException(str(e))
+    if len(args) != 3:
+        msg = "EVENT_NAME, DATA_TAG and SYNTHETIC_TAG must be given."
+        raise LASIFCommandLineException(msg)
+    options = dict(options)
+    try:
+        highpass = 1.0 / float(options["--highpass"]) \
+            if "--highpass" in options else None
+        lowpass = 1.0 / float(options["--lowpass"]) \
+            if "--lowpass" in options else None
+        workers = int(options["--workers"]) \
+            if "--workers" in options else None
+    except ValueError as e:
+        raise LASIFCommandLineException(str(e))
+
+    proj = _find_project_root(".")
+
+    event_name, data_tag, synthetic_tag = args
+    events = proj.get_event_dict()
+    if event_name == "all":
+        event_names = sorted(events.keys())
+    elif event_name not in events:
+        msg = "Event '%s' not found." % event_name
+        raise LASIFCommandLineException(msg)
+    else:
+        event_names = [event_name]
+
+    for event_name in event_names:
+        try:
+            counts = proj.preprocess_data(event_name, data_tag,
+                synthetic_tag, highpass=highpass, lowpass=lowpass,
+                workers=workers)
+        except ValueError as e:
+            print "Skipping event '%s': %s" % (event_name, str(e))
+            continue
+        print ("Event '%s': Processed %i, skipped %i already processed and "
+            "failed to process %i station(s).") % (event_name,
+            counts["processed"], counts["skipped"], counts["failed"])
 
 
 def lasif_generate_dummy_data(args):
@@ -15,7 +15,6 @@ points in the setup.py.
 """
 import numpy as np
 from obspy.core import AttribDict, Trace, Stream
-from StringIO import StringIO
 import warnings
 
 from lasif import rotations
@@ -53,7 +52,7 @@ def is_SES3D(filename_or_file_object):
     return False
 
 
-def read_SES3D(file_or_file_object, *args, **kwargs):
+def read_SES3D(file_or_file_object, headonly=False, *args, **kwargs):
     """
     Turns a SES3D file into a obspy.core.Stream object.
 
@@ -75,11 +74,14 @@ def read_SES3D(file_or_file_object, *args, **kwargs):
     The network, station, and location attributes of the trace will be empty,
     and the channel will be set to either 'X' (south component), 'Y' (east
     component), or 'Z' (vertical component).
+
+    :param headonly: If True, only the header is read. The trace then has no
+        data but its stats are complete, including the number of samples.
     """
     # Make sure that it is a file like object.
     if not hasattr(file_or_file_object, "read"):
         with open(file_or_file_object, "rb") as open_file:
-            file_or_file_object = StringIO(open_file.read())
+            return read_SES3D(open_file, headonly=headonly)
 
     # Read the header.
     component = file_or_file_object.readline().split()[0].lower()
@@ -94,12 +96,15 @@ def read_SES3D(file_or_file_object, *args, **kwargs):
     src_loc = file_or_file_object.readline().split()
     src_x, src_y, src_z = map(float, [src_loc[1], src_loc[3], src_loc[5]])
 
-    # Read the data.
-    data = np.array(map(float, file_or_file_object.readlines()),
-        dtype="float32")
-
     # Setup Obspy Stream/Trace structure.
-    tr = Trace(data=data)
+    if headonly:
+        tr = Trace(header={"npts": npts})
+    else:
+        # Parse all samples at once. Converting to double precision first
+        # rounds exactly like float() does.
+        data = np.fromstring(file_or_file_object.read(), dtype=np.float64,
+            sep=" ").astype(np.float32)
+        tr = Trace(data=data)
     tr.stats.delta = delta
     # Map the channel attributes.
     tr.stats.channel = {"theta": "X",
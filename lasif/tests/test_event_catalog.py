@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test suite for the event catalog.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+from obspy import UTCDateTime
+from obspy.core.event import Catalog, Event, FocalMechanism, Magnitude, \
+    MomentTensor, Origin, Tensor
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+
+from lasif.tools import event_catalog
+from lasif.tools.event_catalog import EventCatalog
+
+
+def _write_event(filename, latitude, longitude, depth=10000.0,
+        moment_tensor=True):
+    event = Event()
+    event.origins.append(Origin(latitude=latitude, longitude=longitude,
+        depth=depth, time=UTCDateTime(2012, 4, 12, 7, 15, 48, 500000)))
+    event.magnitudes.append(Magnitude(mag=6.1, magnitude_type="Mwc"))
+    if moment_tensor:
+        event.focal_mechanisms.append(FocalMechanism(
+            moment_tensor=MomentTensor(tensor=Tensor(m_rr=1.0, m_tt=2.0,
+            m_pp=3.0, m_rt=4.0, m_rp=5.0, m_tp=6.0))))
+    Catalog(events=[event]).write(filename, format="QUAKEML")
+
+
+class EventCatalogTest(unittest.TestCase):
+    """
+    Tests for the event catalog.
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.events_folder = os.path.join(self.directory, "EVENTS")
+        os.makedirs(self.events_folder)
+        self.cache_file = os.path.join(self.directory, "catalog.sqlite")
+        self._extract = EventCatalog._extract_index_values_quakeml
+
+    def tearDown(self):
+        EventCatalog._extract_index_values_quakeml = self._extract
+        shutil.rmtree(self.directory)
+
+    def test_event_catalog(self):
+        """
+        The catalog contains the information of all events and only parses
+        new or changed files.
+        """
+        parsed_files = []
+        extract = self._extract
+
+        def extract_index_values(self, filename):
+            parsed_files.append(os.path.basename(filename))
+            return extract(self, filename)
+        EventCatalog._extract_index_values_quakeml = extract_index_values
+
+        _write_event(os.path.join(self.events_folder, "event_1.xml"),
+            45.0, 10.0)
+        _write_event(os.path.join(self.events_folder, "event_2.xml"),
+            -20.0, -70.0, depth=None, moment_tensor=False)
+        with open(os.path.join(self.events_folder, "broken.xml"), "wt") as \
+                open_file:
+            open_file.write("not QuakeML")
+
+        with warnings.catch_warnings(record=True):
+            warnings.simplefilter("always")
+            catalog = EventCatalog(self.cache_file, self.events_folder)
+        self.assertEqual(sorted(parsed_files),
+            ["broken.xml", "event_1.xml", "event_2.xml"])
+        # Unreadable files are still part of the project.
+        self.assertEqual(sorted(catalog.get_event_filenames().keys()),
+            ["broken", "event_1", "event_2"])
+        self.assertEqual(catalog.get_event_filenames()["event_1"],
+            os.path.join(self.events_folder, "event_1.xml"))
+
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            infos = catalog.get_event_infos()
+        self.assertEqual(sorted(infos.keys()), ["event_1", "event_2"])
+        self.assertEqual(len(w), 1)
+        self.assertTrue("no depth" in str(w[0].message))
+
+        info = infos["event_1"]
+        self.assertEqual(info["latitude"], 45.0)
+        self.assertEqual(info["longitude"], 10.0)
+        self.assertEqual(info["depth_in_km"], 10.0)
+        self.assertEqual(info["origin_time"],
+            UTCDateTime(2012, 4, 12, 7, 15, 48, 500000))
+        self.assertEqual(info["magnitude"], 6.1)
+        self.assertEqual(info["magnitude_type"], "Mwc")
+        self.assertEqual(info["region"],
+            event_catalog.get_flinn_engdahl_region(45.0, 10.0))
+        self.assertEqual(info["moment_tensor"],
+            [1.0, 2.0, 3.0, 4.0, 5.0, 6.0])
+        self.assertEqual(infos["event_2"]["depth_in_km"], 0.0)
+        self.assertEqual(infos["event_2"]["moment_tensor"], None)
+        self.assertEqual(catalog.get_event_info("event_1"), info)
+        self.assertEqual(catalog.get_event_info("event_3"), None)
+
+        # Unchanged files are not parsed again, changed ones are.
+        del catalog
+        parsed_files = []
+        os.remove(os.path.join(self.events_folder, "broken.xml"))
+        _write_event(os.path.join(self.events_folder, "event_1.xml"),
+            46.0, 11.0)
+        catalog = EventCatalog(self.cache_file, self.events_folder)
+        self.assertEqual(parsed_files, ["event_1.xml"])
+        self.assertEqual(sorted(catalog.get_event_filenames().keys()),
+            ["event_1", "event_2"])
+        self.assertEqual(catalog.get_event_info("event_1")["latitude"],
+            46.0)
+
+        # Events added after the first query are found as well.
+        catalog = EventCatalog(self.cache_file, self.events_folder,
+            update_policy="on_first_query")
+        self.assertEqual(len(catalog.get_event_infos()), 2)
+        _write_event(os.path.join(self.events_folder, "event_3.xml"),
+            0.0, 0.0)
+        self.assertEqual(sorted(catalog.get_event_infos().keys()),
+            ["event_1", "event_2", "event_3"])
+
+    def test_flinn_engdahl_singleton(self):
+        """
+        The Flinn-Engdahl regionalization is only initialized once.
+        """
+        event_catalog.get_flinn_engdahl_region(0.0, 0.0)
+        flinn_engdahl = event_catalog._FLINN_ENGDAHL
+        self.assertTrue(flinn_engdahl is not None)
+        event_catalog.get_flinn_engdahl_region(10.0, 10.0)
+        self.assertTrue(event_catalog._FLINN_ENGDAHL is flinn_engdahl)
+
+
+def suite():
+    return unittest.makeSuite(EventCatalogTest, "test")
+
+
+if __name__ == "__main__":
+    unittest.main(defaultTest="suite")
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test suite for the bulk instrument correction.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import inspect
+import numpy as np
+from obspy import Trace, UTCDateTime
+from obspy.xseed import Parser
+import os
+import unittest
+
+from lasif.tools.instrument_correction import InstrumentCorrector, \
+    _get_nfft
+
+
+# Most generic way to get the actual data directory.
+data_dir = os.path.join(os.path.dirname(os.path.abspath(
+    inspect.getfile(inspect.currentframe()))), "data")
+
+
+def _get_trace(seed_id, npts, sampling_rate, seed=0):
+    network, station, location, channel = seed_id.split(".")
+    np.random.seed(seed)
+    return Trace(data=np.random.randn(npts).cumsum(), header={
+        "network": network, "station": station, "location": location,
+        "channel": channel, "sampling_rate": sampling_rate,
+        "starttime": UTCDateTime(2012, 1, 1)})
+
+
+class InstrumentCorrectorTest(unittest.TestCase):
+    """
+    Tests for the instrument corrector.
+    """
+    def test_identical_to_simulate(self):
+        """
+        The results are identical to the ones of Trace.simulate() for
+        stacks of traces with different responses and lengths.
+        """
+        seed_file = os.path.join(data_dir, "dataless.BW_FURT")
+        resp_file = os.path.join(data_dir, "RESP.G.FDF.00.BHE")
+        paz = Parser(seed_file).getPAZ("BW.FURT..EHZ",
+            UTCDateTime(2012, 1, 1))
+
+        traces = [
+            _get_trace("BW.FURT..EHZ", 1000, 20.0, 0),
+            _get_trace("BW.FURT..EHZ", 1000, 20.0, 1),
+            _get_trace("G.FDF.00.BHE", 1000, 20.0, 2),
+            _get_trace("BW.FURT..EHZ", 777, 20.0, 3),
+            _get_trace("G.FDF.00.BHE", 1000, 10.0, 4)]
+        responses = [{"paz": paz}, {"paz": paz},
+            {"seedresp": {"filename": resp_file, "units": "VEL"}},
+            {"paz": paz},
+            {"seedresp": {"filename": resp_file, "units": "VEL"}}]
+
+        for pre_filt in (None, (0.01, 0.02, 4.0, 5.0)):
+            expected = []
+            for trace, response in zip(traces, responses):
+                trace = trace.copy()
+                if "paz" in response:
+                    trace.simulate(paz_remove=paz, pre_filt=pre_filt)
+                else:
+                    trace.simulate(seedresp=dict(response["seedresp"]),
+                        pre_filt=pre_filt)
+                expected.append(trace.data)
+
+            corrector = InstrumentCorrector(pre_filt=pre_filt)
+            corrected = [_i.copy() for _i in traces]
+            corrector.correct_traces(corrected, responses)
+            for trace, data in zip(corrected, expected):
+                np.testing.assert_allclose(trace.data, data, rtol=1E-7,
+                    atol=1E-7 * np.abs(data).max())
+            # One evaluation per unique response, number of samples and
+            # sampling rate.
+            self.assertEqual(len(corrector._responses), 4)
+
+    def test_cache_size(self):
+        """
+        The number of cached responses is limited.
+        """
+        paz = {"poles": [-4.44 + 4.44j, -4.44 - 4.44j], "zeros": [0j, 0j],
+            "gain": 0.4, "sensitivity": 1.0}
+        corrector = InstrumentCorrector(max_cached_responses=2)
+        for npts in (100, 200, 300, 100):
+            corrector.remove_response(np.ones((3, npts)), 10.0,
+                [{"paz": paz}] * 3)
+        self.assertEqual(len(corrector._responses), 2)
+        self.assertEqual([_i[1] for _i in corrector._responses.keys()],
+            [_get_nfft(300), _get_nfft(100)])
+
+    def test_resp_blocks(self):
+        """
+        Evaluating just the block of a channel gives the same result as the
+        whole RESP file.
+        """
+        from lasif.tools import simple_resp_parser
+
+        resp_file = os.path.join(data_dir, "RESP.AF.DODT..BHE")
+        channel = simple_resp_parser.get_inventory(resp_file,
+            remove_duplicates=True, include_offsets=True)[0]
+        trace = _get_trace("AF.DODT..BHE", 1000, 20.0)
+        expected = trace.copy()
+        expected.simulate(seedresp={"filename": resp_file, "units": "VEL"})
+
+        corrector = InstrumentCorrector()
+        corrector.correct_traces([trace], [{"seedresp": {
+            "filename": resp_file, "units": "VEL",
+            "offset": channel["offset"], "length": channel["length"]}}])
+        np.testing.assert_allclose(trace.data, expected.data, rtol=1E-7,
+            atol=1E-7 * np.abs(expected.data).max())
+
+
+def suite():
+    return unittest.makeSuite(InstrumentCorrectorTest, "test")
+
+
+if __name__ == "__main__":
+    unittest.main(defaultTest="suite")
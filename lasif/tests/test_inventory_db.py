@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test suite for the inventory database.
+
+The downloads are tested against a small local stand-in for an FDSN station
+web service.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import BaseHTTPServer
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+import urlparse
+
+from lasif.tools import inventory_db
+from lasif.tools.inventory_db import get_station_coordinates, \
+    get_station_coordinates_batch
+
+
+# The stations known to the local web service.
+STATIONS = {
+    "IU.PAB": (39.5446, -4.3499, 950.0),
+    "IU.ANMO": (34.94591, -106.4572, 1850.0),
+    "IU.KONO": (59.6491, 9.5982, 216.0),
+    "BW.FURT": (48.162899, 11.2752, 565.0)}
+
+# Local depths of the stations for which the web service returns a channel.
+DEPTHS = {
+    "IU.ANMO": 57.0}
+
+# Networks for which the local web service misbehaves. Maps the network code
+# to the status code and the body of the response.
+ERROR_RESPONSES = {
+    "RL": (429, "Too many requests"),
+    "DN": (403, "Forbidden"),
+    "HT": (200, "<html><body>Service unavailable</body></html>"),
+    "EM": (204, "")}
+
+
+class FDSNStationHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        query = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+        self.server.requests.append(query)
+        network = query["network"][0]
+        if network in ERROR_RESPONSES:
+            status_code, content = ERROR_RESPONSES[network]
+            self.send_response(status_code)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+            return
+        stations = [_i for _i in query["station"][0].split(",")
+            if "%s.%s" % (network, _i) in STATIONS]
+        if not stations:
+            self.send_response(404)
+            self.end_headers()
+            return
+        station_xml = "".join(
+            "<Station code='%s'><Latitude>%f</Latitude>"
+            "<Longitude>%f</Longitude><Elevation>%f</Elevation>%s</Station>" %
+            ((_i,) + STATIONS["%s.%s" % (network, _i)] + (
+                "<Channel code='BHZ'><Depth>%f</Depth></Channel>" %
+                DEPTHS["%s.%s" % (network, _i)]
+                if "%s.%s" % (network, _i) in DEPTHS else "",))
+            for _i in stations)
+        content = ("<?xml version='1.0' encoding='UTF-8'?>"
+            "<FDSNStationXML xmlns='http://www.fdsn.org/xml/station/1'>"
+            "<Network code='%s'>%s</Network></FDSNStationXML>") % (
+            network, station_xml)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class InventoryDBTest(unittest.TestCase):
+    """
+    Tests for the inventory database.
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.directory, "inventory_db.sqlite")
+        self.server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0),
+            FDSNStationHandler)
+        self.server.requests = []
+        self.url = "http://127.0.0.1:%i/fdsnws/station/1/query" % \
+            self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def test_batched_downloads(self):
+        """
+        Missing stations are requested in groups per network and cached.
+        """
+        station_ids = ["IU.PAB", "IU.ANMO", "IU.KONO", "BW.FURT", "BW.ABCD"]
+        coordinates = get_station_coordinates_batch(self.db_file,
+            station_ids, url=self.url, stations_per_request=2)
+        self.assertEqual(sorted(coordinates.keys()), sorted(station_ids))
+        self.assertEqual(coordinates["BW.ABCD"], None)
+        for station_id, (lat, lng, ele) in STATIONS.iteritems():
+            self.assertAlmostEqual(coordinates[station_id]["latitude"], lat)
+            self.assertAlmostEqual(coordinates[station_id]["longitude"], lng)
+            self.assertAlmostEqual(coordinates[station_id]["elevation_in_m"],
+                ele)
+        # Two requests for the three IU stations and one for BW.
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(sorted(_i["station"][0] for _i in
+            self.server.requests), ["ABCD,FURT", "ANMO,KONO", "PAB"])
+
+        # Everything, including the negative result, is now cached.
+        self.assertEqual(get_station_coordinates_batch(self.db_file,
+            station_ids, url=self.url), coordinates)
+        self.assertEqual(get_station_coordinates(self.db_file, "IU.PAB"),
+            coordinates["IU.PAB"])
+        self.assertEqual(len(self.server.requests), 3)
+
+        # Negative results expire.
+        get_station_coordinates_batch(self.db_file, station_ids,
+            url=self.url, negative_ttl=0.0)
+        self.assertEqual(len(self.server.requests), 4)
+        self.assertEqual(self.server.requests[-1]["station"], ["ABCD"])
+
+    def test_missing_depth(self):
+        """
+        Stations without a depth are stored as NULL and returned as None.
+        """
+        station_ids = ["IU.PAB", "IU.ANMO"]
+        for _ in xrange(2):
+            coordinates = get_station_coordinates_batch(self.db_file,
+                station_ids, url=self.url)
+            self.assertEqual(coordinates["IU.PAB"]["local_depth_in_m"], None)
+            self.assertEqual(coordinates["IU.ANMO"]["local_depth_in_m"],
+                57.0)
+        # The second time everything came from the database.
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(get_station_coordinates(self.db_file,
+            "IU.PAB")["local_depth_in_m"], None)
+        conn = sqlite3.connect(self.db_file)
+        self.assertEqual(conn.execute("SELECT depth FROM stations WHERE "
+            "station_name = 'IU.PAB';").fetchone(), (None,))
+        conn.close()
+
+    def test_failed_requests_are_not_cached(self):
+        """
+        Stations that could not be requested at all are not stored.
+        """
+        attempts = inventory_db.REQUEST_ATTEMPTS
+        inventory_db.REQUEST_ATTEMPTS = 1
+        try:
+            # Nothing listens on the port of a closed server.
+            server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0),
+                FDSNStationHandler)
+            url = "http://127.0.0.1:%i/query" % server.server_port
+            server.server_close()
+            self.assertEqual(get_station_coordinates_batch(self.db_file,
+                ["IU.PAB"], url=url), {"IU.PAB": None})
+        finally:
+            inventory_db.REQUEST_ATTEMPTS = attempts
+        self.assertEqual(get_station_coordinates_batch(self.db_file,
+            ["IU.PAB"], url=self.url)["IU.PAB"]["latitude"], 39.5446)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_error_responses(self):
+        """
+        Only empty responses mark stations as not existing. Rate limiting,
+        denied requests and unparsable documents are not cached.
+        """
+        attempts = inventory_db.REQUEST_ATTEMPTS
+        inventory_db.REQUEST_ATTEMPTS = 1
+        try:
+            station_ids = ["RL.A", "DN.A", "HT.A", "EM.A", "IU.PAB"]
+            coordinates = get_station_coordinates_batch(self.db_file,
+                station_ids, url=self.url)
+            self.assertEqual(coordinates["IU.PAB"]["latitude"], 39.5446)
+            for station_id in station_ids[:-1]:
+                self.assertEqual(coordinates[station_id], None)
+            self.assertEqual(len(self.server.requests), 5)
+
+            # Only the empty response has been cached.
+            get_station_coordinates_batch(self.db_file, station_ids,
+                url=self.url)
+            self.assertEqual(sorted(_i["network"][0] for _i in
+                self.server.requests[5:]), ["DN", "HT", "RL"])
+        finally:
+            inventory_db.REQUEST_ATTEMPTS = attempts
+
+    def test_old_databases(self):
+        """
+        Databases of older versions with duplicate rows are upgraded.
+        """
+        conn = sqlite3.connect(self.db_file)
+        conn.execute(inventory_db.CREATE_DB_SQL)
+        conn.executemany("INSERT INTO stations VALUES (?, ?, ?, ?, ?);", [
+            ("IU.PAB", 1.0, 2.0, 3.0, None),
+            ("IU.PAB", 39.5446, -4.3499, 950.0, None),
+            ("BW.ABCD", None, None, None, None)])
+        conn.commit()
+        conn.close()
+
+        coordinates = get_station_coordinates_batch(self.db_file,
+            ["IU.PAB", "BW.ABCD"], url=self.url)
+        self.assertEqual(coordinates["IU.PAB"]["latitude"], 39.5446)
+        self.assertEqual(coordinates["BW.ABCD"], None)
+        # Old negative results have no timestamp and are requested again.
+        self.assertEqual(len(self.server.requests), 1)
+        conn = sqlite3.connect(self.db_file)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM stations;")
+            .fetchone()[0], 2)
+        conn.close()
+
+
+def suite():
+    return unittest.makeSuite(InventoryDBTest, "test")
+
+
+if __name__ == "__main__":
+    unittest.main(defaultTest="suite")
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test suite for the prefetcher.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import threading
+import time
+import unittest
+
+from lasif.tools.prefetcher import Prefetcher
+
+
+class PrefetcherTest(unittest.TestCase):
+    """
+    Tests for the prefetcher.
+    """
+    def setUp(self):
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def square(self, value):
+        self.release.wait()
+        self.calls.append((value, threading.current_thread().name))
+        if value < 0:
+            raise ValueError("Negative value.")
+        return value ** 2
+
+    def wait_for_calls(self, count):
+        for _ in xrange(500):
+            if len(self.calls) >= count:
+                return
+            time.sleep(0.01)
+
+    def test_prefetching(self):
+        """
+        Prefetched results are computed in background threads and are then
+        returned without calling the function again.
+        """
+        prefetcher = Prefetcher(self.square, max_workers=2)
+        prefetcher.prefetch([(_i, (_i,)) for _i in xrange(4)])
+        self.wait_for_calls(4)
+        self.assertEqual(sorted(_i[0] for _i in self.calls), range(4))
+        main_thread = threading.current_thread().name
+        self.assertFalse(any(_i[1] == main_thread for _i in self.calls))
+
+        self.assertEqual([prefetcher.get(_i, (_i,)) for _i in xrange(4)],
+            [0, 1, 4, 9])
+        self.assertEqual(len(self.calls), 4)
+
+        # Not prefetched results are computed in the calling thread.
+        self.assertEqual(prefetcher.get(5, (5,)), 25)
+        self.assertEqual(self.calls[-1], (5, main_thread))
+
+        # Exceptions are raised in the calling thread.
+        prefetcher.prefetch([(-1, (-1,))])
+        self.assertRaises(ValueError, prefetcher.get, -1, (-1,))
+        prefetcher.close()
+
+    def test_cancellation_and_size(self):
+        """
+        Queued tasks are cancelled by the next prefetch call and the number
+        of results is limited.
+        """
+        self.release.clear()
+        prefetcher = Prefetcher(self.square, max_workers=1, max_results=3)
+        prefetcher.prefetch([(_i, (_i,)) for _i in xrange(5)])
+        # The worker is now blocked in the first task.
+        time.sleep(0.05)
+        prefetcher.prefetch([(_i, (_i,)) for _i in xrange(10, 13)])
+        self.release.set()
+        for _ in xrange(500):
+            if 12 in prefetcher._results:
+                break
+            time.sleep(0.01)
+        self.assertEqual(sorted(_i[0] for _i in self.calls),
+            [0, 10, 11, 12])
+
+        # Only the most recently used results are kept.
+        self.assertEqual(prefetcher._results.keys(), [10, 11, 12])
+        self.assertEqual(prefetcher.get(12, (12,)), 144)
+        self.assertEqual(len(self.calls), 4)
+        self.assertEqual(prefetcher.get(0, (0,)), 0)
+        self.assertEqual(len(self.calls), 5)
+        prefetcher.close()
+
+
+def suite():
+    return unittest.makeSuite(PrefetcherTest, "test")
+
+
+if __name__ == "__main__":
+    unittest.main(defaultTest="suite")
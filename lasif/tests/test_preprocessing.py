@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test suite for the preprocessing helpers.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import glob
+import inspect
+import numpy as np
+from obspy import read, Stream, Trace, UTCDateTime
+from obspy.core.event import Catalog, Event, FocalMechanism, Magnitude, \
+    MomentTensor, Origin, Tensor
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+
+from lasif import preprocessing
+from lasif.project import Project
+from lasif.tools.instrument_correction import InstrumentCorrector
+from lasif.tools.resampling import Resampler
+from lasif.tools.response_cache import ResponseCache
+
+
+# Most generic way to get the actual data directory.
+data_dir = os.path.join(os.path.dirname(os.path.abspath(
+    inspect.getfile(inspect.currentframe()))), "data")
+
+
+class PreprocessingTest(unittest.TestCase):
+    """
+    Tests for the preprocessing helpers.
+    """
+    def test_processing_tag(self):
+        """
+        The tag changes with every parameter influencing the result.
+        """
+        starttime = UTCDateTime(2012, 1, 1)
+        tag = preprocessing.get_processing_tag("raw", starttime, 1000, 0.5,
+            0.01, 0.001)
+        self.assertTrue(tag.startswith(preprocessing.PROCESSED_TAG_PREFIX))
+        self.assertEqual(tag, preprocessing.get_processing_tag(u"raw",
+            UTCDateTime(2012, 1, 1), 1000, 0.5, 0.01, 0.001))
+        other_tags = set([
+            preprocessing.get_processing_tag("other", starttime, 1000, 0.5,
+                0.01, 0.001),
+            preprocessing.get_processing_tag("raw", starttime + 1, 1000, 0.5,
+                0.01, 0.001),
+            preprocessing.get_processing_tag("raw", starttime, 1001, 0.5,
+                0.01, 0.001),
+            preprocessing.get_processing_tag("raw", starttime, 1000, 0.25,
+                0.01, 0.001),
+            preprocessing.get_processing_tag("raw", starttime, 1000, 0.5,
+                0.02, 0.001),
+            preprocessing.get_processing_tag("raw", starttime, 1000, 0.5,
+                None, None)])
+        self.assertEqual(len(other_tags), 6)
+        self.assertFalse(tag in other_tags)
+
+    def test_responses(self):
+        """
+        Poles and zeros are taken from the response cache, RESP files are
+        passed on with the block of the channel.
+        """
+        seed_file = os.path.join(data_dir, "SEED", "dataless.BW_FURT")
+        resp_file = os.path.join(data_dir, "RESP", "RESP.G.FDF.00.BHE")
+        time = UTCDateTime(2012, 1, 1)
+        data = Stream([Trace(data=np.zeros(10), header={"network": "BW",
+            "station": "FURT", "channel": "EHZ", "starttime": time}),
+            Trace(data=np.zeros(10), header={"network": "G",
+            "station": "FDF", "location": "00", "channel": "BHE",
+            "starttime": time})])
+        data[0].stats.station_file = seed_file
+        data[1].stats.station_file = resp_file
+        data[1].stats.station_file_block = (10, 20)
+
+        response_cache = ResponseCache()
+        expected_paz = {"poles": [1j], "zeros": [], "gain": 1.0,
+            "sensitivity": 1.0}
+        response_cache._get_epochs = lambda filename: {"BW.FURT..EHZ": [
+            (0.0, None, expected_paz)]}
+        responses = preprocessing.get_responses(data, response_cache)
+        self.assertEqual(responses[0], {"paz": expected_paz})
+        self.assertEqual(responses[1], {"seedresp": {"filename": resp_file,
+            "units": "VEL", "date": time, "offset": 10, "length": 20}})
+
+        data[0].stats.station_file = "/some/where/else"
+        self.assertRaises(NotImplementedError, preprocessing.get_responses,
+            data, response_cache)
+
+    def test_preprocess_traces(self):
+        """
+        The traces end up on the time axis of the synthetics.
+        """
+        seed_file = os.path.join(data_dir, "SEED", "dataless.BW_FURT")
+        starttime = UTCDateTime(2012, 1, 1)
+        data = Stream()
+        for channel, offset in (("EHZ", -100.0), ("EHN", 50.0)):
+            data += Trace(data=np.random.randn(20000).cumsum(), header={
+                "network": "BW", "station": "FURT", "channel": channel,
+                "starttime": starttime + offset, "sampling_rate": 20.0})
+            data[-1].stats.station_file = seed_file
+        response_cache = ResponseCache()
+        paz = {"poles": [-0.037 + 0.037j, -0.037 - 0.037j], "zeros": [0j, 0j],
+            "gain": 1.0, "sensitivity": 1E9}
+        response_cache._get_epochs = lambda filename: {
+            "BW.FURT..EHZ": [(0.0, None, paz)],
+            "BW.FURT..EHN": [(0.0, None, paz)]}
+
+        # Without the bandpass spreading the data.
+        preprocessing.preprocess_traces(data, starttime, 900, 1.0, None,
+            None, response_cache, InstrumentCorrector(), Resampler())
+        for trace in data:
+            self.assertEqual(trace.stats.starttime, starttime)
+            self.assertEqual(trace.stats.npts, 900)
+            self.assertEqual(trace.stats.sampling_rate, 1.0)
+            self.assertTrue(np.isfinite(trace.data).all())
+        # Samples before the start of the data are zero.
+        self.assertTrue((data[1].data[:50] == 0.0).all())
+        self.assertFalse((data[1].data[60:] == 0.0).all())
+
+    def test_zero_phase_bandpass(self):
+        """
+        The bandpass does not shift a symmetric pulse.
+        """
+        class _NoCorrection(object):
+            def correct_traces(self, traces, responses):
+                pass
+
+        starttime = UTCDateTime(2012, 1, 1)
+        pulse = np.exp(-0.5 * ((np.arange(1001) - 500.0) / 3.0) ** 2)
+        data = Stream([Trace(data=pulse, header={"network": "BW",
+            "station": "FURT", "channel": "EHZ", "starttime": starttime,
+            "sampling_rate": 1.0})])
+        data[0].stats.station_file = os.path.join(data_dir, "SEED",
+            "dataless.BW_FURT")
+        response_cache = ResponseCache()
+        response_cache._get_epochs = lambda filename: {"BW.FURT..EHZ": [
+            (0.0, None, {"poles": [], "zeros": [], "gain": 1.0,
+            "sensitivity": 1.0})]}
+
+        preprocessing.preprocess_traces(data, starttime, 1001, 1.0, 0.1,
+            0.01, response_cache, _NoCorrection(), Resampler())
+        self.assertEqual(np.argmax(data[0].data), 500)
+        # Away from the edges affected by the padding of the filter.
+        np.testing.assert_allclose(data[0].data[300:701],
+            data[0].data[300:701][::-1],
+            atol=1E-3 * np.abs(data[0].data).max())
+
+    def test_write_trace(self):
+        """
+        Processed files are up-to-date as long as their input files do not
+        change. Only the processed files look like waveform files.
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "waveform")
+            station_file = os.path.join(directory, "station")
+            for name in (filename, station_file):
+                with open(name, "wb") as open_file:
+                    open_file.write("1")
+            output_folder = os.path.join(directory, "processed")
+            os.makedirs(output_folder)
+            trace = Trace(data=np.arange(10, dtype=np.int32), header={
+                "network": "BW", "station": "FURT", "channel": "EHZ"})
+
+            self.assertFalse(preprocessing.is_processed(output_folder,
+                trace.id, filename, station_file))
+            preprocessing._write_trace(trace, output_folder,
+                preprocessing.get_input_stats(filename, station_file))
+            self.assertEqual(glob.glob(os.path.join(output_folder, "*")),
+                [preprocessing.get_processed_filename(output_folder,
+                trace.id)])
+            np.testing.assert_array_equal(read(
+                preprocessing.get_processed_filename(output_folder,
+                trace.id))[0].data, np.arange(10))
+            self.assertTrue(preprocessing.is_processed(output_folder,
+                trace.id, filename, station_file))
+            self.assertFalse(preprocessing.is_processed(output_folder,
+                "BW.FURT..EHN", filename, station_file))
+
+            # A changed modification time is enough.
+            os.utime(station_file, (0, 0))
+            self.assertFalse(preprocessing.is_processed(output_folder,
+                trace.id, filename, station_file))
+            os.remove(station_file)
+            self.assertFalse(preprocessing.is_processed(output_folder,
+                trace.id, filename, station_file))
+        finally:
+            shutil.rmtree(directory)
+
+
+class PreprocessDataTest(unittest.TestCase):
+    """
+    Tests for the batch preprocessing and the station information of a small
+    example project.
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.project = Project(self.directory, init_project="Test")
+
+        origin_time = UTCDateTime(2012, 4, 12, 7, 15, 48, 500000)
+        event = Event()
+        event.origins.append(Origin(latitude=45.0, longitude=10.0,
+            depth=10000.0, time=origin_time))
+        event.magnitudes.append(Magnitude(mag=6.1, magnitude_type="Mwc"))
+        event.focal_mechanisms.append(FocalMechanism(
+            moment_tensor=MomentTensor(tensor=Tensor(m_rr=1.0, m_tt=2.0,
+            m_pp=3.0, m_rt=4.0, m_rp=5.0, m_tp=6.0))))
+        Catalog(events=[event]).write(os.path.join(
+            self.project.paths["events"], "event_1.xml"), format="QUAKEML")
+        shutil.copy(os.path.join(data_dir, "dataless.BW_FURT"),
+            self.project.paths["dataless_seed"])
+
+        raw_folder = os.path.join(self.project.paths["data"], "event_1",
+            "raw")
+        os.makedirs(raw_folder)
+        for channel in ("EHZ", "EHN", "EHE"):
+            Trace(data=np.random.randn(20000).cumsum(), header={
+                "network": "BW", "station": "FURT", "channel": channel,
+                "starttime": origin_time - 100.0,
+                "sampling_rate": 20.0}).write(os.path.join(raw_folder,
+                "BW.FURT..%s.mseed" % channel), format="MSEED")
+        synthetics_folder = os.path.join(self.project.paths["synthetics"],
+            "event_1", "synthetic")
+        os.makedirs(synthetics_folder)
+        for component in "XYZ":
+            Trace(data=np.sin(np.arange(900) / 10.0), header={
+                "network": "BW", "station": "FURT", "channel": component,
+                "sampling_rate": 1.0}).write(os.path.join(
+                synthetics_folder, "BW.FURT.%s.mseed" % component),
+                format="MSEED")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _get_data(self):
+        """
+        Returns the data of the first station of the iterator and whether
+        or not it has been processed before.
+        """
+        iterator = self.project.data_synthetic_iterator("event_1", "raw",
+            "synthetic", 0.01, 0.001)
+        # Only the synthetics are rotated.
+        iterator.rot_angle = 0.0
+        try:
+            data = iterator.next()["data"]
+            is_processed = iterator._station_files[0][-1]
+        finally:
+            iterator.close()
+        data.sort()
+        return np.array([_i.data for _i in data]), is_processed
+
+    def test_preprocess_data(self):
+        """
+        Stations are only processed again if their input files change and
+        the iterator returns the same data as when processing on the fly.
+        """
+        with warnings.catch_warnings(record=True):
+            warnings.simplefilter("always")
+            expected, is_processed = self._get_data()
+            self.assertFalse(is_processed)
+
+            self.assertEqual(self.project.preprocess_data("event_1", "raw",
+                "synthetic", 0.01, 0.001, workers=1),
+                {"processed": 1, "skipped": 0, "failed": 0})
+            self.assertEqual(self.project.preprocess_data("event_1", "raw",
+                "synthetic", 0.01, 0.001, workers=1),
+                {"processed": 0, "skipped": 1, "failed": 0})
+            # The new files are indexed.
+            folders = glob.glob(os.path.join(self.project.paths["data"],
+                "event_1", preprocessing.PROCESSED_TAG_PREFIX + "*"))
+            self.assertEqual(len(folders), 1)
+            partition = self.project.waveform_cache.get_partition("event_1",
+                os.path.basename(folders[0]))
+            self.assertEqual(sorted(_i["channel_id"] for _i in
+                partition.get_values()), ["BW.FURT..EHE", "BW.FURT..EHN",
+                "BW.FURT..EHZ"])
+
+            data, is_processed = self._get_data()
+            self.assertTrue(is_processed)
+            np.testing.assert_allclose(data, expected, rtol=1E-7,
+                atol=1E-7 * np.abs(expected).max())
+
+            # Other parameters are processed separately.
+            self.assertEqual(self.project.preprocess_data("event_1", "raw",
+                "synthetic", 0.02, 0.001, workers=1)["processed"], 1)
+
+            os.utime(os.path.join(self.project.paths["data"], "event_1",
+                "raw", "BW.FURT..EHZ.mseed"), (0, 0))
+            data, is_processed = self._get_data()
+            self.assertFalse(is_processed)
+            self.assertEqual(self.project.preprocess_data("event_1", "raw",
+                "synthetic", 0.01, 0.001, workers=1),
+                {"processed": 1, "skipped": 0, "failed": 0})
+
+            self.assertRaises(ValueError, self.project.preprocess_data,
+                "event_1", "raw", "other", workers=1)
+
+    def test_station_coordinate_arrays(self):
+        """
+        The station coordinates are available as arrays and as a dictionary
+        per station.
+        """
+        arrays = self.project.get_station_coordinate_arrays("event_1")
+        self.assertEqual(list(arrays["station_id"]), [u"BW.FURT"])
+        self.assertAlmostEqual(arrays["latitude"][0], 48.162899)
+        self.assertAlmostEqual(arrays["longitude"][0], 11.2752)
+        self.assertAlmostEqual(arrays["elevation_in_m"][0], 565.0)
+        # Memoized and protected against modifications.
+        self.assertTrue(arrays is
+            self.project.get_station_coordinate_arrays("event_1"))
+        self.assertFalse(arrays["latitude"].flags.writeable)
+
+        stations = self.project.get_stations_for_event("event_1")
+        self.assertEqual(stations.keys(), ["BW.FURT"])
+        self.assertEqual(stations["BW.FURT"]["latitude"],
+            arrays["latitude"][0])
+        self.assertEqual(stations["BW.FURT"]["elevation"], 565.0)
+
+        # No data.
+        os.makedirs(os.path.join(self.project.paths["data"], "event_2"))
+        shutil.copy(os.path.join(self.project.paths["events"],
+            "event_1.xml"), os.path.join(self.project.paths["events"],
+            "event_2.xml"))
+        arrays = self.project.get_station_coordinate_arrays("event_2")
+        self.assertEqual(len(arrays["station_id"]), 0)
+        self.assertEqual(len(arrays["latitude"]), 0)
+        self.assertEqual(self.project.get_stations_for_event("event_2"), {})
+
+    def test_preprocess_station_error(self):
+        """
+        Errors are returned instead of raised and nothing is written.
+        """
+        output_folder = os.path.join(self.directory, "processed")
+        os.makedirs(output_folder)
+        station_id, count, error = preprocessing.preprocess_station({
+            "station_id": "BW.FURT",
+            "channels": [(os.path.join(self.directory, "missing.mseed"),
+                os.path.join(self.project.paths["dataless_seed"],
+                "dataless.BW_FURT"), None)],
+            "output_folder": output_folder,
+            "response_cache_folder": os.path.join(self.directory,
+                "responses"),
+            "starttime": UTCDateTime(2012, 1, 1),
+            "npts": 900,
+            "delta": 1.0,
+            "highpass": None,
+            "lowpass": None})
+        self.assertEqual((station_id, count), ("BW.FURT", 0))
+        self.assertTrue(error.startswith("OSError: "))
+        self.assertEqual(os.listdir(output_folder), [])
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(PreprocessingTest, "test"))
+    suite.addTest(unittest.makeSuite(PreprocessDataTest, "test"))
+    return suite
+
+
+if __name__ == "__main__":
+    unittest.main(defaultTest="suite")
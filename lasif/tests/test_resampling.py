@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test suite for the resampling of many traces at once.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import numpy as np
+from obspy import Stream, Trace, UTCDateTime
+import unittest
+
+from lasif.tools.resampling import Resampler
+
+
+class ResamplingTest(unittest.TestCase):
+    """
+    Tests for the resampling.
+    """
+    def test_linear_interpolation(self):
+        """
+        Upsampling with the linear method is the same as numpy.interp().
+        """
+        data = np.random.random((3, 50))
+        offsets = np.array([0.3, -1.2, 0.0])
+        result = Resampler("linear").resample(data, 1.0, offsets, 200, 4.0,
+            fill_value=-5.0)
+        times = np.arange(200) / 4.0
+        for row, offset, resampled in zip(data, offsets, result):
+            expected = np.interp(times, np.arange(50) + offset, row,
+                left=-5.0, right=-5.0)
+            np.testing.assert_allclose(resampled, expected, atol=1E-12)
+
+    def test_band_limited_signal(self):
+        """
+        All methods reproduce a slow sine wave and suppress frequencies above
+        the new Nyquist frequency.
+        """
+        times = np.arange(2000) / 20.0
+        offsets = np.array([0.0, 0.013, 0.5])
+        data = np.sin(2.0 * np.pi * 0.1 * (times + offsets[:, np.newaxis]))
+        # A sampling interval of 0.13 seconds as commonly used by SES3D.
+        new_times = 3.3 + np.arange(800) * 0.13
+        expected = np.sin(2.0 * np.pi * 0.1 * (new_times +
+            offsets[:, np.newaxis]))
+        aliased = np.sin(2.0 * np.pi * 9.0 * times)
+
+        for method, tolerance in (("linear", 2E-3), ("lanczos", 1E-4),
+                ("fft", 1E-3)):
+            resampler = Resampler(method)
+            result = resampler.resample(data, 20.0, -3.3, 800, 1.0 / 0.13)
+            # The last samples are after the end of the data.
+            valid = new_times <= times[-1]
+            self.assertFalse(valid.all())
+            self.assertTrue((result[:, ~valid] == 0.0).all())
+            # Exclude the edges where the data is extended with zeros.
+            np.testing.assert_allclose(result[:, valid][:, 10:-10],
+                expected[:, valid][:, 10:-10], atol=tolerance)
+
+            result = resampler.resample(aliased, 20.0, 0.0, 200, 2.0)
+            self.assertTrue(np.abs(result[0, 20:-20]).max() < 1E-3)
+
+    def test_resample_traces(self):
+        """
+        Traces are resampled in place and the resampling matrices are
+        reused.
+        """
+        starttime = UTCDateTime(2012, 1, 1)
+        traces = Stream([
+            Trace(data=np.arange(100, dtype=np.int32), header={
+                "starttime": starttime - 1.0, "sampling_rate": 10.0}),
+            Trace(data=np.arange(100, dtype=np.float64), header={
+                "starttime": starttime - 1.0, "sampling_rate": 10.0}),
+            Trace(data=np.ones(30), header={
+                "starttime": starttime + 2.0, "sampling_rate": 2.0})])
+        resampler = Resampler("linear")
+        resampler.resample_traces(traces, starttime, 10, 1.0)
+        for trace in traces:
+            self.assertEqual(trace.stats.starttime, starttime)
+            self.assertEqual(trace.stats.sampling_rate, 1.0)
+            self.assertEqual(trace.stats.npts, 10)
+            self.assertEqual(trace.data.dtype, np.float64)
+        # The last sample is after the end of the data.
+        np.testing.assert_allclose(traces[0].data,
+            range(10, 100, 10) + [0.0], atol=1E-12)
+        np.testing.assert_allclose(traces[1].data, traces[0].data)
+        # The anti-aliasing kernel extends the data with zeros.
+        np.testing.assert_allclose(traces[2].data, [0.0, 0.0, 0.75] +
+            [1.0] * 7)
+        # One kernel per combination of sampling rates.
+        self.assertEqual(len(resampler._kernels), 2)
+
+    def test_kernel_reuse(self):
+        """
+        Traces with different lengths and start times share one kernel as
+        long as the fractional part of their offsets is the same.
+        """
+        starttime = UTCDateTime(2012, 1, 1)
+        data = np.random.randn(3000).cumsum()
+        traces = Stream([
+            Trace(data=data[:2000].copy(), header={
+                "starttime": starttime - 10.0, "sampling_rate": 20.0}),
+            Trace(data=data[:1500].copy(), header={
+                "starttime": starttime + 3.4, "sampling_rate": 20.0}),
+            Trace(data=data.copy(), header={
+                "starttime": starttime - 51.65, "sampling_rate": 20.0})])
+        offsets = [_i.stats.starttime - starttime for _i in traces]
+
+        resampler = Resampler()
+        resampler.resample_traces(traces, starttime, 700, 1.0 / 0.13)
+        self.assertEqual(len(resampler._kernels), 1)
+        columns, weights, step = resampler._kernels.values()[0]
+        # 13 samples at 20 Hz are 5 samples at 1 / 0.13 Hz.
+        self.assertEqual(weights.shape[0], 5)
+        self.assertEqual(step, 13)
+
+        # The same result as with the weights computed for every sample.
+        for trace, offset, npts in zip(traces, offsets, (2000, 1500, 3000)):
+            positions = np.arange(700) * 2.6 - offset * 20.0
+            columns, weights = resampler._compute_weights(positions, 2.6)
+            inside = (columns >= 0) & (columns < npts)
+            expected = (np.where(inside, weights, 0.0) *
+                data[np.clip(columns, 0, npts - 1)]).sum(axis=1)
+            expected[(positions < 0) | (positions > npts - 1)] = 0.0
+            np.testing.assert_allclose(trace.data, expected, atol=1E-9)
+
+        # Half a sample later.
+        resampler.resample(data, 20.0, 0.025, 700, 1.0 / 0.13)
+        self.assertEqual(len(resampler._kernels), 2)
+        # No kernel is cached for ratios that are no simple fractions.
+        resampler = Resampler("linear")
+        result = resampler.resample(data[:100], 1.0, 0.0, 300, np.pi)
+        self.assertEqual(len(resampler._kernels), 0)
+        np.testing.assert_allclose(result[0], np.interp(np.arange(300) /
+            np.pi, np.arange(100), data[:100], right=0.0), atol=1E-12)
+
+    def test_invalid_arguments(self):
+        """
+        Unknown methods and incommensurable rates for the fft method raise.
+        """
+        self.assertRaises(ValueError, Resampler, "cubic")
+        self.assertRaises(ValueError, Resampler("fft").resample,
+            np.zeros((1, 100)), 1.0, 0.0, 10, np.pi)
+
+
+def suite():
+    return unittest.makeSuite(ResamplingTest, "test")
+
+
+if __name__ == "__main__":
+    unittest.main(defaultTest="suite")
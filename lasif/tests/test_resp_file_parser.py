@@ -12,6 +12,7 @@ Simple test suite for the RESP file parser.
 import inspect
 import obspy
 import os
+import tempfile
 import unittest
 
 from lasif.tools import simple_resp_parser
@@ -90,6 +91,44 @@ class RESPFileParserTestCase(unittest.TestCase):
         self.assertEqual(channel["end_date"], None)
         self.assertEqual(channel["channel_id"], "AF.DODT..BHE")
 
+    def test_block_offsets(self):
+        """
+        The offsets and lengths of the channel blocks cover the file and
+        each block can be read and parsed on its own.
+        """
+        filename = os.path.join(self.data_dir, "RESP.AF.DODT..BHE")
+        channels = simple_resp_parser.get_inventory(filename,
+            include_offsets=True)
+        self.assertEqual(len(channels), 2)
+        self.assertEqual(channels[1]["offset"], channels[0]["offset"] +
+            channels[0]["length"])
+        self.assertEqual(channels[1]["offset"] + channels[1]["length"],
+            os.path.getsize(filename))
+        with open(filename, "rb") as open_file:
+            header = open_file.read(channels[0]["offset"])
+        self.assertFalse("B050F03" in header)
+
+        for channel in channels:
+            block = simple_resp_parser.read_block(filename,
+                channel["offset"], channel["length"])
+            self.assertTrue(block.startswith("B050F03"))
+            self.assertEqual(block.count("B050F03"), 1)
+            # The parser needs a filename.
+            temp_file = tempfile.NamedTemporaryFile()
+            temp_file.write(block)
+            temp_file.flush()
+            parsed = simple_resp_parser.get_inventory(temp_file.name)
+            temp_file.close()
+            del channel["offset"]
+            del channel["length"]
+            self.assertEqual(parsed, [channel])
+
+        # Duplicates keep the first block.
+        channels = simple_resp_parser.get_inventory(filename,
+            remove_duplicates=True, include_offsets=True)
+        self.assertEqual(len(channels), 1)
+        self.assertEqual(channels[0]["offset"], len(header))
+
 
 def suite():
     return unittest.makeSuite(RESPFileParserTestCase, "test")
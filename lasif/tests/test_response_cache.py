@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test suite for the response cache.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import inspect
+from obspy import UTCDateTime
+from obspy.xseed import Parser
+import os
+import shutil
+import tempfile
+import unittest
+
+from lasif.tools import response_cache
+from lasif.tools.response_cache import ResponseCache
+
+
+# Most generic way to get the actual data directory.
+data_dir = os.path.join(os.path.dirname(os.path.abspath(
+    inspect.getfile(inspect.currentframe()))), "data")
+
+
+class ResponseCacheTest(unittest.TestCase):
+    """
+    Tests for the response cache.
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_folder = os.path.join(self.directory, "responses")
+        self.seed_file = os.path.join(self.directory, "dataless.BW_FURT")
+        shutil.copy2(os.path.join(data_dir, "dataless.BW_FURT"),
+            self.seed_file)
+        self._parse_seed_file = response_cache._parse_seed_file
+
+    def tearDown(self):
+        response_cache._parse_seed_file = self._parse_seed_file
+        shutil.rmtree(self.directory)
+
+    def test_paz_matches_parser(self):
+        """
+        The cached responses are identical to the ones of the parser.
+        """
+        cache = ResponseCache(self.cache_folder)
+        parser = Parser(self.seed_file)
+        time = UTCDateTime(2012, 1, 1)
+        for channel_id in ["BW.FURT..EHZ", "BW.FURT..EHN", "BW.FURT..EHE"]:
+            self.assertEqual(cache.get_paz(self.seed_file, channel_id, time),
+                parser.getPAZ(channel_id, time))
+        # Before the first epoch.
+        self.assertRaises(ValueError, cache.get_paz, self.seed_file,
+            "BW.FURT..EHZ", UTCDateTime(1990, 1, 1))
+        self.assertRaises(ValueError, cache.get_paz, self.seed_file,
+            "BW.ABCD..EHZ", time)
+
+    def test_tiers(self):
+        """
+        Each file is parsed only once. Changed files are parsed again.
+        """
+        parsed_files = []
+
+        def parse_seed_file(filename):
+            parsed_files.append(filename)
+            return self._parse_seed_file(filename)
+        response_cache._parse_seed_file = parse_seed_file
+
+        time = UTCDateTime(2012, 1, 1)
+        cache = ResponseCache(self.cache_folder)
+        paz = cache.get_paz(self.seed_file, "BW.FURT..EHZ", time)
+        cache.get_paz(self.seed_file, "BW.FURT..EHN", time)
+        self.assertEqual(len(parsed_files), 1)
+        self.assertEqual(len(os.listdir(self.cache_folder)), 1)
+
+        # Returned values can be modified without affecting the cache.
+        paz["poles"].append(1.0)
+        self.assertNotEqual(cache.get_paz(self.seed_file, "BW.FURT..EHZ",
+            time), paz)
+
+        # A new instance uses the persistent tier.
+        cache = ResponseCache(self.cache_folder)
+        cache.get_paz(self.seed_file, "BW.FURT..EHZ", time)
+        self.assertEqual(len(parsed_files), 1)
+
+        # Changing the file invalidates both tiers.
+        shutil.copy(os.path.join(data_dir, "dataless.IU_PAB"),
+            self.seed_file)
+        self.assertRaises(ValueError, cache.get_paz, self.seed_file,
+            "BW.FURT..EHZ", time)
+        self.assertEqual(len(parsed_files), 2)
+        time = UTCDateTime(2005, 1, 1)
+        cache.get_paz(self.seed_file, "IU.PAB.00.BHE", time)
+        self.assertEqual(len(parsed_files), 2)
+
+        # The in-memory tier is limited.
+        cache = ResponseCache(max_memory_files=1)
+        other_file = os.path.join(self.directory, "dataless.IU_PAB")
+        shutil.copy2(os.path.join(data_dir, "dataless.IU_PAB"), other_file)
+        cache.get_paz(self.seed_file, "IU.PAB.00.BHE", time)
+        cache.get_paz(other_file, "IU.PAB.00.BHE", time)
+        cache.get_paz(self.seed_file, "IU.PAB.00.BHE", time)
+        self.assertEqual(len(parsed_files), 5)
+
+    def test_stationxml_files(self):
+        """
+        Poles and zeros are also extracted from StationXML files, no matter
+        if given in radians or Hertz or to displacement or velocity.
+        """
+        stationxml_file = os.path.join(data_dir, "station.BW_FURT.xml")
+        cache = ResponseCache()
+        expected = Parser(os.path.join(data_dir, "dataless.BW_FURT")).getPAZ(
+            "BW.FURT..EHZ", UTCDateTime(2012, 1, 1))
+        for channel_id, time in [("BW.FURT..EHZ", UTCDateTime(2012, 1, 1)),
+                ("BW.FURT..EHN", UTCDateTime(2005, 1, 1)),
+                ("BW.FURT..EHN", UTCDateTime(2012, 1, 1))]:
+            paz = cache.get_paz(stationxml_file, channel_id, time)
+            self.assertEqual(paz["sensitivity"], expected["sensitivity"])
+            self.assertAlmostEqual(paz["gain"], expected["gain"])
+            self.assertEqual(len(paz["poles"]), len(expected["poles"]))
+            self.assertEqual(len(paz["zeros"]), len(expected["zeros"]))
+            for actual, desired in zip(paz["poles"] + paz["zeros"],
+                    expected["poles"] + expected["zeros"]):
+                self.assertAlmostEqual(actual, desired)
+        # No poles and zeros stage.
+        self.assertRaises(ValueError, cache.get_paz, stationxml_file,
+            "BW.FURT..EHE", UTCDateTime(2012, 1, 1))
+
+
+def suite():
+    return unittest.makeSuite(ResponseCacheTest, "test")
+
+
+if __name__ == "__main__":
+    unittest.main(defaultTest="suite")
@@ -125,6 +125,27 @@ class SES3DFileParserTestCase(unittest.TestCase):
             2.95646032E-07, 2.49543859E-07, 2.03108399E-07, 1.56527761E-07,
             1.09975687E-07, 6.36098676E-08, 1.75719919E-08, -2.80116144E-08]))
 
+    def test_readingSES3DFileHeadonly(self):
+        """
+        Only the header is read and the data is parsed exactly like Python's
+        float() does it.
+        """
+        filename = os.path.join(self.data_dir, "File_phi")
+        tr = read_SES3D(filename, headonly=True)[0]
+        self.assertEqual(len(tr.data), 0)
+        self.assertEqual(tr.stats.npts, 3300)
+        self.assertEqual(tr.stats.channel, "Y")
+        self.assertAlmostEqual(tr.stats.delta, 0.15)
+        self.assertAlmostEqual(tr.stats.ses3d.receiver_latitude, 90.0 -
+            107.84100)
+        self.assertAlmostEqual(tr.stats.ses3d.source_depth_in_m, 20000)
+
+        with open(filename, "rb") as open_file:
+            expected = np.array(map(float, open_file.readlines()[7:]),
+                dtype="float32")
+        np.testing.assert_array_equal(read_SES3D(filename)[0].data,
+            expected)
+
     def test_ComponentMapping(self):
         """
         Tests that the components are correctly mapped.
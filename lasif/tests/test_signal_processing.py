@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test suite for the processing of many traces at once.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import numpy as np
+from obspy import Stream, Trace
+from obspy.signal.filter import bandpass, lowpass
+from obspy.signal.invsim import cosTaper
+import scipy.signal
+import unittest
+import warnings
+
+from lasif.tools import signal_processing
+
+
+class SignalProcessingTest(unittest.TestCase):
+    """
+    Tests for the processing of many traces at once.
+    """
+    def setUp(self):
+        np.random.seed(12345)
+        self.stream = Stream([
+            Trace(data=np.random.randn(1000).cumsum(),
+                header={"sampling_rate": 1.0}),
+            Trace(data=np.random.randn(1000).cumsum(),
+                header={"sampling_rate": 1.0}),
+            Trace(data=np.random.randint(-100, 100, 500).astype(np.int32),
+                header={"sampling_rate": 20.0})])
+        self.original = [tr.data.astype(np.float64) for tr in self.stream]
+
+    def test_filter_traces(self):
+        """
+        The filters are the same as the ones of obspy and are only designed
+        once.
+        """
+        signal_processing.filter_traces(self.stream, "bandpass",
+            freqmin=0.01, freqmax=0.1)
+        for trace, data in zip(self.stream[:2], self.original):
+            self.assertEqual(trace.data.dtype, np.float64)
+            expected = bandpass(data, 0.01, 0.1, 1.0)
+            np.testing.assert_allclose(trace.data, expected,
+                atol=1E-6 * np.abs(expected).max())
+        # The transfer function coefficients used by obspy are unstable for
+        # such a narrow band, the second order sections are not.
+        sos = scipy.signal.iirfilter(4, [0.001, 0.01], btype="band",
+            ftype="butter", output="sos")
+        np.testing.assert_allclose(self.stream[2].data,
+            scipy.signal.sosfilt(sos, self.original[2]))
+        sos = signal_processing.get_sos("bandpass", 1.0, 0.01, 0.1)
+        self.assertTrue(sos is signal_processing.get_sos("bandpass", 1.0,
+            0.01, 0.1))
+        self.assertRaises(ValueError, sos.__setitem__, 0, 1.0)
+
+        # Zero phase filtering.
+        data = np.array(self.original[:2])
+        sos = signal_processing.get_sos("lowpass", 1.0, freqmax=0.2)
+        np.testing.assert_allclose(
+            signal_processing.filter_stack(data, sos, zerophase=True),
+            scipy.signal.sosfiltfilt(sos, data, axis=1))
+        np.testing.assert_allclose(
+            signal_processing.filter_stack(data, sos)[0],
+            lowpass(data[0], 0.2, 1.0), rtol=1E-6, atol=1E-6)
+
+        # Corner frequencies above Nyquist.
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            self.assertEqual(signal_processing.get_sos("lowpass", 1.0,
+                freqmax=0.6), None)
+            sos = signal_processing.get_sos("bandpass", 1.0, 0.1, 0.6)
+        self.assertEqual(len(w), 2)
+        np.testing.assert_allclose(sos, signal_processing.get_sos(
+            "highpass", 1.0, freqmin=0.1))
+        self.assertRaises(ValueError, signal_processing.get_sos,
+            "bandpass", 1.0, 0.7, 0.8)
+        self.assertRaises(ValueError, signal_processing.get_sos, "notch",
+            1.0, 0.1, 0.2)
+        # Swapped corner frequencies.
+        self.assertRaises(ValueError, signal_processing.get_sos,
+            "bandpass", 1.0, 0.1, 0.01)
+
+    def test_detrend_and_taper_traces(self):
+        """
+        Detrending and tapering is the same as for single traces.
+        """
+        signal_processing.detrend_traces(self.stream)
+        for trace, data in zip(self.stream, self.original):
+            np.testing.assert_allclose(trace.data,
+                scipy.signal.detrend(data), atol=1E-9)
+        detrended = [tr.data.copy() for tr in self.stream]
+
+        signal_processing.taper_traces(self.stream, max_percentage=0.05)
+        for trace, data in zip(self.stream, detrended):
+            np.testing.assert_allclose(trace.data,
+                data * cosTaper(len(data), 0.1))
+            self.assertEqual(trace.data[0], 0.0)
+            self.assertEqual(trace.data[-1], 0.0)
+
+
+def suite():
+    return unittest.makeSuite(SignalProcessingTest, "test")
+
+
+if __name__ == "__main__":
+    unittest.main(defaultTest="suite")
@@ -10,11 +10,16 @@ Test suite for the station cache.
     (http://www.gnu.org/copyleft/gpl.html)
 """
 import inspect
+import numpy as np
+from obspy import UTCDateTime
 import os
 import shutil
+import sqlite3
 import tempfile
+import time
 import unittest
 
+from lasif.tools.cache_watcher import CacheWatcher
 from lasif.tools.station_cache import StationCache
 
 
@@ -165,6 +170,438 @@ class StationCacheTest(unittest.TestCase):
         single_value = station_cache.get_details(all_values[0]["filename"])[0]
         self.assertEqual(single_value, all_values[0])
 
+    def test_parallel_update(self):
+        """
+        Indexing with a pool of worker processes must give the same result as
+        indexing everything in the current process.
+        """
+        directory = tempfile.mkdtemp(dir=self.directory)
+        seed_directory = os.path.join(directory, "SEED")
+        resp_directory = os.path.join(directory, "RESP")
+        os.makedirs(seed_directory)
+        os.makedirs(resp_directory)
+        # Enough files to actually trigger the use of the pool.
+        for _i in xrange(30):
+            shutil.copy2(os.path.join(self.data_dir, "RESP.G.FDF.00.BHE"),
+                os.path.join(resp_directory, "RESP.G.FDF.00.BHE.%i" % _i))
+        shutil.copy2(os.path.join(self.data_dir, "dataless.BW_FURT"),
+            os.path.join(seed_directory, "dataless.BW_FURT"))
+
+        serial_cache = StationCache(os.path.join(directory, "serial.sqlite"),
+            seed_directory, resp_directory, process_count=1)
+        parallel_cache = StationCache(
+            os.path.join(directory, "parallel.sqlite"), seed_directory,
+            resp_directory, process_count=4, flush_size=7)
+
+        def sort_key(value):
+            return (value["filename"], value["channel_id"])
+        serial_values = sorted(serial_cache.get_values(), key=sort_key)
+        parallel_values = sorted(parallel_cache.get_values(), key=sort_key)
+        self.assertEqual(len(serial_values), 33)
+        self.assertEqual(serial_values, parallel_values)
+        del parallel_cache
+
+        # Removing many files at once must remove all of their indices.
+        for _i in xrange(10):
+            os.remove(os.path.join(resp_directory,
+                "RESP.G.FDF.00.BHE.%i" % _i))
+        parallel_cache = StationCache(
+            os.path.join(directory, "parallel.sqlite"), seed_directory,
+            resp_directory, process_count=4, flush_size=7)
+        self.assertEqual(len(parallel_cache.get_values()), 23)
+
+    def test_touched_files_are_only_reindexed_if_hash_changed(self):
+        """
+        Files with a new modification time but unchanged contents are not
+        reindexed if a hash function is given.
+        """
+        directory = tempfile.mkdtemp(dir=self.directory)
+        resp_directory = os.path.join(directory, "RESP")
+        os.makedirs(resp_directory)
+        resp_file = os.path.join(resp_directory, "RESP.G.FDF.00.BHE")
+        shutil.copy2(os.path.join(self.data_dir, "RESP.G.FDF.00.BHE"),
+            resp_file)
+        cache_file = os.path.join(directory, "cache.sqlite")
+
+        def get_index_ids(cache):
+            return cache.db_cursor.execute(
+                "SELECT id FROM indices ORDER BY id;").fetchall()
+
+        for hash_function in ["crc32", "adler32", "sampled_crc32"]:
+            if os.path.exists(cache_file):
+                os.remove(cache_file)
+            cache = StationCache(cache_file, directory, resp_directory,
+                hash_function=hash_function)
+            original_ids = get_index_ids(cache)
+            self.assertEqual(len(original_ids), 1)
+            del cache
+
+            # Only touch it.
+            mtime = os.path.getmtime(resp_file) + 10
+            os.utime(resp_file, (mtime, mtime))
+            cache = StationCache(cache_file, directory, resp_directory,
+                hash_function=hash_function)
+            self.assertEqual(get_index_ids(cache), original_ids)
+            del cache
+
+            # Now actually change it.
+            with open(resp_file, "ab") as open_file:
+                open_file.write("\n")
+            cache = StationCache(cache_file, directory, resp_directory,
+                hash_function=hash_function)
+            self.assertNotEqual(get_index_ids(cache), original_ids)
+            self.assertEqual(len(get_index_ids(cache)), 1)
+            del cache
+
+        self.assertRaises(ValueError, StationCache, cache_file, directory,
+            resp_directory, hash_function="unknown")
+
+    def test_filtered_queries(self):
+        """
+        Tests the filtering and projection of the queried values.
+        """
+        directory = tempfile.mkdtemp(dir=self.directory)
+        seed_directory = os.path.join(directory, "SEED")
+        resp_directory = os.path.join(directory, "RESP")
+        os.makedirs(seed_directory)
+        os.makedirs(resp_directory)
+        shutil.copy2(os.path.join(self.data_dir, "dataless.BW_FURT"),
+            os.path.join(seed_directory, "dataless.BW_FURT"))
+        for filename in ["RESP.G.FDF.00.BHE", "RESP.G.FDF.00.BHN"]:
+            shutil.copy2(os.path.join(self.data_dir, filename),
+                os.path.join(resp_directory, filename))
+        cache = StationCache(os.path.join(directory, "cache.sqlite"),
+            seed_directory, resp_directory)
+        self.assertEqual(len(cache.get_values()), 5)
+
+        values = cache.get_values(channel_id="G.FDF.00.BHE")
+        self.assertEqual(len(values), 1)
+        self.assertEqual(values[0]["filename"],
+            os.path.join(resp_directory, "RESP.G.FDF.00.BHE"))
+
+        values = cache.get_values(channel_id=["G.FDF.00.BHE",
+            "G.FDF.00.BHN", "BW.FURT..EHZ"], columns=["channel_id"])
+        self.assertEqual(sorted(_i["channel_id"] for _i in values),
+            ["BW.FURT..EHZ", "G.FDF.00.BHE", "G.FDF.00.BHN"])
+        self.assertEqual(sorted(values[0].keys()), ["channel_id", "filename"])
+
+        # The RESP files have no coordinates.
+        self.assertEqual(len(cache.get_values(latitude=None)), 2)
+        values = cache.get_values(minimum_latitude=40.0,
+            maximum_latitude=50.0, minimum_longitude=10.0,
+            maximum_longitude=12.0)
+        self.assertEqual(len(values), 3)
+        self.assertTrue(all(_i["channel_id"].startswith("BW.FURT.")
+            for _i in values))
+
+        # Export as arrays.
+        arrays = cache.get_column_arrays(columns=["channel_id", "latitude"],
+            channel_id=["G.FDF.00.BHE", "BW.FURT..EHZ"])
+        self.assertEqual(sorted(arrays.keys()),
+            ["channel_id", "filename", "latitude"])
+        self.assertEqual(arrays["latitude"].dtype, np.float64)
+        order = np.argsort(arrays["channel_id"])
+        self.assertEqual(list(arrays["channel_id"][order]),
+            ["BW.FURT..EHZ", "G.FDF.00.BHE"])
+        self.assertFalse(np.isnan(arrays["latitude"][order][0]))
+        self.assertTrue(np.isnan(arrays["latitude"][order][1]))
+        array = cache.get_array()
+        self.assertEqual(len(array), 5)
+        self.assertEqual(array.dtype.names, ("channel_id", "start_date",
+            "end_date", "latitude", "longitude", "elevation_in_m",
+            "local_depth_in_m", "offset", "length", "filename"))
+        self.assertEqual(len(cache.get_array(channel_id="XX.YY..ZZZ")), 0)
+
+        self.assertEqual(list(cache.iter_values(channel_id=[])), [])
+        self.assertRaises(ValueError, cache.get_values, unknown=1)
+        self.assertRaises(ValueError, cache.get_values, columns=["unknown"])
+
+    def test_update_policies(self):
+        """
+        Tests the different update policies.
+        """
+        directory = tempfile.mkdtemp(dir=self.directory)
+        resp_directory = os.path.join(directory, "RESP")
+        os.makedirs(resp_directory)
+        cache_file = os.path.join(directory, "cache.sqlite")
+
+        def add_file(filename):
+            shutil.copy2(os.path.join(self.data_dir, filename),
+                os.path.join(resp_directory, filename))
+
+        add_file("RESP.G.FDF.00.BHE")
+        # Never updates automatically.
+        cache = StationCache(cache_file, directory, resp_directory,
+            update_policy="never")
+        self.assertEqual(len(cache.get_values()), 0)
+        cache.update()
+        self.assertEqual(len(cache.get_values()), 1)
+        del cache
+
+        # Only updates upon the first query.
+        cache = StationCache(cache_file, directory, resp_directory,
+            update_policy="on_first_query")
+        add_file("RESP.G.FDF.00.BHN")
+        self.assertEqual(len(cache.get_channels()), 2)
+        add_file("RESP.G.FDF.00.BHZ")
+        self.assertEqual(len(cache.get_channels()), 2)
+        del cache
+
+        # The last update was just now.
+        cache = StationCache(cache_file, directory, resp_directory,
+            update_policy="ttl", ttl=3600)
+        self.assertEqual(len(cache.get_values()), 2)
+        del cache
+        cache = StationCache(cache_file, directory, resp_directory,
+            update_policy="ttl", ttl=0)
+        self.assertEqual(len(cache.get_values()), 3)
+        del cache
+
+        self.assertRaises(ValueError, StationCache, cache_file, directory,
+            resp_directory, update_policy="sometimes")
+
+    def test_directory_modification_time_shortcut(self):
+        """
+        Files in folders with an unchanged modification time are not checked.
+        """
+        directory = tempfile.mkdtemp(dir=self.directory)
+        resp_directory = os.path.join(directory, "RESP")
+        os.makedirs(resp_directory)
+        cache_file = os.path.join(directory, "cache.sqlite")
+        resp_file = os.path.join(resp_directory, "RESP.AF.DODT..BHE")
+        shutil.copy2(os.path.join(self.data_dir, "RESP.G.FDF.00.BHE"),
+            resp_file)
+
+        def set_old_folder_mtime():
+            # Recent modification times are not trusted.
+            mtime = os.path.getmtime(resp_directory) - 100
+            os.utime(resp_directory, (mtime, mtime))
+
+        set_old_folder_mtime()
+        cache = StationCache(cache_file, directory, resp_directory,
+            use_directory_mtimes=True)
+        self.assertEqual(list(cache.get_channels().keys()), ["G.FDF.00.BHE"])
+        del cache
+
+        # Changing a file in place does not change the folder.
+        shutil.copy2(os.path.join(self.data_dir, "RESP.AF.DODT..BHE"),
+            resp_file)
+        cache = StationCache(cache_file, directory, resp_directory,
+            use_directory_mtimes=True)
+        self.assertEqual(list(cache.get_channels().keys()), ["G.FDF.00.BHE"])
+        del cache
+        # Without the shortcut it is detected.
+        cache = StationCache(cache_file, directory, resp_directory)
+        self.assertEqual(list(cache.get_channels().keys()), ["AF.DODT..BHE"])
+        del cache
+
+        # Adding a file changes the folder.
+        shutil.copy2(os.path.join(self.data_dir, "RESP.G.FDF.00.BHN"),
+            os.path.join(resp_directory, "RESP.G.FDF.00.BHN"))
+        set_old_folder_mtime()
+        cache = StationCache(cache_file, directory, resp_directory,
+            use_directory_mtimes=True)
+        self.assertEqual(sorted(cache.get_channels().keys()),
+            ["AF.DODT..BHE", "G.FDF.00.BHN"])
+        del cache
+
+    def test_cache_watcher(self):
+        """
+        A running watcher applies only the observed changes to the cache.
+        """
+        directory = tempfile.mkdtemp(dir=self.directory)
+        resp_directory = os.path.join(directory, "RESP")
+        os.makedirs(resp_directory)
+        cache_file = os.path.join(directory, "cache.sqlite")
+        shutil.copy2(os.path.join(self.data_dir, "RESP.G.FDF.00.BHE"),
+            os.path.join(resp_directory, "RESP.G.FDF.00.BHE"))
+
+        cache = StationCache(cache_file, directory, resp_directory,
+            update_policy="never")
+
+        def wait_for_channels(channels):
+            # The changes only show up after the next poll.
+            for _ in xrange(100):
+                current = sorted(cache.get_channels().keys())
+                if current == channels:
+                    break
+                time.sleep(0.05)
+            self.assertEqual(current, channels)
+
+        with CacheWatcher(cache, interval=0.05, use_inotify=False) as watcher:
+            self.assertEqual(watcher.backend, "polling")
+            self.assertEqual(list(cache.get_channels().keys()),
+                ["G.FDF.00.BHE"])
+            # The cache must no longer scan the folders.
+            cache.update = None
+
+            shutil.copy2(os.path.join(self.data_dir, "RESP.G.FDF.00.BHN"),
+                os.path.join(resp_directory, "RESP.G.FDF.00.BHN"))
+            wait_for_channels(["G.FDF.00.BHE", "G.FDF.00.BHN"])
+
+            # Files not matching the pattern are ignored.
+            with open(os.path.join(resp_directory, "README"), "wt") as fh:
+                fh.write("Not a RESP file.")
+
+            os.remove(os.path.join(resp_directory, "RESP.G.FDF.00.BHE"))
+            wait_for_channels(["G.FDF.00.BHN"])
+        self.assertEqual(cache._watcher, None)
+
+    def test_concurrent_access(self):
+        """
+        Read-only caches can be queried while another process is writing.
+        """
+        directory = tempfile.mkdtemp(dir=self.directory)
+        resp_directory = os.path.join(directory, "RESP")
+        os.makedirs(resp_directory)
+        cache_file = os.path.join(directory, "cache.sqlite")
+        shutil.copy2(os.path.join(self.data_dir, "RESP.G.FDF.00.BHE"),
+            os.path.join(resp_directory, "RESP.G.FDF.00.BHE"))
+
+        # Read-only databases cannot be created.
+        self.assertRaises(ValueError, StationCache, cache_file, directory,
+            resp_directory, read_only=True)
+
+        cache = StationCache(cache_file, directory, resp_directory)
+        self.assertEqual(cache.db_cursor.execute(
+            "PRAGMA journal_mode;").fetchone()[0], "wal")
+
+        # Simulate another process holding the write lock.
+        other_process = sqlite3.connect(cache_file, isolation_level=None)
+        other_process.execute("BEGIN IMMEDIATE;")
+        other_process.execute("DELETE FROM files;")
+
+        # Reading is possible and sees the last committed state.
+        reader = StationCache(cache_file, directory, resp_directory,
+            read_only=True)
+        self.assertEqual(list(reader.get_channels().keys()), ["G.FDF.00.BHE"])
+        self.assertRaises(ValueError, reader.update)
+
+        # Writers wait for the lock and give up after the timeout.
+        writer = StationCache(cache_file, directory, resp_directory,
+            update_policy="never", timeout=0.1)
+        self.assertRaises(sqlite3.OperationalError, writer.update)
+        other_process.rollback()
+        other_process.close()
+        writer.update()
+        self.assertEqual(list(reader.get_channels().keys()), ["G.FDF.00.BHE"])
+
+    def test_bulk_epoch_resolution(self):
+        """
+        Resolving many channels and times at once gives the same results as
+        resolving them one by one.
+        """
+        directory = tempfile.mkdtemp(dir=self.directory)
+        seed_directory = os.path.join(directory, "SEED")
+        resp_directory = os.path.join(directory, "RESP")
+        os.makedirs(seed_directory)
+        os.makedirs(resp_directory)
+        cache_file = os.path.join(directory, "cache.sqlite")
+        shutil.copy2(os.path.join(self.data_dir, "dataless.BW_FURT"),
+            os.path.join(seed_directory, "dataless.BW_FURT"))
+        shutil.copy2(os.path.join(self.data_dir, "RESP.G.FDF.00.BHE"),
+            os.path.join(resp_directory, "RESP.G.FDF.00.BHE"))
+
+        cache = StationCache(cache_file, seed_directory, resp_directory)
+        channel_ids = sorted(cache.get_channels().keys()) + ["XX.YY..BHZ"]
+        times = [UTCDateTime(_i, 1, 1) for _i in (1990, 2001, 2010, 2013)]
+        pairs = [(_i, _j) for _i in channel_ids for _j in times]
+
+        filenames = cache.get_station_filenames([_i[0] for _i in pairs],
+            [_i[1] for _i in pairs])
+        self.assertEqual(filenames, [cache.get_station_filename(*_i)
+            for _i in pairs])
+        self.assertEqual(cache.station_infos_available(
+            [_i[0] for _i in pairs], [_i[1].timestamp for _i in pairs]),
+            [cache.station_info_available(*_i) for _i in pairs])
+        # Some have information and some do not.
+        self.assertTrue(any(filenames))
+        self.assertFalse(all(filenames))
+        # A single time for all channels.
+        self.assertEqual(cache.get_station_filenames(channel_ids, times[-1]),
+            [cache.get_station_filename(_i, times[-1]) for _i in channel_ids])
+
+        # The index is reused until the cache changes.
+        index = cache._get_epoch_index()
+        self.assertTrue(cache._get_epoch_index() is index)
+        os.remove(os.path.join(resp_directory, "RESP.G.FDF.00.BHE"))
+        cache.update()
+        self.assertEqual(cache.get_station_filenames(["G.FDF.00.BHE"],
+            times[-1]), [None])
+
+    def test_stationxml_files(self):
+        """
+        StationXML files are indexed as well.
+        """
+        directory = tempfile.mkdtemp(dir=self.directory)
+        stationxml_directory = os.path.join(directory, "StationXML")
+        os.makedirs(stationxml_directory)
+        cache_file = os.path.join(directory, "cache.sqlite")
+        stationxml_file = os.path.join(stationxml_directory,
+            "station.BW_FURT.xml")
+        shutil.copy2(os.path.join(self.data_dir, "station.BW_FURT.xml"),
+            stationxml_file)
+
+        cache = StationCache(cache_file, directory, directory,
+            stationxml_directory)
+        channels = cache.get_channels()
+        self.assertEqual(sorted(channels.keys()), ["BW.FURT..EHE",
+            "BW.FURT..EHN", "BW.FURT..EHZ"])
+        self.assertEqual(len(channels["BW.FURT..EHN"]), 2)
+        self.assertEqual(channels["BW.FURT..EHZ"][0]["latitude"], 48.162899)
+        self.assertEqual(channels["BW.FURT..EHZ"][0]["elevation_in_m"],
+            565.0)
+        self.assertEqual(cache.get_station_filename("BW.FURT..EHN",
+            UTCDateTime(2012, 1, 1)), stationxml_file)
+        self.assertEqual(cache.get_station_filename("BW.FURT..EHN",
+            UTCDateTime(2000, 1, 1)), None)
+
+    def test_stations_table(self):
+        """
+        The materialized stations table follows the indexed files and can be
+        queried by bounding box.
+        """
+        directory = tempfile.mkdtemp(dir=self.directory)
+        cache_file = os.path.join(directory, "cache.sqlite")
+        seed_file = os.path.join(directory, "dataless.BW_FURT")
+        shutil.copy2(os.path.join(self.data_dir, "dataless.IU_PAB"),
+            os.path.join(directory, "dataless.IU_PAB"))
+
+        cache = StationCache(cache_file, directory, directory)
+        self.assertEqual(cache.get_stations().keys(), ["IU.PAB"])
+
+        shutil.copy2(os.path.join(self.data_dir, "dataless.BW_FURT"),
+            seed_file)
+        cache.update()
+        stations = cache.get_stations()
+        self.assertEqual(sorted(stations.keys()), ["BW.FURT", "IU.PAB"])
+        self.assertAlmostEqual(stations["BW.FURT"]["latitude"], 48.162899)
+        self.assertAlmostEqual(stations["BW.FURT"]["longitude"], 11.2752)
+        self.assertEqual(cache.db_cursor.execute("SELECT channel_count "
+            "FROM stations WHERE station_id = 'BW.FURT';").fetchone()[0], 3)
+
+        # Bounding box queries, also across the antimeridian.
+        self.assertEqual(cache.get_stations_in_bounding_box(45.0, 50.0,
+            10.0, 12.0).keys(), ["BW.FURT"])
+        self.assertEqual(cache.get_stations_in_bounding_box(45.0, 50.0,
+            -10.0, 10.0), {})
+        self.assertEqual(sorted(cache.get_stations_in_bounding_box(30.0,
+            50.0, 170.0, 20.0).keys()), ["BW.FURT", "IU.PAB"])
+        self.assertEqual(cache.get_stations_in_bounding_box(30.0, 50.0,
+            170.0, 0.0).keys(), ["IU.PAB"])
+
+        # Read-only instances see the same stations.
+        read_only_cache = StationCache(cache_file, directory, directory,
+            read_only=True)
+        self.assertEqual(read_only_cache.get_stations(), stations)
+
+        # Removing a file removes its stations.
+        os.remove(seed_file)
+        cache.update()
+        self.assertEqual(cache.get_stations().keys(), ["IU.PAB"])
+        self.assertEqual(cache.db_cursor.execute("SELECT COUNT(*) "
+            "FROM dirty_channels;").fetchone()[0], 0)
+
     @classmethod
     def tearDownClass(cls):
         """
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test suite for the index of the synthetic waveform files.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from lasif.tools import synthetics_index
+
+
+class SyntheticsIndexTest(unittest.TestCase):
+    """
+    Tests for the index of the synthetic waveform files.
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.folder = os.path.join(self.directory, "synthetics")
+        self.cache_folder = os.path.join(self.directory, "cache")
+        os.makedirs(self.folder)
+        self._index_folder = synthetics_index._index_folder
+        self.indexed = []
+
+        def index_folder(folder):
+            self.indexed.append(folder)
+            return self._index_folder(folder)
+        synthetics_index._index_folder = index_folder
+
+    def tearDown(self):
+        synthetics_index._index_folder = self._index_folder
+        shutil.rmtree(self.directory)
+
+    def _touch(self, filename, age=10.0):
+        open(os.path.join(self.folder, filename), "wb").close()
+        # Make the folder old enough for the index to be stored.
+        modified = time.time() - age
+        os.utime(self.folder, (modified, modified))
+
+    def test_index(self):
+        """
+        The index maps the stations to their components and files.
+        """
+        for filename in ("BW.FURT___.x", "BW.FURT___.y", "BW.FURT___.z",
+                "GR.FUR_____.Z.mseed", "README", "BW.FURT.", ".hidden.file.x"):
+            self._touch(filename)
+        index = synthetics_index.get_synthetics_index(self.folder)
+        self.assertEqual(sorted(index.keys()), ["BW.FURT", "GR.FUR"])
+        self.assertEqual(index["BW.FURT"], {
+            "X": os.path.join(self.folder, "BW.FURT___.x"),
+            "Y": os.path.join(self.folder, "BW.FURT___.y"),
+            "Z": os.path.join(self.folder, "BW.FURT___.z")})
+        self.assertEqual(index["GR.FUR"], {
+            "Z": os.path.join(self.folder, "GR.FUR_____.Z.mseed")})
+        self.assertEqual(synthetics_index.get_synthetics_index(
+            os.path.join(self.directory, "missing")), {})
+
+    def test_persistence(self):
+        """
+        The stored index is used until files are added or removed.
+        """
+        self._touch("BW.FURT___.x")
+        get_index = lambda: synthetics_index.get_synthetics_index(
+            self.folder, self.cache_folder)
+        index = get_index()
+        self.assertEqual(len(self.indexed), 1)
+        self.assertEqual(get_index(), index)
+        self.assertEqual(len(self.indexed), 1)
+
+        self._touch("BW.FURT___.y", age=5.0)
+        self.assertEqual(sorted(get_index()["BW.FURT"].keys()), ["X", "Y"])
+        self.assertEqual(len(self.indexed), 2)
+        self.assertEqual(len(os.listdir(self.cache_folder)), 1)
+
+        # Recently modified folders are not stored as further changes
+        # might not change the modification time.
+        self._touch("BW.FURT___.z", age=0.0)
+        self.assertEqual(len(get_index()["BW.FURT"]), 3)
+        self.assertEqual(len(get_index()["BW.FURT"]), 3)
+        self.assertEqual(len(self.indexed), 4)
+
+
+def suite():
+    return unittest.makeSuite(SyntheticsIndexTest, "test")
+
+
+if __name__ == "__main__":
+    unittest.main(defaultTest="suite")
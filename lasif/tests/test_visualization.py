@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test suite for the visualization routines.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import matplotlib.pyplot as plt
+import numpy as np
+from obspy import readEvents, UTCDateTime
+from obspy.core.event import Catalog, Event, FocalMechanism, Magnitude, \
+    MomentTensor, Origin, Tensor
+import os
+import shutil
+import tempfile
+import unittest
+
+from lasif import visualization
+from lasif.tools.event_catalog import EventCatalog
+
+
+class _MapObject(object):
+    """
+    Stands in for a Basemap instance.
+    """
+    xmin, xmax, ymin, ymax = -180.0, 180.0, -90.0, 90.0
+
+    def __init__(self):
+        self.points = []
+        self.great_circles = []
+
+    def __call__(self, x, y):
+        self.points.append((x, y))
+        return x, y
+
+    def scatter(self, x, y, **kwargs):
+        self.scattered = (x, y)
+
+    def drawgreatcircle(self, *args, **kwargs):
+        self.great_circles.append(args)
+
+
+class VisualizationTest(unittest.TestCase):
+    """
+    Tests for the visualization routines.
+    """
+    def setUp(self):
+        # Works without a display.
+        plt.switch_backend("agg")
+        self.directory = tempfile.mkdtemp()
+        self.events_folder = os.path.join(self.directory, "EVENTS")
+        os.makedirs(self.events_folder)
+        for name, latitude, moment_tensor in (("event_1", 45.0, True),
+                ("event_2", 10.0, False)):
+            event = Event()
+            event.origins.append(Origin(latitude=latitude, longitude=12.0,
+                depth=10000.0, time=UTCDateTime(2012, 4, 12)))
+            event.magnitudes.append(Magnitude(mag=6.1,
+                magnitude_type="Mwc"))
+            if moment_tensor:
+                event.focal_mechanisms.append(FocalMechanism(
+                    moment_tensor=MomentTensor(tensor=Tensor(m_rr=1.0,
+                    m_tt=2.0, m_pp=3.0, m_rt=4.0, m_rp=5.0, m_tp=6.0))))
+            Catalog(events=[event]).write(os.path.join(self.events_folder,
+                "%s.xml" % name), format="QUAKEML")
+
+    def tearDown(self):
+        plt.close("all")
+        shutil.rmtree(self.directory)
+
+    def test_plot_events(self):
+        """
+        Events can be given as obspy Event objects, as done by the Misfit
+        GUI, or as event information dictionaries. Events without a moment
+        tensor are skipped.
+        """
+        events = [readEvents(os.path.join(self.events_folder,
+            "%s.xml" % _i))[0] for _i in ("event_1", "event_2")]
+        map_object = _MapObject()
+        visualization.plot_events(events, map_object=map_object)
+        self.assertEqual(map_object.points, [(12.0, 45.0)])
+        self.assertEqual(len(plt.gca().collections), 1)
+
+        catalog = EventCatalog(os.path.join(self.directory, "cache.sqlite"),
+            self.events_folder)
+        event_infos = catalog.get_event_infos()
+        map_object = _MapObject()
+        visualization.plot_events([event_infos["event_1"],
+            event_infos["event_2"]], map_object=map_object)
+        self.assertEqual(map_object.points, [(12.0, 45.0)])
+        self.assertEqual(len(plt.gca().collections), 2)
+
+    def test_plot_stations_for_event(self):
+        """
+        The stations are plotted directly from the coordinate arrays.
+        """
+        catalog = EventCatalog(os.path.join(self.directory, "cache.sqlite"),
+            self.events_folder)
+        event_info = catalog.get_event_info("event_1")
+        stations = {"station_id": np.array([u"BW.FURT", u"GR.FUR"]),
+            "latitude": np.array([48.16, 48.1]),
+            "longitude": np.array([11.28, 11.2])}
+        map_object = _MapObject()
+        visualization.plot_stations_for_event(map_object, stations,
+            event_info)
+        self.assertTrue(map_object.scattered[0] is stations["longitude"])
+        self.assertTrue(map_object.scattered[1] is stations["latitude"])
+        self.assertEqual(map_object.great_circles, [
+            (12.0, 45.0, 11.28, 48.16), (12.0, 45.0, 11.2, 48.1)])
+        self.assertTrue(plt.gca().get_title().endswith("2 stations."))
+
+
+def suite():
+    return unittest.makeSuite(VisualizationTest, "test")
+
+
+if __name__ == "__main__":
+    unittest.main(defaultTest="suite")
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test suite for the waveform cache.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import numpy as np
+import obspy
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from lasif.tools.cache_watcher import CacheWatcher
+from lasif.tools.waveform_cache import ProjectWaveformCache, WaveformCache
+
+
+class WaveformCacheTest(unittest.TestCase):
+    """
+    Tests for the waveform cache.
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.waveform_directory = os.path.join(self.directory, "raw")
+        os.makedirs(self.waveform_directory)
+        self.cache_file = os.path.join(self.directory, "cache.sqlite")
+
+        # One MiniSEED file without and one SAC file with coordinates.
+        tr = obspy.Trace(data=np.arange(1000, dtype="int32"))
+        tr.stats.network = "BW"
+        tr.stats.station = "FURT"
+        tr.stats.channel = "BHZ"
+        tr.stats.sampling_rate = 20.0
+        tr.stats.starttime = obspy.UTCDateTime(2012, 1, 1)
+        tr.write(os.path.join(self.waveform_directory, "BW.FURT..BHZ.mseed"),
+            format="mseed")
+
+        tr = obspy.Trace(data=np.arange(500, dtype="float32"))
+        tr.stats.network = "GR"
+        tr.stats.station = "FUR"
+        tr.stats.channel = "BHE"
+        tr.stats.sampling_rate = 10.0
+        tr.stats.starttime = obspy.UTCDateTime(2012, 1, 1)
+        tr.write(os.path.join(self.waveform_directory, "GR.FUR..BHE.sac"),
+            format="sac")
+        sac_file = os.path.join(self.waveform_directory, "GR.FUR..BHE.sac")
+        tr = obspy.read(sac_file)[0]
+        tr.stats.sac.stla = 48.16
+        tr.stats.sac.stlo = 11.28
+        tr.stats.sac.stel = 565.0
+        tr.write(sac_file, format="sac")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_header_only_indexing(self):
+        """
+        All values, including the sampling rate and the number of samples,
+        are indexed.
+        """
+        cache = WaveformCache(self.cache_file, self.waveform_directory)
+        values = {_i["channel_id"]: _i for _i in cache.get_values()}
+        self.assertEqual(sorted(values.keys()), ["BW.FURT..BHZ",
+            "GR.FUR..BHE"])
+
+        mseed = values["BW.FURT..BHZ"]
+        self.assertEqual(mseed["npts"], 1000)
+        self.assertEqual(mseed["sampling_rate"], 20.0)
+        self.assertEqual(mseed["starttime_timestamp"],
+            obspy.UTCDateTime(2012, 1, 1).timestamp)
+        self.assertAlmostEqual(mseed["endtime_timestamp"],
+            obspy.UTCDateTime(2012, 1, 1).timestamp + 999 / 20.0)
+        self.assertEqual(mseed["latitude"], None)
+
+        sac = values["GR.FUR..BHE"]
+        self.assertEqual(sac["npts"], 500)
+        self.assertEqual(sac["sampling_rate"], 10.0)
+        self.assertAlmostEqual(sac["latitude"], 48.16, 5)
+        self.assertAlmostEqual(sac["longitude"], 11.28, 5)
+        self.assertAlmostEqual(sac["elevation_in_m"], 565.0, 5)
+        self.assertEqual(sac["local_depth_in_m"], 0.0)
+
+    def test_project_waveform_cache(self):
+        """
+        One database for all events and tags which can be queried per event
+        and tag and across events.
+        """
+        data_directory = os.path.join(self.directory, "DATA")
+        mseed_file = os.path.join(self.waveform_directory,
+            "BW.FURT..BHZ.mseed")
+        sac_file = os.path.join(self.waveform_directory, "GR.FUR..BHE.sac")
+        for event_name, tag, filename in [
+                ("event_1", "raw", mseed_file),
+                ("event_1", "raw", sac_file),
+                ("event_1", "preprocessed", mseed_file),
+                ("event_2", "raw", sac_file)]:
+            folder = os.path.join(data_directory, event_name, tag)
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            shutil.copy2(filename, folder)
+        # Files directly in the event folders are ignored.
+        with open(os.path.join(data_directory, "event_1", "raw_cache.sqlite"),
+                "wb") as fh:
+            fh.write("")
+
+        cache = ProjectWaveformCache(self.cache_file, data_directory)
+        self.assertEqual(len(cache.get_values()), 4)
+
+        partition = cache.get_partition("event_1", "raw")
+        self.assertEqual(sorted(_i["channel_id"] for _i in
+            partition.get_values()), ["BW.FURT..BHZ", "GR.FUR..BHE"])
+        self.assertEqual(partition.get_values(columns=["npts"],
+            network="GR")[0]["npts"], 500)
+        partition = cache.get_partition("event_1", "preprocessed")
+        self.assertEqual(list(partition.get_column_arrays(
+            columns=["channel_id"])["channel_id"]), [u"BW.FURT..BHZ"])
+        self.assertEqual(cache.get_partition("event_3", "raw").get_values(),
+            [])
+
+        counts = cache.get_counts()
+        self.assertEqual(sorted(counts.keys()), ["event_1", "event_2"])
+        self.assertEqual(counts["event_1"]["files"], 2)
+        self.assertEqual(counts["event_1"]["stations"], 2)
+        self.assertEqual(counts["event_1"]["samples"], 1500)
+        self.assertEqual(counts["event_2"]["channels"], 1)
+        self.assertEqual(counts["event_2"]["size_in_bytes"],
+            os.path.getsize(sac_file))
+
+        stations, events, matrix = cache.get_availability_matrix()
+        self.assertEqual(stations, ["BW.FURT", "GR.FUR"])
+        self.assertEqual(events, ["event_1", "event_2"])
+        np.testing.assert_array_equal(matrix, [[True, False], [True, True]])
+        stations, events, matrix = cache.get_availability_matrix(
+            tag="synthetic")
+        self.assertEqual(matrix.shape, (0, 0))
+
+    def test_watcher_new_folders(self):
+        """
+        A running watcher notices new event and tag folders and the files
+        written to them afterwards.
+        """
+        data_directory = os.path.join(self.directory, "DATA")
+        os.makedirs(os.path.join(data_directory, "event_1", "raw"))
+        mseed_file = os.path.join(self.waveform_directory,
+            "BW.FURT..BHZ.mseed")
+        sac_file = os.path.join(self.waveform_directory, "GR.FUR..BHE.sac")
+        cache = ProjectWaveformCache(self.cache_file, data_directory,
+            update_policy="never")
+
+        def wait_for_files(event_name, tag, count):
+            # The changes only show up after the next poll.
+            for _ in xrange(100):
+                values = cache.get_partition(event_name, tag).get_values()
+                if len(values) == count:
+                    break
+                time.sleep(0.05)
+            self.assertEqual(len(values), count)
+
+        with CacheWatcher(cache, interval=0.05, use_inotify=False):
+            self.assertEqual(cache.get_values(), [])
+
+            new_folder = os.path.join(data_directory, "event_1",
+                "processed_1234")
+            os.makedirs(new_folder)
+            shutil.copy2(mseed_file, new_folder)
+            wait_for_files("event_1", "processed_1234", 1)
+            # Files written after the folder was picked up.
+            shutil.copy2(sac_file, new_folder)
+            wait_for_files("event_1", "processed_1234", 2)
+
+            new_folder = os.path.join(data_directory, "event_2", "raw")
+            os.makedirs(new_folder)
+            shutil.copy2(sac_file, new_folder)
+            wait_for_files("event_2", "raw", 1)
+
+            shutil.rmtree(os.path.join(data_directory, "event_1"))
+            wait_for_files("event_1", "processed_1234", 0)
+        self.assertEqual(len(cache.get_values()), 1)
+
+
+def suite():
+    return unittest.makeSuite(WaveformCacheTest, "test")
+
+
+if __name__ == "__main__":
+    unittest.main(defaultTest="suite")
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Watcher keeping a file info cache up-to-date while it is running.
+
+Useful for long running sessions. Instead of scanning all folders before
+queries, the watcher observes the folders of a cache and only the observed
+changes are applied to the database. It uses inotify via pyinotify if it is
+available and otherwise falls back to periodically polling the folders in a
+background thread.
+
+The watcher never touches the database itself. It only collects the names of
+created, modified and deleted files, which are then applied by the cache in
+the thread using it right before the next query. Folders listed with
+FileInfoCache._list_subfolders() are watched for new and removed subfolders.
+If that happens, the cache starts watching the new folders and is updated
+once completely.
+
+Example:
+
+>>> cache = StationCache(cache_db_file, seed_folder, resp_folder)
+>>> with CacheWatcher(cache):  # doctest: +SKIP
+...     cache.get_channels()
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+from fnmatch import fnmatch
+import glob
+import os
+import threading
+import warnings
+
+from lasif.tools.file_info_cache import get_file_stat, get_subfolders
+
+
+class CacheWatcher(object):
+    """
+    Observes the folders of a FileInfoCache and collects all changes.
+
+    Only files found with FileInfoCache._glob_folder() and the subfolders of
+    folders listed with FileInfoCache._list_subfolders() are watched.
+
+    :param cache: The FileInfoCache instance to keep up-to-date.
+    :param interval: The polling interval in seconds. Only used if inotify
+        is not available.
+    :param use_inotify: Use inotify if possible. Otherwise always poll.
+    """
+    def __init__(self, cache, interval=2.0, use_inotify=True):
+        self.cache = cache
+        self.interval = interval
+        self.use_inotify = use_inotify
+        self.backend = None
+        self._changed_files = set()
+        self._folders_changed = False
+        # The (folder, pattern) tuples of all watched files and the
+        # subfolders of the listed folders as last seen by the cache.
+        self._folders = []
+        self._listed_folders = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._notifier = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def is_running(self):
+        return self.backend is not None
+
+    def start(self):
+        """
+        Starts watching. The cache is fully updated once after watching
+        started so no change can be missed.
+        """
+        if self.is_running:
+            return
+        self._stop_event.clear()
+        self._folders_changed = False
+        self.update_folders()
+        if self.use_inotify and self._start_inotify():
+            self.backend = "inotify"
+        else:
+            self._start_polling()
+            self.backend = "polling"
+
+        self.cache.update()
+        self.cache._watcher = self
+
+    def stop(self):
+        """
+        Stops watching. All changes observed so far are applied to the cache
+        and it returns to its normal update policy.
+        """
+        if not self.is_running:
+            return
+        self._stop_event.set()
+        if self._notifier is not None:
+            self._notifier.stop()
+            self._notifier = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.backend = None
+        self.cache._watcher = None
+        if self.pop_folders_changed():
+            self.cache.update()
+        else:
+            self.cache.apply_changes(self.get_changed_files())
+
+    def get_changed_files(self):
+        """
+        Returns the names of all files changed since the last call.
+        """
+        with self._lock:
+            changed_files = self._changed_files
+            self._changed_files = set()
+        return changed_files
+
+    def pop_folders_changed(self):
+        """
+        Returns True if subfolders have been added or removed since the last
+        call.
+        """
+        with self._lock:
+            folders_changed = self._folders_changed
+            self._folders_changed = False
+        return folders_changed
+
+    def update_folders(self):
+        """
+        Determines the folders to watch with the cache. Subfolders created or
+        removed after the cache listed their parent folder are detected by
+        comparing with its listings.
+        """
+        self.cache._get_all_files()
+        with self._lock:
+            self._folders = self.cache._watched_folders.keys()
+            self._listed_folders = dict(self.cache._listed_folders)
+        if self._notifier is not None:
+            self._add_inotify_watches()
+
+    def _check_listed_folders(self):
+        """
+        Flags the folders as changed if any listed folder gained or lost
+        subfolders.
+        """
+        with self._lock:
+            listed_folders = self._listed_folders.items()
+        if any(get_subfolders(_i) != _j for _i, _j in listed_folders):
+            self._set_folders_changed()
+
+    def _add_changed_file(self, filename):
+        with self._lock:
+            self._changed_files.add(filename)
+
+    def _set_folders_changed(self):
+        with self._lock:
+            self._folders_changed = True
+
+    def _start_inotify(self):
+        """
+        Attempts to start the inotify notifier. Returns False if pyinotify is
+        not available. The folders are added by update_folders().
+        """
+        try:
+            import pyinotify
+        except ImportError:
+            return False
+
+        watcher = self
+
+        class EventHandler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                if event.dir:
+                    if event.path in watcher._listed_folders and \
+                            not event.mask & pyinotify.IN_CLOSE_WRITE:
+                        watcher._set_folders_changed()
+                    return
+                # Files are only indexed once they have been written
+                # completely.
+                if event.mask & pyinotify.IN_CREATE:
+                    return
+                if not any(folder == event.path and fnmatch(event.name,
+                        pattern) for folder, pattern in watcher._folders):
+                    return
+                watcher._add_changed_file(os.path.join(event.path,
+                    event.name))
+
+        self._inotify_mask = pyinotify.IN_CLOSE_WRITE | \
+            pyinotify.IN_CREATE | pyinotify.IN_DELETE | \
+            pyinotify.IN_MOVED_TO | pyinotify.IN_MOVED_FROM
+        self._watch_manager = pyinotify.WatchManager()
+        self._inotify_watched = set()
+        self._notifier = pyinotify.ThreadedNotifier(self._watch_manager,
+            EventHandler())
+        self._notifier.daemon = True
+        self._notifier.start()
+        self._add_inotify_watches()
+        return True
+
+    def _add_inotify_watches(self):
+        with self._lock:
+            folders = set(_i[0] for _i in self._folders) | \
+                set(self._listed_folders)
+        for folder in sorted(folders - self._inotify_watched):
+            if not os.path.isdir(folder):
+                msg = ("Folder '%s' does not exist and will not be watched."
+                    % folder)
+                warnings.warn(msg)
+                continue
+            self._watch_manager.add_watch(folder, self._inotify_mask)
+            self._inotify_watched.add(folder)
+        # Subfolders created before their parent folder was watched.
+        self._check_listed_folders()
+
+    def _start_polling(self):
+        """
+        Watches the folders by periodically comparing their contents with the
+        previous state in a background thread. The folders are set by
+        update_folders().
+        """
+        def get_state():
+            with self._lock:
+                folders = list(self._folders)
+            state = {}
+            for folder, pattern in folders:
+                for filename in glob.iglob(os.path.join(folder, pattern)):
+                    try:
+                        state[filename] = get_file_stat(filename)
+                    except OSError:
+                        # Deleted in the meanwhile.
+                        continue
+            return state
+
+        def poll(state):
+            while not self._stop_event.wait(self.interval):
+                new_state = get_state()
+                for filename in set(state.iterkeys()) | \
+                        set(new_state.iterkeys()):
+                    if state.get(filename) != new_state.get(filename):
+                        self._add_changed_file(filename)
+                state = new_state
+                self._check_listed_folders()
+
+        # The initial state is taken before the thread starts so nothing
+        # happening afterwards can be missed.
+        self._thread = threading.Thread(target=poll, args=(get_state(),))
+        self._thread.daemon = True
+        self._thread.start()
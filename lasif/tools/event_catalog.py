@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Catalog of the events of a project.
+
+Parsing QuakeML files is slow. The catalog stores the information most
+commonly needed about every event in the events folder, e.g. the origin,
+the magnitude, the moment tensor and the Flinn-Engdahl region. A QuakeML
+file is only parsed again once it has been modified. The complete event
+objects are only needed for a few tasks and should be read separately.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import os
+import warnings
+
+from lasif.tools.file_info_cache import FileInfoCache
+
+
+# The moment tensor components in the order of the focmec lists used by
+# ObsPy's beachball routines.
+MOMENT_TENSOR_COMPONENTS = ["m_rr", "m_tt", "m_pp", "m_rt", "m_rp", "m_tp"]
+
+# Initializing the Flinn-Engdahl regionalization is expensive. Shared by all
+# catalogs of a process.
+_FLINN_ENGDAHL = None
+
+
+class EventCatalog(FileInfoCache):
+    """
+    Cache taking care of all QuakeML files in the events folder. Every file
+    is expected to contain a single event, named after the file.
+
+    All further keyword arguments are passed on to the FileInfoCache.
+    """
+    def __init__(self, cache_db_file, events_folder, **kwargs):
+        self.index_values = [
+            ("event_name", "TEXT"),
+            ("latitude", "REAL"),
+            ("longitude", "REAL"),
+            ("depth_in_km", "REAL"),
+            ("origin_time_timestamp", "REAL"),
+            ("magnitude", "REAL"),
+            ("magnitude_type", "TEXT"),
+            ("region", "TEXT")] + \
+            [(_i, "REAL") for _i in MOMENT_TENSOR_COMPONENTS]
+
+        self.filetypes = ["quakeml"]
+
+        self.indexed_columns = [("event_name",)]
+
+        self.events_folder = events_folder
+        self._events_folder_mtime = self._get_events_folder_mtime()
+
+        super(EventCatalog, self).__init__(cache_db_file=cache_db_file,
+            **kwargs)
+
+    def _ensure_up_to_date(self):
+        """
+        Events are added during the lifetime of a project, e.g. by the
+        command line interface. Checking the modification time of the events
+        folder is cheap so it is done before every query and the catalog is
+        updated if it changed.
+        """
+        mtime = self._get_events_folder_mtime()
+        if mtime != self._events_folder_mtime:
+            self._events_folder_mtime = mtime
+            self._is_up_to_date = False
+        super(EventCatalog, self)._ensure_up_to_date()
+
+    def _get_events_folder_mtime(self):
+        if not os.path.isdir(self.events_folder):
+            return None
+        return os.stat(self.events_folder).st_mtime
+
+    def _find_files_quakeml(self):
+        return self._glob_folder(self.events_folder, "*%sxml" % os.extsep)
+
+    def _extract_index_values_quakeml(self, filename):
+        """
+        Parses the QuakeML file and extracts the preferred or first origin,
+        magnitude and moment tensor.
+        """
+        from obspy import readEvents
+
+        try:
+            event = readEvents(filename)[0]
+            org = event.preferred_origin() or event.origins[0]
+            mag = event.preferred_magnitude() or event.magnitudes[0]
+        except:
+            warnings.warn("Could not read QuakeML file '%s'." % filename)
+            return None
+
+        moment_tensor = get_moment_tensor(event) or \
+            [None] * len(MOMENT_TENSOR_COMPONENTS)
+
+        event_name = os.path.splitext(os.path.basename(filename))[0]
+        return [[event_name, org.latitude, org.longitude,
+            org.depth / 1000.0 if org.depth is not None else None,
+            org.time.timestamp, mag.mag, mag.magnitude_type,
+            get_flinn_engdahl_region(org.latitude, org.longitude)] +
+            moment_tensor]
+
+    def get_event_filenames(self):
+        """
+        Returns a dictionary with the names of all events as the keys and
+        the absolute filenames of their QuakeML files as the values. Contains
+        files that could not be read as well.
+        """
+        self._ensure_up_to_date()
+        filenames = [_i[0] for _i in self.db_cursor.execute(
+            "SELECT filename FROM files;")]
+        return {os.path.splitext(os.path.basename(_i))[0]:
+            os.path.abspath(_i) for _i in filenames}
+
+    def get_event_infos(self, **filters):
+        """
+        Returns a dictionary with one dictionary of information per event.
+        The keys are the same as for Project.get_event_info() with the
+        additional "moment_tensor" key. It is None or a list of the
+        components in the order of MOMENT_TENSOR_COMPONENTS.
+
+        Takes the same filter arguments as iter_values().
+        """
+        from obspy import UTCDateTime
+
+        infos = {}
+        for values in self.iter_values(**filters):
+            if values["depth_in_km"] is None:
+                warnings.warn("Origin contains no depth. Will be assumed to "
+                    "be 0")
+                values["depth_in_km"] = 0.0
+            if values["magnitude_type"] is None:
+                warnings.warn("Magnitude has no specified type. Will be "
+                    "assumed to be Mw")
+                values["magnitude_type"] = "Mw"
+            moment_tensor = [values[_i] for _i in MOMENT_TENSOR_COMPONENTS]
+            if None in moment_tensor:
+                moment_tensor = None
+            infos[values["event_name"]] = {
+                "latitude": values["latitude"],
+                "longitude": values["longitude"],
+                "origin_time": UTCDateTime(values["origin_time_timestamp"]),
+                "depth_in_km": values["depth_in_km"],
+                "magnitude": values["magnitude"],
+                "region": values["region"],
+                "magnitude_type": values["magnitude_type"],
+                "moment_tensor": moment_tensor}
+        return infos
+
+    def get_event_info(self, event_name):
+        """
+        Returns the information about a single event or None if the event
+        is not in the catalog.
+        """
+        return self.get_event_infos(event_name=event_name).get(event_name)
+
+
+def get_moment_tensor(event):
+    """
+    Returns the components of the moment tensor of the preferred or first
+    focal mechanism of an obspy Event in the order of
+    MOMENT_TENSOR_COMPONENTS or None if it has none.
+    """
+    fm = event.preferred_focal_mechanism() or \
+        (event.focal_mechanisms[0] if event.focal_mechanisms else None)
+    if fm is None or fm.moment_tensor is None or \
+            fm.moment_tensor.tensor is None:
+        return None
+    moment_tensor = [getattr(fm.moment_tensor.tensor, _i)
+        for _i in MOMENT_TENSOR_COMPONENTS]
+    if None in moment_tensor:
+        return None
+    return moment_tensor
+
+
+def get_flinn_engdahl_region(latitude, longitude):
+    """
+    Returns the name of the Flinn-Engdahl region of a point. The
+    regionalization is only initialized once per process.
+    """
+    global _FLINN_ENGDAHL
+    if _FLINN_ENGDAHL is None:
+        from obspy.core.util import FlinnEngdahl
+        _FLINN_ENGDAHL = FlinnEngdahl()
+    return _FLINN_ENGDAHL.get_region(longitude, latitude)
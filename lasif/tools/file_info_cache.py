@@ -12,9 +12,33 @@ files you want to index and functions to extract the indices and find the
 files. Upon each call to the constructor it will check the existing database,
 automatically remove any deleted files, reindex modified ones and add new ones.
 
+When the database is updated is determined by the update policy. By default
+it happens in the constructor. It can also be postponed until the first query,
+only happen if the last update is older than a given time span, or be left to
+explicit calls to update(). While a CacheWatcher (see cache_watcher.py) is
+running, only the changes it observed are applied instead. Only if folders
+listed with _list_subfolders() gain or lose subfolders, a full update is
+required.
+
+A file counts as modified if its size, modification time or inode changed. If
+a hash function is given, the contents of such files are additionally hashed
+and they are only reindexed if the hash changed as well. This is useful if
+files are frequently touched or copied without being changed.
+
 This is much faster then reading the files every time but still provides a lot
 of flexibility as the data can be managed by some other means.
 
+New and modified files are indexed by a pool of worker processes if there are
+enough of them. The 'index file' methods thus must not rely on any state
+changed during the update and their return values must be picklable. All
+database writes happen in the main process.
+
+The databases use write-ahead logging so any number of processes can query a
+cache while one process updates it. Updates hold the write lock of the
+database for their whole duration; other processes wanting to update the same
+cache wait for them and then find everything up-to-date. Processes that only
+query can open a cache read-only.
+
 
 Example implementation:
 
@@ -29,6 +53,9 @@ class ImageCache(object):
             ("type", "TEXT")]
         # The types of files to index.
         self.filetypes = ["png", "jpeg"]
+        # Optional. Creates one SQL index per tuple of column names to speed
+        # up queries filtering by these columns.
+        self.indexed_columns = [("width", "height")]
 
         # Subclass specific values
         self.image_folder = image_folder
@@ -46,11 +73,13 @@ class ImageCache(object):
     # Useful for lots of filetypes, not necessarily images as in the example
     # here.
 
+    # Finding the files with the _glob_folder() helper method enables the
+    # directory modification time shortcut.
     def _find_files_png(self):
-        return glob.glob(os.path.join("*.png"))
+        return self._glob_folder(self.image_folder, "*.png")
 
     def _find_files_jpeg(self):
-        return glob.glob(os.path.join("*.png"))
+        return self._glob_folder(self.image_folder, "*.jpeg")
 
     def _extract_index_values_png(self, filename):
         # Do somethings to get the values.
@@ -69,10 +98,49 @@ class ImageCache(object):
     (http://www.gnu.org/copyleft/gpl.html)
 """
 from binascii import crc32
+import cPickle
+from fnmatch import fnmatch
+import glob
 from itertools import izip
+import multiprocessing
 import os
 import progressbar
 import sqlite3
+import tempfile
+import time
+import zlib
+
+
+# Increment if the layout of the files table changes. Existing databases with
+# a different version will be recreated.
+SCHEMA_VERSION = 2
+
+
+# Only use a pool of worker processes if at least this many files need to be
+# indexed. Otherwise starting the pool costs more than it saves.
+MIN_FILES_FOR_POOL = 20
+# The default number of files whose indices are kept in memory before they are
+# written to the database.
+DEFAULT_FLUSH_SIZE = 500
+
+# Possible values for the update policy of a cache.
+UPDATE_POLICIES = ("always", "on_first_query", "ttl", "never")
+
+# Directory modification times this close to the time of the scan are not
+# trusted as files might still be added within the timestamp resolution of the
+# filesystem.
+DIRECTORY_MTIME_SAFETY_MARGIN_IN_S = 2.0
+
+# Seconds a process waits for another process to finish writing to a database
+# before giving up.
+DEFAULT_BUSY_TIMEOUT_IN_S = 120.0
+
+# Files are read in chunks of this many bytes when hashing them.
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# The cache instance currently updated by a pool of worker processes. Set
+# before the pool is created so that the forked workers inherit it.
+_WORKER_CACHE = None
 
 
 class FileInfoCache(object):
@@ -80,60 +148,200 @@ class FileInfoCache(object):
     Object able to cache information about arbitrary files on the filesystem.
 
     Intended to be subclassed.
+
+    :param cache_db_file: The SQLite file storing the cache.
+    :param process_count: The number of processes used to extract the index
+        values of new and modified files. Defaults to the number of CPUs.
+        Set it to 1 to index everything in the current process.
+    :param flush_size: The number of files whose indices are collected in
+        memory before they are written to the database. The whole update is
+        committed as a single transaction regardless of this value.
+    :param hash_function: Determines whether or not files whose size,
+        modification time or inode changed are hashed to find out if they
+        actually changed. Either None to not hash at all, the name of one of
+        the functions in HASH_FUNCTIONS ("crc32", "adler32",
+        "sampled_crc32") or a function taking a filename and returning the
+        hash as a string. Custom functions must be defined on the module
+        level so they can be used by the worker processes.
+    :param update_policy: When to update the database.
+        * "always": Upon initialization.
+        * "on_first_query": Right before the first query.
+        * "ttl": Right before the first query but only if the last update
+          of the database is more than ttl seconds ago.
+        * "never": Only if update() is called.
+    :param ttl: The time to live in seconds for the "ttl" update policy.
+    :param use_directory_mtimes: If True, the files in folders whose
+        modification time did not change since the last update are neither
+        listed nor checked for modifications. Only applies to files found
+        with _glob_folder(). Much faster for large folders but files changed
+        in place will not be reindexed.
+    :param read_only: If True, the database is only ever queried and never
+        updated, regardless of the update policy. It must already exist and
+        have the current layout. Use it for processes that only query, e.g.
+        parallel workers.
+    :param timeout: The time in seconds to wait for another process
+        currently writing to the database.
     """
-    def __init__(self, cache_db_file):
+    def __init__(self, cache_db_file, process_count=None,
+            flush_size=DEFAULT_FLUSH_SIZE, hash_function=None,
+            update_policy="always", ttl=60.0, use_directory_mtimes=False,
+            read_only=False, timeout=DEFAULT_BUSY_TIMEOUT_IN_S):
+        if update_policy not in UPDATE_POLICIES:
+            msg = "Unknown update policy '%s'. Available: %s" % (
+                update_policy, ", ".join(UPDATE_POLICIES))
+            raise ValueError(msg)
+        self.update_policy = update_policy
+        self.ttl = ttl
+        self.use_directory_mtimes = use_directory_mtimes
+        self.read_only = read_only
+        self.timeout = timeout
+        self._is_up_to_date = False
+        # Incremented whenever this instance writes to the database.
+        self._change_count = 0
+        self._watched_folders = {}
+        self._listed_folders = {}
+        self._current_filetype = None
+        # Set by a running CacheWatcher.
+        self._watcher = None
         self.cache_db_file = cache_db_file
+        self.process_count = process_count
+        self.flush_size = flush_size
+        if hash_function is not None and \
+                not hasattr(hash_function, "__call__"):
+            if hash_function not in HASH_FUNCTIONS:
+                msg = "Unknown hash function '%s'. Available: %s" % (
+                    hash_function, ", ".join(sorted(HASH_FUNCTIONS.keys())))
+                raise ValueError(msg)
+            hash_function = HASH_FUNCTIONS[hash_function]
+        self.hash_function = hash_function
         self._init_database()
-        self.update()
+        if self.update_policy == "always" and not self.read_only:
+            self.update()
 
     def __del__(self):
-        try:
-            self.db_conn.close()
-        except:
-            pass
+        self._close()
 
     def _init_database(self):
         """
         Inits the database connects, turns on foreign key support and creates
         the tables if they do not already exist.
         """
-        # Check if the file exists. If it exists, try to use it, otherwise
-        # delete and create a new one. This should take care that a new
-        # database is created in the case of DB corruption due to a power
-        # failure.
-        if os.path.exists(self.cache_db_file):
+        if self.read_only and not os.path.exists(self.cache_db_file):
+            msg = ("Cache database '%s' does not exist. It cannot be created "
+                "in read-only mode." % self.cache_db_file)
+            raise ValueError(msg)
+        # Try to use an existing file. If it is not a valid database, delete
+        # and create a new one. This should take care that a new database is
+        # created in the case of DB corruption due to a power failure.
+        try:
+            self._connect()
+        except sqlite3.DatabaseError:
+            if self.read_only:
+                raise
+            self._close()
+            for filename in (self.cache_db_file,
+                    self.cache_db_file + "-wal", self.cache_db_file + "-shm"):
+                if os.path.exists(filename):
+                    os.remove(filename)
+            self._connect()
+        # Make sure that foreign key support has been turned on.
+        if self.db_cursor.execute("PRAGMA foreign_keys;").fetchone()[0] != 1:
+            self._close()
+            msg = ("Could not enable foreign key support for SQLite. Please "
+                "contact the LASIF developers.")
+            raise ValueError(msg)
+
+        if self.read_only:
+            if not self._has_current_schema() or \
+                    not self._has_all_schema_objects():
+                self._close()
+                msg = ("Cache database '%s' does not have the current layout. "
+                    "Open it once without read_only to recreate it." %
+                    self.cache_db_file)
+                raise ValueError(msg)
+            return
+
+        # Only lock the database if the layout has to change. Other processes
+        # might be doing the same so check again once the lock is acquired.
+        if not self._has_current_schema() or \
+                not self._has_all_schema_objects():
+            self._begin_write()
             try:
-                self.db_conn = sqlite3.connect(self.cache_db_file)
+                self._create_tables()
+                self.db_conn.commit()
             except:
-                os.remove(self.cache_db_file)
-                self.db_conn = sqlite3.connect(self.cache_db_file)
-        else:
-            self.db_conn = sqlite3.connect(self.cache_db_file)
+                self.db_conn.rollback()
+                raise
+
+        # Temporary table used to remove many files with a single statement.
+        self.db_cursor.execute("CREATE TEMPORARY TABLE IF NOT EXISTS "
+            "removed_files (id INTEGER PRIMARY KEY);")
+
+    def _connect(self):
+        """
+        Connects to the database and configures the connection.
+        """
+        # Transactions are explicitly started with _begin_write(). The
+        # timeout is the time to wait for locks held by other processes.
+        self.db_conn = sqlite3.connect(self.cache_db_file,
+            timeout=self.timeout, isolation_level=None)
         self.db_cursor = self.db_conn.cursor()
         # Enable foreign key support.
         self.db_cursor.execute("PRAGMA foreign_keys = ON;")
+        if self.read_only:
+            # Fails here if the file is not a database.
+            self.db_cursor.execute("SELECT COUNT(*) FROM sqlite_master;")
+            self.db_cursor.execute("PRAGMA query_only = ON;")
+            return
+        # With write-ahead logging readers do not block the writer and the
+        # writer does not block the readers. The setting is persistent.
+        self.db_cursor.execute("PRAGMA journal_mode = WAL;")
         # Turn of sychronous writing. Much much faster inserts at the price of
         # risking corruption at power failure. Worth the risk as the databases
         # are just created from the data and can be recreated at any time.
         self.db_cursor.execute("PRAGMA synchronous = OFF;")
-        self.db_conn.commit()
-        # Make sure that foreign key support has been turned on.
-        if self.db_cursor.execute("PRAGMA foreign_keys;").fetchone()[0] != 1:
-            try:
-                self.db_conn.close()
-            except:
-                pass
-            msg = ("Could not enable foreign key support for SQLite. Please "
-                "contact the LASIF developers.")
+
+    def _close(self):
+        try:
+            self.db_conn.close()
+        except:
+            pass
+
+    def _begin_write(self):
+        """
+        Starts a transaction holding the write lock of the database. Waits
+        for up to self.timeout seconds if another process is writing.
+        """
+        if self.read_only:
+            msg = "Cache database '%s' has been opened read-only." % \
+                self.cache_db_file
             raise ValueError(msg)
+        self.db_cursor.execute("BEGIN IMMEDIATE;")
+
+    def _create_tables(self):
+        """
+        Creates all tables and SQL indices that do not exist yet. Drops all
+        existing tables if their layout does not match. Does not commit.
+        """
+        # The databases are just created from the data so simply start over if
+        # the layout does not match the current one.
+        if not self._has_current_schema():
+            self.db_cursor.execute("DROP TABLE IF EXISTS indices;")
+            self.db_cursor.execute("DROP TABLE IF EXISTS files;")
+            self.db_cursor.execute("DROP TABLE IF EXISTS folders;")
+            self.db_cursor.execute("DROP TABLE IF EXISTS cache_info;")
+            self.db_cursor.execute("PRAGMA user_version = %i;" %
+                SCHEMA_VERSION)
 
         # Create the tables.
         SQL_CREATE_FILES_TABLE = """
             CREATE TABLE IF NOT EXISTS files (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 filename TEXT,
-                last_modified REAL,
-                crc32_hash INTEGER
+                size INTEGER,
+                mtime_ns INTEGER,
+                inode INTEGER,
+                hash TEXT
             );
         """
         self.db_cursor.execute(SQL_CREATE_FILES_TABLE)
@@ -148,34 +356,330 @@ class FileInfoCache(object):
         """ % ",\n".join(["%s %s" % _i for _i in self.index_values])
 
         self.db_cursor.execute(SQL_CREATE_INDEX_TABLE)
-        self.db_conn.commit()
+
+        # The modification times of all folders at the time of the last
+        # update and some general information about the cache.
+        self.db_cursor.execute("""
+            CREATE TABLE IF NOT EXISTS folders (
+                folder TEXT,
+                pattern TEXT,
+                mtime_ns INTEGER,
+                PRIMARY KEY (folder, pattern)
+            );
+        """)
+        self.db_cursor.execute("""
+            CREATE TABLE IF NOT EXISTS cache_info (
+                key TEXT PRIMARY KEY,
+                value REAL
+            );
+        """)
+
+        # Create the SQL indices. Finding files by name and finding the
+        # indices of a file are required in any case, the others are
+        # specified by the subclass.
+        self.db_cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS "
+            "files_filename ON files(filename);")
+        self.db_cursor.execute("CREATE INDEX IF NOT EXISTS "
+            "indices_filepath_id ON indices(filepath_id);")
+        for columns in getattr(self, "indexed_columns", []):
+            self.db_cursor.execute("CREATE INDEX IF NOT EXISTS "
+                "indices_%s ON indices(%s);" % ("_".join(columns),
+                ", ".join(columns)))
+
+    def _has_all_schema_objects(self):
+        """
+        Checks if all tables, SQL indices and triggers exist.
+        """
+        existing = set(_i[0] for _i in self.db_cursor.execute(
+            "SELECT name FROM sqlite_master;"))
+        return set(self._get_schema_object_names()).issubset(existing)
+
+    def _get_schema_object_names(self):
+        """
+        Returns the names of all tables, SQL indices and triggers created by
+        _create_tables(). Subclasses creating additional ones have to extend
+        both methods.
+        """
+        return ["files", "indices", "folders", "cache_info",
+            "files_filename", "indices_filepath_id"] + \
+            ["indices_%s" % "_".join(_i)
+             for _i in getattr(self, "indexed_columns", [])]
+
+    def _before_commit(self):
+        """
+        Called within every write transaction right before it is committed.
+        Subclasses can use it to keep derived tables up-to-date.
+        """
+        pass
+
+    def _has_current_schema(self):
+        """
+        Checks if the database is either empty or has the layout expected by
+        this version and subclass.
+        """
+        tables = [_i[0] for _i in self.db_cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table';")]
+        for table in ("files", "indices", "folders", "cache_info"):
+            if table not in tables:
+                return False
+        if self.db_cursor.execute("PRAGMA user_version;").fetchone()[0] != \
+                SCHEMA_VERSION:
+            return False
+        columns = [_i[1] for _i in self.db_cursor.execute(
+            "PRAGMA table_info(indices);")]
+        return columns == ["id"] + [_i[0] for _i in self.index_values] + \
+            ["filepath_id"]
 
     def _get_all_files(self):
         """
         Find all files for all filetypes.
         """
+        # Folders whose content did not change since the last update. Filled
+        # by _glob_folder().
+        self._unchanged_folders = set()
+        self._folder_mtimes = {}
+        self._watched_folders = {}
+        self._listed_folders = {}
         self.files = {}
         for filetype in self.filetypes:
+            self._current_filetype = filetype
             get_file_fct = "_find_files_%s" % filetype
             self.files[filetype] = getattr(self, get_file_fct)()
+        self._current_filetype = None
+
+    def _list_subfolders(self, folder):
+        """
+        Returns the sorted paths of all subfolders of a folder.
+
+        Intended to be used in the '_find_files_FILETYPE' methods whenever
+        the folders passed to _glob_folder() are discovered by listing a
+        parent folder. A running CacheWatcher then also notices new and
+        removed subfolders.
+        """
+        subfolders = get_subfolders(folder)
+        self._listed_folders[folder] = subfolders
+        return subfolders
+
+    def _glob_folder(self, folder, pattern):
+        """
+        Returns all files in folder matching the glob pattern.
+
+        Intended to be used in the '_find_files_FILETYPE' methods. If
+        directory modification times are used and the folder has not been
+        modified since the last update, the folder is not listed and the
+        files are taken from the database.
+        """
+        self._watched_folders[(folder, pattern)] = self._current_filetype
+        if not os.path.isdir(folder):
+            return []
+        mtime = os.stat(folder).st_mtime
+        mtime_ns = int(round(mtime * 1E9))
+        # Do not trust very recent modification times. Files might still be
+        # added without changing the modification time.
+        if (time.time() - mtime) < DIRECTORY_MTIME_SAFETY_MARGIN_IN_S:
+            mtime_ns = None
+        self._folder_mtimes[(folder, pattern)] = mtime_ns
+
+        if self.use_directory_mtimes and mtime_ns is not None:
+            result = self.db_cursor.execute("SELECT mtime_ns FROM folders "
+                "WHERE folder = ? AND pattern = ?;", (folder,
+                pattern)).fetchone()
+            if result and result[0] == mtime_ns:
+                self._unchanged_folders.add(folder)
+                # Range query on the indexed filenames.
+                prefix = os.path.join(folder, "")
+                filenames = self.db_cursor.execute("SELECT filename FROM "
+                    "files WHERE filename >= ? AND filename < ?;", (prefix,
+                    prefix[:-1] + chr(ord(prefix[-1]) + 1))).fetchall()
+                return [_i[0] for _i in filenames
+                    if os.path.dirname(_i[0]) == folder and
+                    fnmatch(os.path.basename(_i[0]), pattern)]
+
+        return glob.glob(os.path.join(folder, pattern))
+
+    def _ensure_up_to_date(self):
+        """
+        Updates the database before a query if required by the update policy.
+
+        If a watcher is attached, only the changes it observed are applied.
+        New or removed subfolders require a full update.
+        """
+        if self._watcher is not None:
+            if self._watcher.pop_folders_changed():
+                # The full update covers all changes observed so far.
+                self._watcher.get_changed_files()
+                self._watcher.update_folders()
+                self.update()
+            else:
+                self.apply_changes(self._watcher.get_changed_files())
+            return
+        if self._is_up_to_date or self.read_only or \
+                self.update_policy in ("always", "never"):
+            return
+        if self.update_policy == "ttl":
+            result = self.db_cursor.execute("SELECT value FROM cache_info "
+                "WHERE key = 'last_update';").fetchone()
+            if result and (time.time() - result[0]) < self.ttl:
+                self._is_up_to_date = True
+                return
+        self.update()
 
     def update(self):
         """
         Updates the database.
+
+        The write lock of the database is held during the whole update. If
+        another process is updating the database, this waits until it is
+        done.
         """
-        # Get all files first.
-        self._get_all_files()
+        self._begin_write()
+        try:
+            # Get all files first.
+            self._get_all_files()
 
-        # Get all files currently in the database and reshape into a
-        # dictionary. The dictionary key is the filename and the value a tuple
-        # of (id, last_modified, crc32 hash).
-        db_files = self.db_cursor.execute("SELECT * FROM files").fetchall()
-        db_files = {_i[1]: (_i[0], _i[2], _i[3]) for _i in db_files}
+            # Get all files currently in the database and reshape into a
+            # dictionary. The dictionary key is the filename and the value a
+            # tuple of (id, (size, mtime_ns, inode), hash).
+            db_files = self.db_cursor.execute("SELECT id, filename, size, "
+                "mtime_ns, inode, hash FROM files").fetchall()
+            db_files = {_i[1]: (_i[0], tuple(_i[2:5]), _i[5])
+                for _i in db_files}
 
-        # Count all files
-        filecount = 0
-        for filetype in self.filetypes:
-            filecount += len(self.files[filetype])
+            # Collect all new and modified files. Each item is a tuple of
+            # (filename, filetype, filepath_id, stat, old_hash). The
+            # filepath_id is None for new files.
+            files_to_index = []
+            for filetype in self.filetypes:
+                for filename in self.files[filetype]:
+                    # Files in unchanged folders are assumed to be unchanged.
+                    if self._unchanged_folders and filename in db_files and \
+                            os.path.dirname(filename) in \
+                            self._unchanged_folders:
+                        del db_files[filename]
+                        continue
+                    # Delete the file from the list of files to keep track of
+                    # files no longer available.
+                    item = self._get_file_to_index(filename, filetype,
+                        db_files.pop(filename, None))
+                    if item is not None:
+                        files_to_index.append(item)
+        except:
+            self.db_conn.rollback()
+            raise
+
+        # All files remaining in db_files no longer exist.
+        self._write_changes(files_to_index,
+            [_i[0] for _i in db_files.itervalues()], is_full_update=True)
+
+    def apply_changes(self, filenames):
+        """
+        Incrementally applies changes to the given files to the database
+        without scanning any folder.
+
+        Files that no longer exist are removed, new and modified files are
+        (re)indexed. Files not matching any folder and pattern passed to
+        _glob_folder() during the last update are ignored.
+
+        :param filenames: The names of all created, modified, or deleted
+            files.
+        """
+        filenames = set(filenames)
+        if not filenames:
+            return
+
+        self._begin_write()
+        try:
+            # Get the existing records of the files.
+            db_files = {}
+            filenames_list = list(filenames)
+            for _i in xrange(0, len(filenames_list), 500):
+                chunk = filenames_list[_i:_i + 500]
+                for record in self.db_cursor.execute("SELECT id, filename, "
+                        "size, mtime_ns, inode, hash FROM files WHERE "
+                        "filename IN (%s);" % ", ".join(["?"] * len(chunk)),
+                        chunk):
+                    db_files[record[1]] = (record[0], tuple(record[2:5]),
+                        record[5])
+
+            files_to_index = []
+            removed_filepath_ids = []
+            for filename in filenames:
+                if not os.path.exists(filename):
+                    if filename in db_files:
+                        removed_filepath_ids.append(db_files[filename][0])
+                    continue
+                filetype = self.get_filetype(filename)
+                if filetype is None:
+                    continue
+                item = self._get_file_to_index(filename, filetype,
+                    db_files.get(filename, None))
+                if item is not None:
+                    files_to_index.append(item)
+        except:
+            self.db_conn.rollback()
+            raise
+
+        self._write_changes(files_to_index, removed_filepath_ids,
+            is_full_update=False)
+
+    def get_change_token(self):
+        """
+        Returns a value that changes whenever the content of the database
+        changes, regardless of whether this or another process changed it.
+        Data derived from the cache can be reused as long as the token stays
+        the same.
+        """
+        self._ensure_up_to_date()
+        # The data version only changes if other connections commit.
+        return self._change_count, self.db_cursor.execute(
+            "PRAGMA data_version;").fetchone()[0]
+
+    def get_filetype(self, filename):
+        """
+        Returns the filetype of a file based on the folders and patterns
+        passed to _glob_folder() during the last update or None if it does
+        not belong to the cache.
+        """
+        folder = os.path.dirname(filename)
+        basename = os.path.basename(filename)
+        for (glob_folder, pattern), filetype in \
+                self._watched_folders.iteritems():
+            if folder == glob_folder and fnmatch(basename, pattern):
+                return filetype
+        return None
+
+    def _get_file_to_index(self, filename, filetype, db_record):
+        """
+        Returns the tuple of (filename, filetype, filepath_id, stat,
+        old_hash) for a file that has to be (re)indexed or None if the file
+        did not change.
+
+        :param db_record: The tuple of (id, stat, hash) of the file currently
+            stored in the database or None for new files.
+        """
+        stat = get_file_stat(filename)
+        if db_record is None:
+            return filename, filetype, None, stat, None
+        filepath_id, old_stat, old_hash = db_record
+        # If the size, modification time and inode are identical, nothing to
+        # do.
+        if stat == old_stat:
+            return None
+        return filename, filetype, filepath_id, stat, old_hash
+
+    def _write_changes(self, files_to_index, removed_filepath_ids,
+            is_full_update):
+        """
+        (Re)indexes the given files and removes the given file records and
+        commits the transaction started with _begin_write().
+
+        :param files_to_index: List of (filename, filetype, filepath_id,
+            stat, old_hash) tuples.
+        :param removed_filepath_ids: The ids of all files to remove.
+        :param is_full_update: If True, the state of all scanned folders and
+            the time of the update are stored as well.
+        """
+        filecount = len(files_to_index)
 
         # Use a progressbar if the filecount is large so something appears on
         # screen.
@@ -187,131 +691,469 @@ class FileInfoCache(object):
                 maxval=filecount).start()
             update_interval = int(filecount / 100)
 
-        current_file_count = 0
-        # Now update all filetypes separately.
-        for filetype in self.filetypes:
-            for filename in self.files[filetype]:
+        # Everything is written in a single transaction. The index values are
+        # extracted either in this process or in a pool of worker processes.
+        # The database is only ever written to by this process.
+        try:
+            # New file records get explicit ids so that their indices can be
+            # inserted in bulk without querying for every id.
+            self._next_filepath_id = self.db_cursor.execute(
+                "SELECT IFNULL(MAX(id), 0) FROM files;").fetchone()[0] + 1
+
+            current_file_count = 0
+            batch = []
+            for result in self._extract_index_values(files_to_index):
                 current_file_count += 1
                 if pbar and not current_file_count % update_interval:
                     pbar.update(current_file_count)
-                if filename in db_files:
-                    # Delete the file from the list of files to keep track of
-                    # files no longer available.
-                    this_file = db_files[filename]
-                    del db_files[filename]
-                    last_modified = os.path.getmtime(filename)
-                    # If the last modified time is identical, nothing to do.
-                    if int(round(last_modified)) == int(round(this_file[1])):
-                        continue
-                    # Otherwise check the hash.
-                    with open(filename, "rb") as open_file:
-                        hash_value = crc32(open_file.read())
-                    if hash_value == this_file[2]:
-                        continue
-                    self._update_file(filename, filetype, this_file[0])
-                else:
-                    self._update_file(filename, filetype)
-        if pbar:
-            pbar.finish()
+                batch.append(result)
+                if len(batch) >= self.flush_size:
+                    self._write_files(batch)
+                    batch = []
+            if batch:
+                self._write_files(batch)
+
+            # Remove all files no longer part of the cache DB. The indices are
+            # removed by the foreign key constraint.
+            if removed_filepath_ids:
+                self.db_cursor.execute("DELETE FROM removed_files;")
+                self.db_cursor.executemany("INSERT INTO removed_files(id) "
+                    "VALUES(?);", [(_i,) for _i in removed_filepath_ids])
+                self.db_cursor.execute("DELETE FROM files WHERE id IN "
+                    "(SELECT id FROM removed_files);")
+                self.db_cursor.execute("DELETE FROM removed_files;")
 
-        # Remove all files no longer part of the cache DB.
-        for filename in db_files:
-            self.db_cursor.execute("DELETE FROM files WHERE filename='%s';" %
-                filename)
-        self.db_conn.commit()
+            self._before_commit()
 
-    def get_values(self):
+            # Store the state of all folders and the time of the update.
+            if is_full_update:
+                self.db_cursor.executemany("REPLACE INTO folders(folder, "
+                    "pattern, mtime_ns) VALUES(?, ?, ?);", [key + (value,)
+                    for key, value in self._folder_mtimes.iteritems()])
+                self.db_cursor.execute("REPLACE INTO cache_info(key, value) "
+                    "VALUES('last_update', ?);", (time.time(),))
+            self.db_conn.commit()
+            if files_to_index or removed_filepath_ids:
+                self._change_count += 1
+            if is_full_update:
+                self._is_up_to_date = True
+        except:
+            self.db_conn.rollback()
+            raise
+        finally:
+            if pbar:
+                pbar.finish()
+
+    def _extract_index_values(self, files_to_index):
         """
-        Returns a list of dictionaries containing all indexed values for every
-        file together with the filename.
+        Generator extracting the index values for all given files.
+
+        Yields one tuple as returned by _extract_file() per file. Uses a pool
+        of worker processes if more than one process is allowed and enough
+        files need to be indexed to amortize the cost of starting the pool.
+        The order of the results is not guaranteed.
+
+        :param files_to_index: List of (filename, filetype, filepath_id,
+            stat, old_hash) tuples.
         """
-        # Assemble the query. Use a simple join statement.
-        sql_query = """
-        SELECT %s, files.filename
-        FROM indices
-        INNER JOIN files
-        ON indices.filepath_id=files.id
-        """ % ", ".join(["indices.%s" % _i[0] for _i in self.index_values])
+        process_count = self.process_count or multiprocessing.cpu_count()
+        process_count = min(process_count, len(files_to_index))
+
+        if process_count <= 1 or len(files_to_index) < MIN_FILES_FOR_POOL:
+            for args in files_to_index:
+                yield self._extract_file(*args)
+            return
+
+        # Bound methods cannot be pickled. The workers are forked and thus
+        # inherit the module level reference to this instance.
+        global _WORKER_CACHE
+        _WORKER_CACHE = self
+        pool = multiprocessing.Pool(processes=process_count)
+        try:
+            chunksize = max(1, min(50, len(files_to_index) //
+                (process_count * 4)))
+            for result in pool.imap_unordered(_extract_index_values_worker,
+                    files_to_index, chunksize=chunksize):
+                yield result
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+            _WORKER_CACHE = None
+
+    def iter_values(self, columns=None, **filters):
+        """
+        Generator yielding one dictionary per index matching the filters.
+        Each dictionary contains the requested indexed values together with
+        the filename.
+
+        All filtering happens in the database. Every keyword argument is
+        interpreted as a filter. Valid keys are the names of the indexed
+        values and "filename", optionally prefixed by "minimum_" or
+        "maximum_". The semantics are:
+
+        * column=value: Equality. A value of None matches NULL values.
+        * column=[value_1, value_2, ...]: Matches any of the values. SQLite
+          limits the number of arguments per query to 999.
+        * minimum_column=value: column >= value
+        * maximum_column=value: column <= value
 
-        all_values = []
-        indices = [_i[0] for _i in self.index_values]
+        Example returning all waveforms of station BW.FURT intersecting a
+        time range:
 
-        for _i in self.db_cursor.execute(sql_query):
-            values = {key: value for (key, value) in izip(indices, _i)}
+        >>> cache.iter_values(network="BW", station="FURT",
+        ...     minimum_endtime_timestamp=starttime,
+        ...     maximum_starttime_timestamp=endtime)  # doctest: +SKIP
+
+        :param columns: The indexed values to return. Defaults to all.
+        """
+        columns, sql_query, arguments = self._get_query(columns, filters)
+
+        # Use a separate cursor so other queries can be run while iterating.
+        for _i in self.db_conn.execute(sql_query, arguments):
+            values = {key: value for (key, value) in izip(columns, _i)}
             values["filename"] = _i[-1]
-            all_values.append(values)
+            yield values
+
+    def get_values(self, columns=None, **filters):
+        """
+        Returns a list of dictionaries containing the indexed values for every
+        file together with the filename.
+
+        Takes the same arguments as iter_values(). Without any arguments all
+        indexed values of all files are returned.
+        """
+        return list(self.iter_values(columns=columns, **filters))
+
+    def get_column_arrays(self, columns=None, **filters):
+        """
+        Returns the indexed values as a dictionary of NumPy arrays, one per
+        column and one for the filenames. Much more compact than a list of
+        dictionaries and the basis for vectorized operations.
+
+        Takes the same arguments as iter_values(). The type of each array is
+        derived from the SQL type of the column: INTEGER and REAL columns are
+        returned as float64 arrays with NULL values mapped to NaN, TEXT
+        columns as unicode arrays with NULL values mapped to empty strings.
+        """
+        import numpy as np
+
+        columns, sql_query, arguments = self._get_query(columns, filters)
+        sql_types = dict(self.index_values)
+        sql_types["filename"] = "TEXT"
+        columns = columns + ["filename"]
+
+        rows = self.db_conn.execute(sql_query, arguments).fetchall()
+        if rows:
+            values = zip(*rows)
+        else:
+            values = [()] * len(columns)
+
+        arrays = {}
+        for column, column_values in izip(columns, values):
+            if sql_types[column].upper() == "TEXT":
+                arrays[column] = np.array([_i if _i is not None else u""
+                    for _i in column_values], dtype=np.unicode_)
+                # Empty arrays would otherwise have a zero length item size.
+                if not len(arrays[column]):
+                    arrays[column] = arrays[column].astype("U1")
+            else:
+                arrays[column] = np.array(column_values, dtype=np.float64)
+        return arrays
 
-        return all_values
+    def get_array(self, columns=None, **filters):
+        """
+        Returns the indexed values as a NumPy structured array with one field
+        per column and one for the filename.
+
+        Takes the same arguments as iter_values(). See get_column_arrays()
+        for the types of the fields.
+        """
+        import numpy as np
+
+        columns = self._get_query(columns, filters)[0] + ["filename"]
+        arrays = self.get_column_arrays(columns=columns[:-1], **filters)
+        dtype = [(str(_i), arrays[_i].dtype) for _i in columns]
+        array = np.empty(len(arrays["filename"]), dtype=dtype)
+        for column in columns:
+            array[column] = arrays[column]
+        return array
 
     def get_details(self, filename):
         """
         Get the indexed information about one file.
         """
-        filename = os.path.abspath(filename)
+        return self.get_values(filename=os.path.abspath(filename))
+
+    def _get_query(self, columns, filters):
+        """
+        Assembles the query for the given columns and filters. Returns a
+        tuple of (columns, sql_query, arguments). The filename is always
+        selected as the last value.
+        """
+        self._ensure_up_to_date()
+        index_names = [_i[0] for _i in self.index_values]
+        if columns is None:
+            columns = index_names
+        else:
+            columns = list(columns)
+            for column in columns:
+                if column not in index_names:
+                    msg = "Unknown column '%s'." % column
+                    raise ValueError(msg)
+        where_clause, arguments = self._get_where_clause(filters)
 
         # Assemble the query. Use a simple join statement.
         sql_query = """
-        SELECT %s, files.filename
+        SELECT %s
         FROM indices
         INNER JOIN files
         ON indices.filepath_id=files.id
-        WHERE files.filename='%s'
-        """ % (", ".join(["indices.%s" % _i[0] for _i in self.index_values]),
-            filename)
+        %s
+        """ % (", ".join(["indices.%s" % _i for _i in columns] +
+            ["files.filename"]), where_clause)
+        return columns, sql_query, arguments
 
-        all_values = []
-        indices = [_i[0] for _i in self.index_values]
+    def _get_where_clause(self, filters):
+        """
+        Turns the filters passed to iter_values() into a parameterized SQL
+        WHERE clause. Returns the clause and the list of arguments.
+        """
+        valid_columns = {_i[0]: "indices.%s" % _i[0]
+            for _i in self.index_values}
+        valid_columns["filename"] = "files.filename"
 
-        for _i in self.db_cursor.execute(sql_query):
-            values = {key: value for (key, value) in izip(indices, _i)}
-            values["filename"] = _i[-1]
-            all_values.append(values)
+        conditions = []
+        arguments = []
+        for key, value in sorted(filters.iteritems()):
+            operator = "="
+            column = key
+            if key not in valid_columns:
+                if key.startswith("minimum_"):
+                    operator = ">="
+                    column = key[len("minimum_"):]
+                elif key.startswith("maximum_"):
+                    operator = "<="
+                    column = key[len("maximum_"):]
+            if column not in valid_columns:
+                msg = "Unknown filter '%s'." % key
+                raise ValueError(msg)
+            column = valid_columns[column]
+
+            if operator != "=":
+                conditions.append("%s %s ?" % (column, operator))
+                arguments.append(value)
+            elif value is None:
+                conditions.append("%s IS NULL" % column)
+            elif isinstance(value, (list, tuple, set, frozenset)):
+                value = list(value)
+                if not value:
+                    conditions.append("0")
+                    continue
+                conditions.append("%s IN (%s)" % (column,
+                    ", ".join(["?"] * len(value))))
+                arguments.extend(value)
+            else:
+                conditions.append("%s = ?" % column)
+                arguments.append(value)
 
-        return all_values
+        if not conditions:
+            return "", arguments
+        return "WHERE " + " AND ".join(conditions), arguments
+
+    def _extract_file(self, filename, filetype, filepath_id=None,
+            stat=None, old_hash=None):
+        """
+        Gathers everything that is stored in the database about a single file.
+
+        If a hash function is set, the file is hashed exactly once. A file
+        whose hash matches old_hash is not reindexed.
+
+        Returns a tuple of (filename, filepath_id, stat, hash, is_modified,
+        indices). If is_modified is False, only the stat and hash values of
+        the file record need to be updated and indices is None.
+        """
+        if stat is None:
+            stat = get_file_stat(filename)
+        filehash = None
+        if self.hash_function is not None:
+            filehash = str(self.hash_function(filename))
+            if old_hash is not None and filehash == old_hash:
+                return filename, filepath_id, stat, filehash, False, None
+        indices = getattr(self, "_extract_index_values_%s" %
+            filetype)(filename)
+        return filename, filepath_id, stat, filehash, True, indices
 
     def _update_file(self, filename, filetype, filepath_id=None):
         """
         Updates or creates a new entry for the given file. If id is given, it
         will be interpreted as an update, otherwise as a fresh record.
         """
-        # Remove all old indices for the file if it is an update.
-        if filepath_id is not None:
-            self.db_cursor.execute("DELETE FROM indices WHERE "
-                "filepath_id = %i" % filepath_id)
+        self._begin_write()
+        try:
+            self._next_filepath_id = self.db_cursor.execute(
+                "SELECT IFNULL(MAX(id), 0) FROM files;").fetchone()[0] + 1
+            self._write_files([self._extract_file(filename, filetype,
+                filepath_id)])
+            self._before_commit()
             self.db_conn.commit()
+            self._change_count += 1
+        except:
+            self.db_conn.rollback()
+            raise
 
-        # Get the hash
-        with open(filename, "rb") as open_file:
-            filehash = crc32(open_file.read())
+    def _write_files(self, files):
+        """
+        Writes the file records and the already extracted indices of many
+        files to the database with a few bulk statements. Does not commit.
 
-        # Add or update the file.
-        if filepath_id is not None:
-            self.db_cursor.execute("UPDATE files SET last_modified=%f, "
-                "crc32_hash=%i WHERE id=%i;" % (os.path.getmtime(filename),
-                filehash, filepath_id))
-            self.db_conn.commit()
-        else:
-            self.db_cursor.execute("INSERT into files(filename, last_modified,"
-                " crc32_hash) VALUES('%s', %f, %i);" % (
-                filename, os.path.getmtime(filename), filehash))
-            self.db_conn.commit()
-            filepath_id = self.db_cursor.lastrowid
+        :param files: List of tuples as returned by _extract_file(). A
+            filepath_id of None denotes a new file.
+        """
+        unchanged_files = []
+        updated_files = []
+        new_files = []
+        all_indices = []
+        for filename, filepath_id, stat, filehash, is_modified, indices in \
+                files:
+            if filepath_id is None:
+                filepath_id = self._next_filepath_id
+                self._next_filepath_id += 1
+                new_files.append((filepath_id, filename) + stat + (filehash,))
+            elif not is_modified:
+                unchanged_files.append(stat + (filehash, filepath_id))
+                continue
+            else:
+                updated_files.append(stat + (filehash, filepath_id))
+            if not indices:
+                continue
+            # Append the filepath id to every index.
+            for index in indices:
+                all_indices.append(tuple(index) + (filepath_id,))
 
-        # Get all indices from the file.
-        indices = getattr(self, "_extract_index_values_%s" %
-            filetype)(filename)
-        if not indices:
-            return
+        sql_update_string = ("UPDATE files SET size = ?, mtime_ns = ?, "
+            "inode = ?, hash = ? WHERE id = ?;")
+        if unchanged_files:
+            self.db_cursor.executemany(sql_update_string, unchanged_files)
+        # Remove all old indices of updated files.
+        if updated_files:
+            self.db_cursor.executemany("DELETE FROM indices WHERE "
+                "filepath_id = ?;", [(_i[-1],) for _i in updated_files])
+            self.db_cursor.executemany(sql_update_string, updated_files)
+        if new_files:
+            self.db_cursor.executemany("INSERT INTO files(id, filename, size, "
+                "mtime_ns, inode, hash) VALUES(?, ?, ?, ?, ?, ?);", new_files)
+        if all_indices:
+            self.db_cursor.executemany(
+                "INSERT INTO indices(%s, filepath_id) VALUES(%s);" % (
+                    ",".join([_i[0] for _i in self.index_values]),
+                    ",".join(["?"] * (len(self.index_values) + 1))),
+                all_indices)
 
-        # Append the filepath id to every index.
-        for index in indices:
-            index.append(filepath_id)
 
-        sql_insert_string = "INSERT INTO indices(%s, filepath_id) VALUES(%s);"
+def get_file_stat(filename):
+    """
+    Returns a tuple of (size, mtime_ns, inode) used to detect modified files.
+    """
+    stat = os.stat(filename)
+    mtime_ns = getattr(stat, "st_mtime_ns", None)
+    if mtime_ns is None:
+        mtime_ns = int(round(stat.st_mtime * 1E9))
+    return (stat.st_size, mtime_ns, stat.st_ino)
 
-        self.db_conn.executemany(sql_insert_string % (
-            ",".join([_i[0] for _i in self.index_values]),
-            ",".join(["?"] * (len(indices[0])))),
-            indices)
 
-        self.db_conn.commit()
+def get_subfolders(folder):
+    """
+    Returns the sorted paths of all subfolders of a folder. Empty if the
+    folder does not exist.
+    """
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return []
+    subfolders = [os.path.join(folder, _i) for _i in names]
+    return sorted(_i for _i in subfolders if os.path.isdir(_i))
+
+
+def write_pickle(filename, content):
+    """
+    Atomically writes a pickle file so other processes never see partially
+    written files. The folder is created if necessary.
+    """
+    folder = os.path.dirname(os.path.abspath(filename))
+    if not os.path.exists(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:
+            # Created by another process in the meanwhile.
+            if not os.path.isdir(folder):
+                raise
+    fd, temp_file = tempfile.mkstemp(dir=folder, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as open_file:
+            cPickle.dump(content, open_file, protocol=2)
+        os.rename(temp_file, filename)
+    except:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+
+def _streaming_checksum(filename, checksum_fct):
+    """
+    Computes a zlib style running checksum of a file without ever holding
+    more than HASH_CHUNK_SIZE bytes of it in memory.
+    """
+    value = checksum_fct("")
+    with open(filename, "rb") as open_file:
+        while True:
+            chunk = open_file.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            value = checksum_fct(chunk, value)
+    return value & 0xffffffff
+
+
+def crc32_hash(filename):
+    """
+    CRC32 checksum of the whole file.
+    """
+    return _streaming_checksum(filename, crc32)
+
+
+def adler32_hash(filename):
+    """
+    Adler-32 checksum of the whole file. Faster than CRC32 and good enough to
+    detect changes.
+    """
+    return _streaming_checksum(filename, zlib.adler32)
+
+
+def sampled_crc32_hash(filename):
+    """
+    CRC32 checksum of the file size and the first and last HASH_CHUNK_SIZE
+    bytes of the file. Only reads at most two chunks of a file and thus is
+    very fast for large files at the cost of not detecting changes in the
+    middle of a file that do not change its size.
+    """
+    size = os.path.getsize(filename)
+    value = crc32(str(size))
+    with open(filename, "rb") as open_file:
+        value = crc32(open_file.read(HASH_CHUNK_SIZE), value)
+        if size > 2 * HASH_CHUNK_SIZE:
+            open_file.seek(-HASH_CHUNK_SIZE, os.SEEK_END)
+        value = crc32(open_file.read(HASH_CHUNK_SIZE), value)
+    return value & 0xffffffff
+
+
+HASH_FUNCTIONS = {
+    "crc32": crc32_hash,
+    "adler32": adler32_hash,
+    "sampled_crc32": sampled_crc32_hash}
+
+
+def _extract_index_values_worker(args):
+    """
+    Extracts everything stored about a single file in a worker process.
+    """
+    return _WORKER_CACHE._extract_file(*args)
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Frequency domain instrument correction for many traces at once.
+
+Performs the same instrument correction as obspy.signal.seisSim() with its
+default settings. The difference is that the inverted instrument responses
+are cached on the frequency grid of the real FFT. Each unique combination of
+response, number of samples and sampling rate is evaluated only once, and all
+traces with the same number of samples and sampling rate are corrected with a
+few 2D array operations.
+
+Responses are either given as poles and zeros or as RESP files which are
+evaluated with evalresp:
+
+>>> corrector = InstrumentCorrector(water_level=600.0)
+>>> responses = [{"paz": paz},
+...     {"seedresp": {"filename": resp_file, "units": "VEL"}}]
+>>> corrector.correct_traces(traces, responses)  # doctest: +SKIP
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+from collections import OrderedDict
+import numpy as np
+import os
+
+from lasif.tools.file_info_cache import get_file_stat
+
+
+# The maximum number of inverted responses kept in memory. Each takes about
+# 8 * npts bytes.
+DEFAULT_MAX_CACHED_RESPONSES = 500
+
+# The fraction of the cosine taper applied before the correction.
+TAPER_FRACTION = 0.05
+
+
+class InstrumentCorrector(object):
+    """
+    Removes instrument responses and caches the inverted responses.
+
+    :param water_level: The water level in dB.
+    :param pre_filt: Optional four corner frequencies of a cosine taper
+        applied in the frequency domain. See obspy.signal.seisSim().
+    :param max_cached_responses: The maximum number of inverted responses
+        kept in memory.
+    """
+    def __init__(self, water_level=600.0, pre_filt=None,
+            max_cached_responses=DEFAULT_MAX_CACHED_RESPONSES):
+        self.water_level = water_level
+        self.pre_filt = pre_filt
+        self.max_cached_responses = max_cached_responses
+        self._responses = OrderedDict()
+        # The epochs of RESP files, see _get_resp_epoch().
+        self._resp_epochs = {}
+
+    def correct_traces(self, traces, responses):
+        """
+        Removes the instrument responses of the traces in place. Traces with
+        the same number of samples and sampling rate are corrected together.
+
+        :param traces: A list of obspy Trace objects or a Stream.
+        :param responses: One response per trace. Either a dictionary
+            {"paz": paz} with poles and zeros or {"seedresp": seedresp} with
+            the same keys as for obspy.signal.seisSim(). The date and the
+            SEED identifiers of a seedresp dictionary are taken from the
+            trace if not given. It can additionally contain the "offset" and
+            "length" of the channel's block in the RESP file. Only that block
+            is then read.
+        """
+        groups = {}
+        for trace, response in zip(traces, responses):
+            groups.setdefault((trace.stats.npts,
+                trace.stats.sampling_rate), []).append((trace, response))
+
+        for (npts, sampling_rate), items in groups.iteritems():
+            traces = [_i[0] for _i in items]
+            responses = []
+            for trace, response in items:
+                if "seedresp" in response:
+                    seedresp = dict(response["seedresp"])
+                    seedresp.setdefault("date", trace.stats.starttime)
+                    for key in ("network", "station", "location", "channel"):
+                        seedresp.setdefault(key, trace.stats[key])
+                    response = {"seedresp": seedresp}
+                responses.append(response)
+            data = self.remove_response(np.array([_i.data for _i in traces],
+                dtype=np.float64), sampling_rate, responses)
+            for trace, trace_data in zip(traces, data):
+                trace.data = trace_data
+
+    def remove_response(self, data, sampling_rate, responses):
+        """
+        Removes the instrument responses from a stack of equally sized
+        traces.
+
+        Returns the corrected data as a new 2D float64 array.
+
+        :param data: 2D array with one trace per row.
+        :param sampling_rate: The sampling rate of all traces.
+        :param responses: One response per row. See correct_traces().
+            seedresp dictionaries must be complete.
+        """
+        from obspy.signal.invsim import cosTaper
+
+        data = np.array(data, dtype=np.float64, ndmin=2)
+        ndat = data.shape[1]
+        nfft = _get_nfft(ndat)
+
+        data -= data.mean(axis=1)[:, np.newaxis]
+        data *= cosTaper(ndat, TAPER_FRACTION)
+        spectra = np.fft.rfft(data, n=nfft, axis=1)
+
+        # Multiply each row with its cached inverted response. The pre
+        # filter is already part of it.
+        inverse_responses = []
+        sensitivities = np.ones(len(responses))
+        for _i, response in enumerate(responses):
+            inverse_responses.append(self.get_inverse_response(response,
+                nfft, sampling_rate))
+            if "paz" in response:
+                sensitivities[_i] = response["paz"]["sensitivity"]
+        spectra *= np.array(inverse_responses)
+        spectra[:, -1] = np.abs(spectra[:, -1]) + 0.0j
+
+        data = np.fft.irfft(spectra, axis=1)[:, :ndat]
+        # Vectorized version of the linear detrend of seisSim(). Subtracts
+        # the line through the first and the last sample of each row.
+        if ndat > 1:
+            x1 = data[:, :1]
+            x2 = data[:, -1:]
+            data = data - (x1 + np.arange(ndat) * (x2 - x1) /
+                float(ndat - 1))
+        data /= sensitivities[:, np.newaxis]
+        return data
+
+    def get_inverse_response(self, response, nfft, sampling_rate):
+        """
+        Returns the inverted and water leveled response on the frequency
+        grid of a real FFT with nfft points, multiplied with the pre filter.
+        Cached per unique response, nfft and sampling rate.
+        """
+        key = (self._get_response_key(response), nfft, sampling_rate)
+        try:
+            inverse_response = self._responses.pop(key)
+        except KeyError:
+            inverse_response = self._compute_inverse_response(response, nfft,
+                sampling_rate)
+        self._responses[key] = inverse_response
+        while len(self._responses) > self.max_cached_responses:
+            self._responses.popitem(last=False)
+        return inverse_response
+
+    def _compute_inverse_response(self, response, nfft, sampling_rate):
+        from lasif.tools import simple_resp_parser
+        from obspy.signal.invsim import cosTaper, evalresp, pazToFreqResp, \
+            specInv
+        import StringIO
+
+        delta = 1.0 / sampling_rate
+        if "paz" in response:
+            paz = response["paz"]
+            freq_response, freqs = pazToFreqResp(paz["poles"], paz["zeros"],
+                paz["gain"], delta, nfft, freq=True)
+        else:
+            seedresp = response["seedresp"]
+            resp_file = seedresp["filename"]
+            if seedresp.get("offset") is not None:
+                resp_file = StringIO.StringIO(simple_resp_parser.read_block(
+                    resp_file, seedresp["offset"], seedresp["length"]))
+            freq_response, freqs = evalresp(delta, nfft, resp_file,
+                seedresp["date"],
+                units=seedresp["units"], freq=True,
+                network=seedresp["network"], station=seedresp["station"],
+                locid=seedresp["location"], channel=seedresp["channel"])
+        freq_response = np.asarray(freq_response, dtype=np.complex128)
+        specInv(freq_response, self.water_level)
+        if self.pre_filt:
+            freq_response *= cosTaper(freqs.size, freqs=freqs,
+                flimit=self.pre_filt)
+        # Make sure it cannot be modified by accident.
+        freq_response.flags.writeable = False
+        return freq_response
+
+    def _get_response_key(self, response):
+        """
+        Returns a hashable key uniquely identifying a response.
+        """
+        if "paz" in response:
+            paz = response["paz"]
+            return ("paz", tuple(paz["poles"]), tuple(paz["zeros"]),
+                paz["gain"])
+        seedresp = response["seedresp"]
+        filename = os.path.abspath(seedresp["filename"])
+        stat = get_file_stat(filename)
+        channel_id = ".".join([seedresp[_i] for _i in ("network", "station",
+            "location", "channel")])
+        # The response is the same for all dates within an epoch. The block
+        # of a channel corresponds to exactly one epoch.
+        if seedresp.get("offset") is not None:
+            epoch = ("block", seedresp["offset"])
+        else:
+            epoch = self._get_resp_epoch(filename, stat, channel_id,
+                seedresp["date"])
+        return ("seedresp", filename, stat, channel_id, seedresp["units"],
+            epoch)
+
+    def _get_resp_epoch(self, filename, stat, channel_id, date):
+        """
+        Returns the start date of the epoch of the channel in the RESP file
+        containing the date. Falls back to the date itself if it cannot be
+        determined.
+        """
+        from lasif.tools import simple_resp_parser
+
+        cached = self._resp_epochs.get(filename)
+        if cached is None or cached[0] != stat:
+            try:
+                channels = simple_resp_parser.get_inventory(filename,
+                    remove_duplicates=True)
+            except Exception:
+                channels = []
+            cached = (stat, channels)
+            self._resp_epochs[filename] = cached
+        for channel in cached[1]:
+            if channel["channel_id"] != channel_id:
+                continue
+            if channel["start_date"] <= date and \
+                    (channel["end_date"] is None or
+                     date < channel["end_date"]):
+                return channel["start_date"].timestamp
+        return date.timestamp
+
+
+def _get_nfft(npts):
+    """
+    The number of points of the FFT for traces with npts samples. Identical
+    to the one used by seisSim().
+    """
+    try:
+        from obspy.signal.util import _npts2nfft
+    except ImportError:
+        from obspy.signal.util import nextpow2
+        return nextpow2(2 * npts)
+    return _npts2nfft(npts)
@@ -3,14 +3,19 @@
 """
 Simple query functions for the inventory database.
 
+Coordinates of stations without local station information are downloaded
+from an FDSN station web service once and stored in the database. Many
+stations are resolved at once with get_station_coordinates_batch(): All
+station ids are looked up with a single query and the missing ones are
+downloaded concurrently, grouping several stations of a network into one
+request.
+
 :copyright:
     Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
 :license:
     GNU Lesser General Public License, Version 3
     (http://www.gnu.org/copyleft/lesser.html)
 """
-import re
-import requests
 import sqlite3
 import time
 
@@ -25,8 +30,26 @@ CREATE TABLE IF NOT EXISTS stations(
 );"""
 
 
-URL = ("http://service.iris.edu/fdsnws/station/1/query?"
-    "network={network}&sta={station}&level=station&nodata=404")
+FDSN_STATION_URL = "http://service.iris.edu/fdsnws/station/1/query"
+
+# The maximum number of stations requested from the web service at once.
+# They all have to be part of the same network.
+DEFAULT_STATIONS_PER_REQUEST = 50
+
+# The number of concurrent requests to the web service.
+DEFAULT_MAX_WORKERS = 4
+
+# Stations the web service knows nothing about are only requested again
+# after this time.
+DEFAULT_NEGATIVE_TTL_IN_S = 7 * 24 * 3600.0
+
+# Number of attempts per request and seconds to wait in between.
+REQUEST_ATTEMPTS = 10
+REQUEST_RETRY_WAIT_IN_S = 0.1
+REQUEST_TIMEOUT_IN_S = 30.0
+
+# SQLite limits the number of arguments per query.
+MAX_SQL_ARGUMENTS = 999
 
 
 class InventoryDB(object):
@@ -34,6 +57,7 @@ class InventoryDB(object):
         self.conn = sqlite3.connect(db_file)
         self.cursor = self.conn.cursor()
         self.cursor.execute(CREATE_DB_SQL)
+        self._update_schema()
         self.conn.commit()
 
     def __del__(self):
@@ -42,68 +66,243 @@ class InventoryDB(object):
         except:
             pass
 
+    def _update_schema(self):
+        """
+        Databases of older versions neither have the time a station has been
+        stored nor an index on the station names. The index also makes
+        REPLACE actually replace existing rows.
+        """
+        columns = [_i[1] for _i in self.cursor.execute(
+            "PRAGMA table_info(stations);")]
+        if "timestamp" not in columns:
+            self.cursor.execute("ALTER TABLE stations ADD COLUMN "
+                "timestamp REAL;")
+        if self.cursor.execute("SELECT name FROM sqlite_master WHERE "
+                "type = 'index' AND name = 'stations_station_name';")\
+                .fetchone() is None:
+            self.cursor.execute("""
+                DELETE FROM stations WHERE rowid NOT IN (
+                    SELECT MAX(rowid) FROM stations GROUP BY station_name);
+            """)
+            self.cursor.execute("CREATE UNIQUE INDEX stations_station_name "
+                "ON stations(station_name);")
+
     def put_station_coordinates(self, station_id, latitude, longitude,
             elevation_in_m, depth_in_m):
-        latitude = str(latitude) if latitude is not None else "NULL"
-        longitude = str(longitude) if longitude is not None else "NULL"
-        elevation_in_m = str(elevation_in_m) \
-            if elevation_in_m is not None else "NULL"
-        depth_in_m = str(depth_in_m) if depth_in_m is not None else "NULL"
-
-        SQL = """
-        REPLACE INTO stations
-            (station_name, latitude, longitude, elevation, depth)
-        VALUES ('%s', %s, %s, %s, %s);
-        """ % (station_id, latitude, longitude, elevation_in_m, depth_in_m)
-        self.cursor.execute(SQL)
+        self.put_many_station_coordinates([(station_id, latitude, longitude,
+            elevation_in_m, depth_in_m)])
+
+    def put_many_station_coordinates(self, stations):
+        """
+        Stores the coordinates of many stations in a single transaction.
+
+        :param stations: List of (station_id, latitude, longitude,
+            elevation_in_m, depth_in_m) tuples. Stations without
+            coordinates have None values.
+        """
+        timestamp = time.time()
+        self.cursor.executemany("""
+            REPLACE INTO stations
+                (station_name, latitude, longitude, elevation, depth,
+                 timestamp)
+            VALUES (?, ?, ?, ?, ?, ?);
+            """, [tuple(_i) + (timestamp,) for _i in stations])
         self.conn.commit()
 
+    def get_many_station_coordinates(self, station_ids):
+        """
+        Returns a dictionary with a (latitude, longitude, elevation, depth,
+        timestamp) tuple for every station id in the database.
+        """
+        station_ids = list(set(station_ids))
+        stations = {}
+        for _i in xrange(0, len(station_ids), MAX_SQL_ARGUMENTS):
+            chunk = station_ids[_i:_i + MAX_SQL_ARGUMENTS]
+            sql_query = """
+            SELECT station_name, latitude, longitude, elevation, depth,
+                timestamp
+            FROM stations
+            WHERE station_name IN (%s);
+            """ % ", ".join("?" * len(chunk))
+            for row in self.cursor.execute(sql_query, chunk):
+                stations[row[0]] = row[1:]
+        return stations
+
 
 def get_station_coordinates(db_file, station_id):
     """
     Returns either a dictionary containing "latitude", "longitude",
     "elevation_in_m", "local_depth_in_m" keys or None if nothing was found.
     """
+    return get_station_coordinates_batch(db_file, [station_id])[station_id]
+
+
+def get_station_coordinates_batch(db_file, station_ids, url=FDSN_STATION_URL,
+        max_workers=DEFAULT_MAX_WORKERS,
+        stations_per_request=DEFAULT_STATIONS_PER_REQUEST,
+        negative_ttl=DEFAULT_NEGATIVE_TTL_IN_S):
+    """
+    Returns a dictionary with the coordinates of every station id. The values
+    are either dictionaries containing "latitude", "longitude",
+    "elevation_in_m", "local_depth_in_m" keys or None if nothing was found.
+
+    Stations not in the database are downloaded concurrently and stored.
+
+    :param db_file: The inventory database file.
+    :param station_ids: The station ids in the form NET.STA.
+    :param url: The query URL of the FDSN station web service.
+    :param max_workers: The number of concurrent requests.
+    :param stations_per_request: The maximum number of stations per request.
+    :param negative_ttl: Stations that could not be found are requested
+        again after this many seconds.
+    """
     inv_db = InventoryDB(db_file)
+    cached = inv_db.get_many_station_coordinates(station_ids)
 
-    SQL = """
-    SELECT latitude, longitude, elevation, depth
-    FROM stations
-    WHERE station_name = '%s'
-    LIMIT 1;
-    """ % station_id
-    coordinates = inv_db.cursor.execute(SQL).fetchone()
+    now = time.time()
+    coordinates = {}
+    missing = []
+    for station_id in set(station_ids):
+        row = cached.get(station_id)
+        if row is None:
+            missing.append(station_id)
+        elif row[0] is not None:
+            coordinates[station_id] = {"latitude": row[0],
+                "longitude": row[1], "elevation_in_m": row[2],
+                "local_depth_in_m": row[3]}
+        # Negative results without a timestamp stem from older versions.
+        elif row[4] is not None and now - row[4] < negative_ttl:
+            coordinates[station_id] = None
+        else:
+            missing.append(station_id)
 
-    if coordinates and coordinates[0] is None:
-        return None
+    if missing:
+        msg = ("Attempting to download coordinates for %i station(s). This "
+            "will only happen once ... ") % len(missing)
+        print msg,
+        downloaded, failed = _download_station_coordinates(sorted(missing),
+            url, max_workers, stations_per_request)
+        inv_db.put_many_station_coordinates(
+            [(station_id,) + downloaded.get(station_id, (None,) * 4)
+             for station_id in missing if station_id not in failed])
+        for station_id in missing:
+            if station_id in downloaded:
+                lat, lng, ele, depth = downloaded[station_id]
+                coordinates[station_id] = {"latitude": lat, "longitude": lng,
+                    "elevation_in_m": ele, "local_depth_in_m": depth}
+            else:
+                coordinates[station_id] = None
+        print "Found %i." % len(downloaded)
+    return coordinates
 
-    elif coordinates:
-        return {"latitude": coordinates[0], "longitude": coordinates[1],
-            "elevation_in_m": coordinates[2],
-            "local_depth_in_m": coordinates[3]}
-
-    msg = ("Attempting to download coordinates for %s. This will only "
-        "happen once ... ") % station_id
-    print msg,
-    # Otherwise try to download the necessary information.
-    network, station = station_id.split(".")
-    for _i in xrange(10):
-        try:
-            req = requests.get(URL.format(network=network, station=station))
-            break
-        except:
-            time.sleep(0.1)
-    if str(req.status_code)[0] != "2":
-        print "Failure."
-        inv_db.put_station_coordinates(station_id, None, None, None, None)
+
+def _download_station_coordinates(station_ids, url, max_workers,
+        stations_per_request):
+    """
+    Downloads the coordinates of the stations. All requests share a pooled
+    HTTP session.
+
+    Returns a dictionary with a (latitude, longitude, elevation, depth) tuple
+    per found station and the set of station ids that could not be requested
+    at all and thus should not be cached.
+    """
+    from multiprocessing.pool import ThreadPool
+    import requests
+
+    # One request per group of stations of the same network.
+    networks = {}
+    for station_id in station_ids:
+        network, station = station_id.split(".")
+        networks.setdefault(network, []).append(station)
+    groups = []
+    for network, stations in sorted(networks.iteritems()):
+        for _i in xrange(0, len(stations), stations_per_request):
+            groups.append((network, stations[_i:_i + stations_per_request]))
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+        pool_maxsize=max_workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    def download(group):
+        network, stations = group
+        params = {"network": network, "station": ",".join(stations),
+            "level": "station", "format": "xml", "nodata": "404"}
+        for _i in xrange(REQUEST_ATTEMPTS):
+            try:
+                response = session.get(url, params=params,
+                    timeout=REQUEST_TIMEOUT_IN_S)
+            except requests.RequestException:
+                time.sleep(REQUEST_RETRY_WAIT_IN_S)
+                continue
+            # Server errors and rate limiting are worth another attempt.
+            if response.status_code >= 500 or response.status_code == 429:
+                time.sleep(REQUEST_RETRY_WAIT_IN_S)
+                continue
+            return response
         return None
 
-    # Now simply find the coordinates.
-    lat = float(re.findall("<Latitude>(.*)</Latitude>", req.text)[0])
-    lng = float(re.findall("<Longitude>(.*)</Longitude>", req.text)[0])
-    ele = float(re.findall("<Elevation>(.*)</Elevation>", req.text)[0])
+    pool = ThreadPool(max(1, min(max_workers, len(groups))))
+    try:
+        responses = pool.map(download, groups)
+    finally:
+        pool.close()
+        pool.join()
+        session.close()
 
-    inv_db.put_station_coordinates(station_id, lat, lng, ele, None)
-    print "Success."
-    return {"latitude": lat, "longitude": lng, "elevation_in_m": ele,
-        "local_depth_in_m": 0.0}
+    coordinates = {}
+    failed = set()
+    for (network, stations), response in zip(groups, responses):
+        # Only these mean that the stations do not exist. Everything else,
+        # e.g. rate limiting or a denied access, must not be cached.
+        if response is not None and response.status_code in (204, 404):
+            continue
+        result = None
+        if response is not None and response.status_code // 100 == 2:
+            result = _parse_station_coordinates(response.content)
+        if result is None:
+            failed.update("%s.%s" % (network, _i) for _i in stations)
+            continue
+        coordinates.update(result)
+    return coordinates, failed
+
+
+def _parse_station_coordinates(stationxml):
+    """
+    Extracts the coordinates of all stations in a station level StationXML
+    document. Returns a dictionary with a (latitude, longitude, elevation,
+    depth) tuple per station id or None if the document cannot be parsed,
+    e.g. an empty body or an HTML error page.
+
+    Stations have no depth in StationXML. It is taken from the first channel
+    if the document contains channels and is None otherwise.
+    """
+    from lxml import etree
+    from lasif.tools.stationxml_parser import find_children, get_float
+
+    coordinates = {}
+    try:
+        root = etree.fromstring(stationxml)
+    except (etree.XMLSyntaxError, ValueError):
+        return None
+    # E.g. well-formed HTML error pages.
+    if etree.QName(root).localname != "FDSNStationXML":
+        return None
+    for network in find_children(root, "Network"):
+        for station in find_children(network, "Station"):
+            station_id = "%s.%s" % (network.get("code"), station.get("code"))
+            # The first epoch wins.
+            if station_id in coordinates:
+                continue
+            depth = None
+            for channel in find_children(station, "Channel"):
+                depth = get_float(channel, "Depth")
+                break
+            try:
+                coordinates[station_id] = (get_float(station, "Latitude"),
+                    get_float(station, "Longitude"),
+                    get_float(station, "Elevation"), depth)
+            except ValueError:
+                return None
+    return coordinates
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Computes the results of a function in background threads before they are
+requested.
+
+Intended for interactive tools stepping through expensive items, e.g. the
+stations of the misfit GUI. The caller announces the items it will most
+likely need next with prefetch(). A bounded number of finished results is
+kept in memory. Announcing a new set of items cancels all queued tasks not in
+it, so jumping to a different position does not waste time on items nobody
+will look at.
+
+>>> prefetcher = Prefetcher(process_station, max_workers=2)
+>>> prefetcher.prefetch([(1, (station_1,)), (2, (station_2,))])
+>>> result = prefetcher.get(1, (station_1,))  # doctest: +SKIP
+
+Results are computed in threads so the function must not use objects bound
+to a thread, e.g. SQLite connections.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+from collections import OrderedDict
+import sys
+import threading
+
+
+# The number of background threads.
+DEFAULT_MAX_WORKERS = 2
+
+# The number of finished results kept in memory.
+DEFAULT_MAX_RESULTS = 20
+
+
+class Prefetcher(object):
+    """
+    Thread pool computing function results ahead of time.
+
+    :param function: The function. Its return value is cached per key.
+    :param max_workers: The number of background threads.
+    :param max_results: The number of finished results kept in memory. Should
+        be larger than the number of keys passed to prefetch().
+    """
+    def __init__(self, function, max_workers=DEFAULT_MAX_WORKERS,
+            max_results=DEFAULT_MAX_RESULTS):
+        self.function = function
+        self.max_workers = max_workers
+        self.max_results = max_results
+        # Every result is a (value, exc_info) tuple.
+        self._results = OrderedDict()
+        self._queue = []
+        self._running = set()
+        self._condition = threading.Condition()
+        self._workers = []
+        self._closed = False
+
+    def prefetch(self, tasks):
+        """
+        Queues the computation of the results for the given keys. Queued
+        tasks for other keys are cancelled. Already running tasks are always
+        finished.
+
+        :param tasks: A list of (key, args) tuples in the order in which they
+            should be computed.
+        """
+        with self._condition:
+            if self._closed:
+                raise ValueError("The prefetcher has been closed.")
+            self._queue = [_i for _i in tasks if _i[0] not in self._results
+                and _i[0] not in self._running]
+            while len(self._workers) < min(self.max_workers,
+                    len(self._queue)):
+                worker = threading.Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+            self._condition.notify_all()
+
+    def get(self, key, args):
+        """
+        Returns the result for the key. Waits for it if it is currently
+        being computed and computes it in the calling thread if it has not
+        been started yet. Exceptions raised by the function are raised again.
+
+        :param key: The key.
+        :param args: The arguments passed to the function.
+        """
+        with self._condition:
+            while key in self._running:
+                self._condition.wait()
+            result = self._results.pop(key, None)
+            if result is None:
+                self._queue = [_i for _i in self._queue if _i[0] != key]
+        if result is None:
+            result = self._call(args)
+        with self._condition:
+            self._store(key, result)
+        value, exc_info = result
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return value
+
+    def close(self):
+        """
+        Cancels all queued tasks and stops the background threads once their
+        current task is done.
+        """
+        with self._condition:
+            self._closed = True
+            self._queue = []
+            self._condition.notify_all()
+
+    def _call(self, args):
+        try:
+            return self.function(*args), None
+        except Exception:
+            return None, sys.exc_info()
+
+    def _store(self, key, result):
+        """
+        Stores a result as the most recently used one. Must be called with
+        the condition acquired.
+        """
+        self._results[key] = result
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                key, args = self._queue.pop(0)
+                self._running.add(key)
+            result = self._call(args)
+            with self._condition:
+                self._running.discard(key)
+                self._store(key, result)
+                self._condition.notify_all()
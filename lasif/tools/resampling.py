@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Resampling of many traces onto a common time axis at once.
+
+All traces with the same number of samples and sampling rate are resampled
+together. Three methods are available:
+
+* "linear": Linear interpolation. Equivalent to numpy.interp() when
+  upsampling.
+* "lanczos": Interpolation with a Lanczos windowed sinc kernel.
+* "fft": Band limited interpolation in the frequency domain. The ratio of
+  the sampling rates has to be a fraction with a reasonably small
+  denominator. The data is assumed to be tapered as it is treated as
+  periodic.
+
+When downsampling, the kernels of the "linear" and "lanczos" methods are
+stretched by the rate ratio so they also act as the anti-aliasing filter. The
+"fft" method discards all frequencies above the new Nyquist frequency. For
+the first two methods the resampling is a sparse matrix multiplication and
+all rows of a stack with the same offset are resampled with a single
+product. If the ratio of the sampling rates is a fraction p / q, the
+interpolation weights repeat every q new samples. Only these q rows, the
+kernel, are cached per sampling rate, new sampling rate and fractional part
+of the offset. The matrices for any number of samples and integer shift are
+assembled from them.
+
+>>> resampler = Resampler(method="lanczos")
+>>> resampler.resample_traces(traces, starttime, npts=1000,
+...     sampling_rate=2.0)  # doctest: +SKIP
+
+Output samples outside the time span of the input data are set to a fill
+value.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+from collections import OrderedDict
+from fractions import Fraction
+import numpy as np
+import threading
+
+
+# The available resampling methods.
+METHODS = ("linear", "lanczos", "fft")
+
+# The half width of the Lanczos kernel in samples of the lower sampling rate.
+DEFAULT_LANCZOS_WIDTH = 10
+
+# The maximum number of kernels kept in memory.
+DEFAULT_MAX_CACHED_KERNELS = 200
+
+# The largest denominator of the rate ratio accepted by the "fft" method and
+# the largest number of rows of a cached kernel. Kernels for other ratios
+# are computed for every call.
+MAX_DENOMINATOR = 1000
+
+# Offsets are rounded to this fraction of a sample. Output samples closer
+# than this to the first or last input sample are still interpolated.
+SAMPLE_TOLERANCE = 1E-6
+
+
+class Resampler(object):
+    """
+    Resamples stacks of traces and caches the resampling kernels. Can be
+    shared between threads.
+
+    :param method: One of METHODS.
+    :param lanczos_width: The half width of the Lanczos kernel.
+    :param max_cached_kernels: The maximum number of kernels kept in
+        memory.
+    """
+    def __init__(self, method="lanczos", lanczos_width=DEFAULT_LANCZOS_WIDTH,
+            max_cached_kernels=DEFAULT_MAX_CACHED_KERNELS):
+        if method not in METHODS:
+            msg = "Unknown resampling method '%s'. Available: %s" % (
+                method, ", ".join(METHODS))
+            raise ValueError(msg)
+        self.method = method
+        self.lanczos_width = lanczos_width
+        self.max_cached_kernels = max_cached_kernels
+        self._kernels = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resample_traces(self, traces, starttime, npts, sampling_rate,
+            fill_value=0.0):
+        """
+        Resamples the traces in place. Afterwards they all start at starttime
+        and have npts samples with the given sampling rate. Traces with the
+        same number of samples and sampling rate are resampled together.
+
+        :param traces: A list of obspy Trace objects or a Stream.
+        :param starttime: The new start time.
+        :param npts: The new number of samples.
+        :param sampling_rate: The new sampling rate.
+        :param fill_value: The value of samples outside of the data.
+        """
+        groups = {}
+        for trace in traces:
+            groups.setdefault((trace.stats.npts, trace.stats.sampling_rate),
+                []).append(trace)
+
+        for (_, old_sampling_rate), group in groups.iteritems():
+            offsets = [_i.stats.starttime - starttime for _i in group]
+            data = self.resample(np.array([_i.data for _i in group],
+                dtype=np.float64), old_sampling_rate, offsets, npts,
+                sampling_rate, fill_value=fill_value)
+            for trace, trace_data in zip(group, data):
+                trace.data = trace_data
+                trace.stats.starttime = starttime
+                trace.stats.sampling_rate = sampling_rate
+
+    def resample(self, data, sampling_rate, offsets, npts,
+            new_sampling_rate, fill_value=0.0):
+        """
+        Resamples a stack of equally sized traces onto a common time axis.
+
+        Returns the resampled data as a new 2D float64 array with npts
+        columns.
+
+        :param data: 2D array with one trace per row.
+        :param sampling_rate: The sampling rate of all traces.
+        :param offsets: The time of the first sample of each row in seconds
+            relative to the first new sample. Either one value per row or a
+            single value for all rows.
+        :param npts: The new number of samples.
+        :param new_sampling_rate: The new sampling rate.
+        :param fill_value: The value of samples outside of the data.
+        """
+        data = np.array(data, dtype=np.float64, ndmin=2)
+        rows, old_npts = data.shape
+        # Offsets in samples of the original data.
+        offsets = np.round(np.ones(rows) * np.asarray(offsets,
+            dtype=np.float64) * sampling_rate / SAMPLE_TOLERANCE) * \
+            SAMPLE_TOLERANCE
+
+        result = np.empty((rows, npts), dtype=np.float64)
+        if old_npts == 0:
+            result[:] = fill_value
+            return result
+
+        # Position of every new sample in samples of the original data.
+        ratio = float(sampling_rate) / new_sampling_rate
+        positions = np.arange(npts) * ratio - offsets[:, np.newaxis]
+        outside = (positions < -SAMPLE_TOLERANCE) | \
+            (positions > old_npts - 1 + SAMPLE_TOLERANCE)
+
+        if self.method == "fft":
+            result[:] = self._resample_fft(data, sampling_rate, offsets,
+                npts, new_sampling_rate)
+        else:
+            unique_offsets, inverse = np.unique(offsets, return_inverse=True)
+            for _i, offset in enumerate(unique_offsets):
+                indices = np.nonzero(inverse == _i)[0]
+                matrix = self.get_matrix(old_npts, sampling_rate, offset,
+                    npts, new_sampling_rate)
+                # Much faster with the columns contiguous in memory.
+                result[indices] = matrix.dot(np.ascontiguousarray(
+                    data[indices].T)).T
+        result[outside] = fill_value
+        return result
+
+    def get_matrix(self, npts, sampling_rate, offset, new_npts,
+            new_sampling_rate):
+        """
+        Returns the sparse resampling matrix with new_npts rows and npts
+        columns. Assembled from the cached kernel, see get_kernel().
+
+        :param offset: The offset of the first sample in samples of the
+            original data. See resample().
+        """
+        from scipy.sparse import csr_matrix
+
+        # Position of the first new sample in samples of the original data.
+        shift = np.floor(-offset)
+        fraction = int(round((-offset - shift) / SAMPLE_TOLERANCE))
+        if fraction >= int(round(1.0 / SAMPLE_TOLERANCE)):
+            shift += 1
+            fraction = 0
+
+        kernel = self.get_kernel(sampling_rate, new_sampling_rate, fraction)
+        if kernel is None:
+            # No periodic kernel. Compute the weights of all samples.
+            ratio = float(sampling_rate) / new_sampling_rate
+            columns, weights = self._compute_weights(np.arange(new_npts) *
+                ratio + fraction * SAMPLE_TOLERANCE, ratio)
+            columns += int(shift)
+        else:
+            # Repeat the kernel, shifted by p samples every q new samples.
+            kernel_columns, kernel_weights, step = kernel
+            phases, indices = np.divmod(np.arange(new_npts),
+                len(kernel_columns))
+            columns = kernel_columns[indices] + \
+                (int(shift) + phases * step)[:, np.newaxis]
+            weights = kernel_weights[indices]
+
+        # Taps outside of the data extend it with zeros.
+        outside = (columns < 0) | (columns >= npts)
+        weights = np.where(outside, 0.0, weights)
+        columns = np.clip(columns, 0, max(npts - 1, 0))
+        taps = columns.shape[1]
+        return csr_matrix((weights.ravel(), columns.ravel(),
+            np.arange(0, new_npts * taps + 1, taps)),
+            shape=(new_npts, npts))
+
+    def get_kernel(self, sampling_rate, new_sampling_rate, fraction):
+        """
+        Returns the resampling kernel as a tuple (columns, weights, step) or
+        None if the ratio of the sampling rates is not a fraction p / q with
+        q <= MAX_DENOMINATOR. Cached per unique combination of the
+        arguments.
+
+        Row r of the 2D columns and weights arrays holds the taps of new
+        sample r. New sample r + n * q uses the same weights with the
+        columns shifted by n * step, which is p.
+
+        :param fraction: The fractional part of the position of the first
+            new sample in samples of the original data in units of
+            SAMPLE_TOLERANCE.
+        """
+        key = (float(sampling_rate), float(new_sampling_rate), fraction)
+        with self._lock:
+            kernel = self._kernels.pop(key, None)
+        if kernel is None:
+            ratio = _get_ratio(new_sampling_rate, sampling_rate)
+            if ratio is None:
+                return None
+            columns, weights = self._compute_weights(
+                np.arange(ratio.denominator) * (float(sampling_rate) /
+                new_sampling_rate) + fraction * SAMPLE_TOLERANCE,
+                float(sampling_rate) / new_sampling_rate)
+            kernel = (columns, weights, ratio.numerator)
+        with self._lock:
+            self._kernels[key] = kernel
+            while len(self._kernels) > self.max_cached_kernels:
+                self._kernels.popitem(last=False)
+        return kernel
+
+    def _compute_weights(self, positions, ratio):
+        """
+        Returns the columns and weights of the taps of every position as 2D
+        arrays with one row per position.
+
+        :param positions: The positions in samples of the original data.
+        :param ratio: The old sampling rate divided by the new one.
+        """
+        # The kernel is stretched when downsampling to act as the
+        # anti-aliasing filter.
+        scale = max(ratio, 1.0)
+        if self.method == "linear":
+            half_width = scale
+        else:
+            half_width = scale * self.lanczos_width
+        taps = np.arange(1 - int(np.ceil(half_width)),
+            int(np.ceil(half_width)) + 1)
+
+        columns = np.floor(positions).astype(np.int64)[:, np.newaxis] + taps
+        distances = (positions[:, np.newaxis] - columns) / scale
+        if self.method == "linear":
+            weights = np.clip(1.0 - np.abs(distances), 0.0, None)
+        else:
+            weights = np.sinc(distances) * \
+                np.sinc(distances / self.lanczos_width)
+            weights[np.abs(distances) >= self.lanczos_width] = 0.0
+        # Normalize before dropping the taps outside of the data so the
+        # data is effectively extended with zeros.
+        weights /= weights.sum(axis=1)[:, np.newaxis]
+        return columns, weights
+
+    def _resample_fft(self, data, sampling_rate, offsets, npts,
+            new_sampling_rate):
+        """
+        Fourier interpolation of all rows. The spectrum is cut off at the
+        new Nyquist frequency or zero padded and every row is shifted onto
+        the new time axis by a linear phase.
+        """
+        ratio = _get_ratio(sampling_rate, new_sampling_rate)
+        if ratio is None:
+            msg = ("The ratio of the sampling rates %g and %g cannot be "
+                "used with the 'fft' method. Use 'lanczos' instead.") % (
+                sampling_rate, new_sampling_rate)
+            raise ValueError(msg)
+
+        rows, old_npts = data.shape
+        # The length of the FFT has to result in an integer number of new
+        # samples.
+        nfft = ratio.denominator * int(np.ceil(float(old_npts) /
+            ratio.denominator))
+        new_nfft = nfft * ratio.numerator // ratio.denominator
+        spectra = np.fft.rfft(data, n=nfft, axis=1)
+        new_spectra = np.zeros((rows, new_nfft // 2 + 1),
+            dtype=np.complex128)
+        count = min(spectra.shape[1], new_spectra.shape[1])
+        new_spectra[:, :count] = spectra[:, :count]
+
+        # The first resampled sample of each row is the first new sample not
+        # before the start of the row. Shift the row by the remaining time.
+        new_offsets = offsets / float(sampling_rate) * new_sampling_rate
+        first_samples = np.ceil(new_offsets - SAMPLE_TOLERANCE).astype(
+            np.int64)
+        shifts = (first_samples - new_offsets) / float(new_sampling_rate)
+        frequencies = np.arange(new_spectra.shape[1]) * \
+            float(sampling_rate) / nfft
+        new_spectra *= np.exp(2j * np.pi * shifts[:, np.newaxis] *
+            frequencies)
+        resampled = np.fft.irfft(new_spectra, n=new_nfft, axis=1) * \
+            (float(new_nfft) / nfft)
+
+        indices = np.arange(npts) - first_samples[:, np.newaxis]
+        # Samples outside of the resampled data are set to the fill value
+        # by the caller.
+        indices = np.clip(indices, 0, new_nfft - 1)
+        return resampled[np.arange(rows)[:, np.newaxis], indices]
+
+
+def _get_ratio(sampling_rate, new_sampling_rate):
+    """
+    Returns new_sampling_rate / sampling_rate as a Fraction or None if it is
+    not a fraction with a denominator of at most MAX_DENOMINATOR.
+    """
+    ratio = Fraction(float(new_sampling_rate) /
+        sampling_rate).limit_denominator(MAX_DENOMINATOR)
+    # Even tiny differences add up to a time shift over many samples.
+    if abs(float(ratio) * sampling_rate - new_sampling_rate) > \
+            1E-9 * new_sampling_rate:
+        return None
+    return ratio
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Cache for the instrument responses extracted from station files.
+
+Parsing a dataless SEED or StationXML file is expensive and the same file is
+usually needed for all components of a station and many times during the
+lifetime of a project. The cache parses each file once and stores the poles
+and zeros of all channel epochs in it. StationXML files are recognized by
+their .xml extension.
+
+It has two tiers: An in-memory LRU cache of the most recently used files and
+a persistent one storing one pickle file per station file in the cache
+folder. Both are invalidated if the size, modification time or inode of the
+station file changes.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+from collections import OrderedDict
+import copy
+import cPickle
+import hashlib
+import os
+
+from lasif.tools.file_info_cache import get_file_stat, write_pickle
+
+
+# The number of station files whose responses are kept in memory.
+DEFAULT_MAX_MEMORY_FILES = 100
+
+
+class ResponseCache(object):
+    """
+    Cache for the poles and zeros of all channel epochs in dataless SEED and
+    StationXML files.
+
+    :param cache_folder: The folder for the persistent tier. If None, only
+        the in-memory tier is used.
+    :param max_memory_files: The maximum number of station files whose
+        responses are kept in memory.
+    """
+    def __init__(self, cache_folder=None,
+            max_memory_files=DEFAULT_MAX_MEMORY_FILES):
+        self.cache_folder = cache_folder
+        self.max_memory_files = max_memory_files
+        self._memory_cache = OrderedDict()
+
+    def get_paz(self, station_file, channel_id, time):
+        """
+        Returns the poles and zeros of a channel at a certain time as a
+        dictionary in the format returned by obspy.xseed.Parser.getPAZ().
+
+        :param station_file: The dataless SEED or StationXML file.
+        :param channel_id: The id of the channel.
+        :param time: The time as a UTCDateTime object.
+        """
+        epochs = self._get_epochs(station_file).get(channel_id, [])
+        timestamp = time.timestamp
+        for start_date, end_date, paz in epochs:
+            if start_date <= timestamp and \
+                    (end_date is None or timestamp < end_date):
+                break
+        else:
+            paz = None
+        if paz is None:
+            msg = "No poles and zeros for channel '%s' at %s in '%s'." % (
+                channel_id, str(time), station_file)
+            raise ValueError(msg)
+        # The caller might modify it.
+        return copy.deepcopy(paz)
+
+    def clear(self):
+        """
+        Clears the in-memory tier.
+        """
+        self._memory_cache.clear()
+
+    def _get_epochs(self, station_file):
+        """
+        Returns a dictionary with a list of (start_date, end_date, paz)
+        tuples per channel of the station file. The dates are POSIX
+        timestamps, open end dates are None.
+        """
+        station_file = os.path.abspath(station_file)
+        stat = get_file_stat(station_file)
+
+        # In-memory tier.
+        entry = self._memory_cache.pop(station_file, None)
+        if entry is not None and entry[0] == stat:
+            self._memory_cache[station_file] = entry
+            return entry[1]
+
+        # Persistent tier.
+        epochs = None
+        pickle_file = self._get_pickle_filename(station_file)
+        if pickle_file and os.path.exists(pickle_file):
+            try:
+                with open(pickle_file, "rb") as open_file:
+                    content = cPickle.load(open_file)
+                if content["filename"] == station_file and \
+                        content["stat"] == stat:
+                    epochs = content["epochs"]
+            except Exception:
+                # Corrupt or incompatible. Will be overwritten.
+                pass
+
+        if epochs is None:
+            if station_file.lower().endswith(".xml"):
+                epochs = _parse_stationxml_file(station_file)
+            else:
+                epochs = _parse_seed_file(station_file)
+            if pickle_file:
+                write_pickle(pickle_file, {"filename": station_file,
+                    "stat": stat, "epochs": epochs})
+
+        self._memory_cache[station_file] = (stat, epochs)
+        while len(self._memory_cache) > self.max_memory_files:
+            self._memory_cache.popitem(last=False)
+        return epochs
+
+    def _get_pickle_filename(self, station_file):
+        if self.cache_folder is None:
+            return None
+        return os.path.join(self.cache_folder, "%s.pickle" %
+            hashlib.md5(station_file).hexdigest())
+
+
+def _parse_seed_file(filename):
+    """
+    Parses a dataless SEED file and extracts the poles and zeros of all
+    channel epochs.
+
+    Returns a dictionary with a list of (start_date, end_date, paz) tuples
+    per channel id. paz is None for epochs without poles and zeros.
+    """
+    from obspy.xseed import Parser
+
+    parser = Parser(filename)
+    epochs = {}
+    for channel in parser.getInventory()["channels"]:
+        start_date = channel["start_date"]
+        end_date = channel["end_date"] or None
+        try:
+            paz = parser.getPAZ(channel["channel_id"], start_date)
+        except Exception:
+            paz = None
+        epochs.setdefault(str(channel["channel_id"]), []).append((
+            start_date.timestamp,
+            end_date.timestamp if end_date is not None else None, paz))
+    return epochs
+
+
+def _parse_stationxml_file(filename):
+    """
+    Parses a StationXML file and extracts the poles and zeros of all channel
+    epochs. Returns the same structure as _parse_seed_file().
+    """
+    from lasif.tools import stationxml_parser
+
+    epochs = {}
+    for channel in stationxml_parser.iter_channels(filename,
+            include_response=True):
+        end_date = channel["end_date"]
+        epochs.setdefault(str(channel["channel_id"]), []).append((
+            channel["start_date"].timestamp,
+            end_date.timestamp if end_date is not None else None,
+            channel["paz"]))
+    return epochs
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Detrending, tapering and filtering of many traces at once.
+
+Traces with the same number of samples and sampling rate are stacked into a
+2D array which is processed along its second axis with a few array
+operations. Butterworth filters are designed only once per filter type,
+sampling rate, corner frequencies and number of corners and are applied as
+second order sections, which are numerically more stable than the transfer
+function coefficients used by obspy.
+
+>>> detrend_traces(stream)
+>>> taper_traces(stream, max_percentage=0.05)
+>>> filter_traces(stream, "bandpass", freqmin=0.01, freqmax=0.1)
+
+All functions operate in place and convert the data to float64.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import numpy as np
+import warnings
+
+
+# The available filter types.
+FILTER_TYPES = ("bandpass", "lowpass", "highpass")
+
+# The designed filters, see get_sos(). There are only a few distinct filters
+# per project so the cache is not limited.
+_SOS_CACHE = {}
+
+
+def get_sos(filter_type, sampling_rate, freqmin=None, freqmax=None,
+        corners=4):
+    """
+    Returns the second order sections of a Butterworth filter or None if the
+    filter does not change the data. Cached per unique combination of the
+    arguments.
+
+    :param filter_type: One of FILTER_TYPES.
+    :param sampling_rate: The sampling rate of the data.
+    :param freqmin: The lower corner frequency. Required for bandpass and
+        highpass filters.
+    :param freqmax: The upper corner frequency. Required for bandpass and
+        lowpass filters.
+    :param corners: The number of corners.
+    """
+    key = (filter_type, float(sampling_rate), freqmin, freqmax, corners)
+    try:
+        return _SOS_CACHE[key]
+    except KeyError:
+        pass
+
+    from scipy.signal import iirfilter
+
+    if filter_type not in FILTER_TYPES:
+        msg = "Unknown filter type '%s'. Available: %s" % (filter_type,
+            ", ".join(FILTER_TYPES))
+        raise ValueError(msg)
+    if filter_type == "bandpass" and freqmin >= freqmax:
+        msg = ("The low corner frequency %g Hz must be below the high corner "
+            "frequency %g Hz.") % (freqmin, freqmax)
+        raise ValueError(msg)
+    nyquist = 0.5 * sampling_rate
+    # Same behaviour as obspy for corner frequencies above Nyquist.
+    if filter_type == "bandpass" and freqmax >= nyquist:
+        msg = ("Selected high corner frequency is above Nyquist. "
+            "Applying a highpass instead.")
+        warnings.warn(msg)
+        filter_type = "highpass"
+    if filter_type == "lowpass" and freqmax >= nyquist:
+        msg = ("Selected corner frequency is above Nyquist. The data is "
+            "not filtered.")
+        warnings.warn(msg)
+        sos = None
+    elif filter_type in ("bandpass", "highpass") and freqmin >= nyquist:
+        msg = "Selected low corner frequency is above Nyquist."
+        raise ValueError(msg)
+    elif filter_type == "bandpass":
+        sos = iirfilter(corners, [freqmin / nyquist, freqmax / nyquist],
+            btype="band", ftype="butter", output="sos")
+    elif filter_type == "lowpass":
+        sos = iirfilter(corners, freqmax / nyquist, btype="lowpass",
+            ftype="butter", output="sos")
+    else:
+        sos = iirfilter(corners, freqmin / nyquist, btype="highpass",
+            ftype="butter", output="sos")
+    if sos is not None:
+        # Make sure it cannot be modified by accident.
+        sos.flags.writeable = False
+    _SOS_CACHE[key] = sos
+    return sos
+
+
+def filter_stack(data, sos, zerophase=False):
+    """
+    Filters every row of a 2D array. Returns a new array.
+
+    :param data: 2D array with one trace per row.
+    :param sos: The second order sections, see get_sos().
+    :param zerophase: If True, the filter is applied forwards and backwards
+        with scipy.signal.sosfiltfilt() which doubles the filter order and
+        results in no phase shift.
+    """
+    from scipy.signal import sosfilt, sosfiltfilt
+
+    data = np.array(data, dtype=np.float64, ndmin=2)
+    if sos is None:
+        return data
+    if zerophase:
+        return sosfiltfilt(sos, data, axis=1)
+    return sosfilt(sos, data, axis=1)
+
+
+def detrend_stack(data):
+    """
+    Removes the least squares line from every row of a 2D array. Returns a
+    new array.
+    """
+    from scipy.signal import detrend
+
+    data = np.array(data, dtype=np.float64, ndmin=2)
+    if data.shape[1] < 2:
+        return data - data.mean(axis=1)[:, np.newaxis]
+    return detrend(data, axis=1, type="linear")
+
+
+def taper_stack(data, max_percentage=0.05):
+    """
+    Applies a cosine taper to every row of a 2D array. Returns a new array.
+
+    :param data: 2D array with one trace per row.
+    :param max_percentage: The tapered fraction at each end.
+    """
+    from obspy.signal.invsim import cosTaper
+
+    data = np.array(data, dtype=np.float64, ndmin=2)
+    if data.shape[1] < 2:
+        return data
+    return data * cosTaper(data.shape[1], 2.0 * max_percentage)
+
+
+def filter_traces(traces, filter_type, freqmin=None, freqmax=None,
+        corners=4, zerophase=False):
+    """
+    Filters the traces in place. See get_sos() and filter_stack() for the
+    arguments.
+    """
+    for (_, sampling_rate), group in _group_traces(traces):
+        sos = get_sos(filter_type, sampling_rate, freqmin=freqmin,
+            freqmax=freqmax, corners=corners)
+        _set_data(group, filter_stack(_get_data(group), sos,
+            zerophase=zerophase))
+
+
+def detrend_traces(traces):
+    """
+    Removes the least squares line from the traces in place.
+    """
+    for _, group in _group_traces(traces):
+        _set_data(group, detrend_stack(_get_data(group)))
+
+
+def taper_traces(traces, max_percentage=0.05):
+    """
+    Applies a cosine taper to the traces in place.
+
+    :param max_percentage: The tapered fraction at each end.
+    """
+    for _, group in _group_traces(traces):
+        _set_data(group, taper_stack(_get_data(group), max_percentage))
+
+
+def _group_traces(traces):
+    """
+    Returns a list of ((npts, sampling_rate), traces) tuples.
+    """
+    groups = {}
+    for trace in traces:
+        groups.setdefault((trace.stats.npts, trace.stats.sampling_rate),
+            []).append(trace)
+    return [_i for _i in groups.iteritems() if _i[0][0]]
+
+
+def _get_data(traces):
+    return np.array([_i.data for _i in traces], dtype=np.float64)
+
+
+def _set_data(traces, data):
+    for trace, trace_data in zip(traces, data):
+        trace.data = trace_data
@@ -12,7 +12,18 @@ Some basic utility to parse RESP files.
 from obspy import UTCDateTime
 
 
-def get_inventory(resp_file, remove_duplicates=False):
+# Blockettes and fields describing a channel in RESP files and the
+# corresponding keys.
+CHANNEL_FIELDS = {
+    "B050F03": "station",
+    "B050F16": "network",
+    "B052F03": "location",
+    "B052F04": "channel",
+    "B052F22": "start_date",
+    "B052F23": "end_date"}
+
+
+def get_inventory(resp_file, remove_duplicates=False, include_offsets=False):
     """
     Simple function reading a RESP file and returning a list of dictionaries.
     Each dictionary contains the following keys for each channel found in the
@@ -29,59 +40,95 @@ def get_inventory(resp_file, remove_duplicates=False):
     :param resp_file: Resp file to open.
     :param remove_duplicates: Some RESP files contain the same values twice.
         This option the duplicates. Defaults to False.
+    :param include_offsets: If True, every dictionary also contains the
+        "offset" and "length" of the channel's block in bytes. See
+        iter_channel_blocks().
     """
     channels = []
-    with open(resp_file, "rt") as open_file:
+    seen = set()
+    for channel in iter_channel_blocks(resp_file):
+        # Make unique list if requested.
+        if remove_duplicates is True:
+            # UTCDateTime objects are not hashable.
+            key = (channel["network"], channel["station"],
+                channel["location"], channel["channel"]) + tuple(
+                _i.timestamp if _i is not None else None
+                for _i in (channel["start_date"], channel["end_date"]))
+            if key in seen:
+                continue
+            seen.add(key)
+        if include_offsets is not True:
+            del channel["offset"]
+            del channel["length"]
+        channels.append(channel)
+    return channels
+
+
+def iter_channel_blocks(resp_file):
+    """
+    Generator streaming through a RESP file and yielding one dictionary per
+    channel block. The dictionaries have the same keys as the ones returned
+    by get_inventory() and additionally the byte "offset" and "length" of
+    the block in the file.
+
+    A block starts with the first line of a channel header and ends right
+    before the header of the next channel. Reading just the block is thus
+    sufficient to evaluate the response of a channel, see read_block().
+    """
+    with open(resp_file, "rb") as open_file:
         current_channel = {}
+        block_start = None
+        pending = None
+        offset = 0
         for line in open_file:
-            line = line.strip().upper()
-            if line.startswith("B050F03"):
-                current_channel["station"] = line.split()[-1]
-                if _is_channel_complete(current_channel):
-                    channels.append(current_channel)
-                    current_channel = {}
-            elif line.startswith("B050F16"):
-                current_channel["network"] = line.split()[-1]
-                if _is_channel_complete(current_channel):
-                    channels.append(current_channel)
-                    current_channel = {}
-            elif line.startswith("B052F03"):
-                location = line.split()[-1]
-                if location == "??":
-                    location = ""
-                current_channel["location"] = location
-                if _is_channel_complete(current_channel):
-                    channels.append(current_channel)
-                    current_channel = {}
-            elif line.startswith("B052F04"):
-                current_channel["channel"] = line.split()[-1]
-                if _is_channel_complete(current_channel):
-                    channels.append(current_channel)
-                    current_channel = {}
-            elif line.startswith("B052F22"):
-                current_channel["start_date"] = _parse_resp_datetime_string(
-                    line.split()[-1])
-                if _is_channel_complete(current_channel):
-                    channels.append(current_channel)
-                    current_channel = {}
-            elif line.startswith("B052F23"):
-                current_channel["end_date"] = _parse_resp_datetime_string(
-                    line.split()[-1])
-                if _is_channel_complete(current_channel):
-                    channels.append(current_channel)
-                    current_channel = {}
-    for channel in channels:
-        channel["channel_id"] = "{network}.{station}.{location}.{channel}"\
-            .format(**channel)
-    # Make unique list if requested.
-    if remove_duplicates is True:
-        unique_list = []
-        for channel in channels:
-            if channel in unique_list:
+            line_offset = offset
+            offset += len(line)
+            # Only the few channel header lines are of interest. Avoid
+            # stripping and uppercasing all other lines.
+            if line[:1] not in "Bb":
+                if line[:1] not in " \t":
+                    continue
+                line = line.lstrip()
+            field = CHANNEL_FIELDS.get(line[:7].upper())
+            if field is None:
                 continue
-            unique_list.append(channel)
-        channels = unique_list
-    return channels
+
+            if block_start is None:
+                block_start = line_offset
+                # The previous block ends where this one starts.
+                if pending is not None:
+                    pending["length"] = line_offset - pending["offset"]
+                    yield pending
+                    pending = None
+
+            value = line.split()[-1].upper()
+            if field in ("start_date", "end_date"):
+                value = _parse_resp_datetime_string(value)
+            elif field == "location" and value == "??":
+                value = ""
+            current_channel[field] = value
+
+            if _is_channel_complete(current_channel):
+                current_channel["channel_id"] = \
+                    "{network}.{station}.{location}.{channel}".format(
+                        **current_channel)
+                current_channel["offset"] = block_start
+                pending = current_channel
+                current_channel = {}
+                block_start = None
+        if pending is not None:
+            pending["length"] = offset - pending["offset"]
+            yield pending
+
+
+def read_block(resp_file, offset, length):
+    """
+    Returns the block of a single channel of a RESP file as a string without
+    reading the rest of the file.
+    """
+    with open(resp_file, "rb") as open_file:
+        open_file.seek(offset, 0)
+        return open_file.read(length)
 
 
 def _is_channel_complete(channel_dict):
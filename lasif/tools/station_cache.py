@@ -9,9 +9,9 @@ Station Cache class.
     GNU General Public License, Version 3
     (http://www.gnu.org/copyleft/gpl.html)
 """
-import glob
+from bisect import bisect_left
+from itertools import izip, repeat
 from obspy.xseed import Parser
-import os
 
 from lasif.tools import simple_resp_parser
 from lasif.tools.file_info_cache import FileInfoCache
@@ -21,9 +21,18 @@ class StationCache(FileInfoCache):
     """
     Cache for Station files.
 
-    Currently supports SEED, XML-SEED and RESP files.
+    Currently supports SEED, XML-SEED, RESP and StationXML files. The
+    StationXML folder is optional.
+
+    Additionally maintains a materialized stations table with one row per
+    station and the coordinates of the station. Triggers on the indices
+    table record which channels changed and only the stations of these
+    channels are refreshed at the end of each write transaction.
+
+    All further keyword arguments are passed on to the FileInfoCache.
     """
-    def __init__(self, cache_db_file, seed_folder, resp_folder):
+    def __init__(self, cache_db_file, seed_folder, resp_folder,
+            stationxml_folder=None, **kwargs):
         self.index_values = [
             ("channel_id", "TEXT"),
             ("start_date", "INTEGER"),
@@ -31,29 +40,151 @@ class StationCache(FileInfoCache):
             ("latitude", "REAL"),
             ("longitude", "REAL"),
             ("elevation_in_m", "REAL"),
-            ("local_depth_in_m", "REAL")]
+            ("local_depth_in_m", "REAL"),
+            # The location of the channel's block in RESP files.
+            ("offset", "INTEGER"),
+            ("length", "INTEGER")]
 
-        self.filetypes = ["seed", "resp"]
+        self.filetypes = ["seed", "resp", "stationxml"]
+
+        self.indexed_columns = [("channel_id", "start_date")]
 
         self.seed_folder = seed_folder
         self.resp_folder = resp_folder
+        self.stationxml_folder = stationxml_folder
+
+        # In-memory index of all channel epochs and the change token of the
+        # cache at the time it was built.
+        self._epoch_index = None
+        self._epoch_index_token = None
+
+        super(StationCache, self).__init__(cache_db_file=cache_db_file,
+            **kwargs)
+
+    def _create_tables(self):
+        """
+        Creates the tables of the FileInfoCache and the stations table
+        together with the triggers keeping track of changed channels.
+        """
+        is_rebuild = not self._has_current_schema()
+        tables = [_i[0] for _i in self.db_cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table';")]
+        super(StationCache, self)._create_tables()
+        if is_rebuild:
+            self.db_cursor.execute("DROP TABLE IF EXISTS stations;")
+            self.db_cursor.execute("DROP TABLE IF EXISTS dirty_channels;")
+        is_populated = not is_rebuild and "stations" in tables
 
-        super(StationCache, self).__init__(cache_db_file=cache_db_file)
+        self.db_cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stations (
+                station_id TEXT PRIMARY KEY,
+                network TEXT,
+                station TEXT,
+                latitude REAL,
+                longitude REAL,
+                elevation_in_m REAL,
+                local_depth_in_m REAL,
+                channel_count INTEGER
+            );
+        """)
+        self.db_cursor.execute("CREATE INDEX IF NOT EXISTS "
+            "stations_coordinates ON stations(latitude, longitude);")
+        self.db_cursor.execute("""
+            CREATE TABLE IF NOT EXISTS dirty_channels (
+                channel_id TEXT PRIMARY KEY
+            );
+        """)
+        self.db_cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS indices_insert_dirty_channels
+            AFTER INSERT ON indices
+            BEGIN
+                INSERT OR IGNORE INTO dirty_channels(channel_id)
+                VALUES (NEW.channel_id);
+            END;
+        """)
+        # Also fires for rows deleted by the foreign key constraint.
+        self.db_cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS indices_delete_dirty_channels
+            AFTER DELETE ON indices
+            BEGIN
+                INSERT OR IGNORE INTO dirty_channels(channel_id)
+                VALUES (OLD.channel_id);
+            END;
+        """)
+        self.db_cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS indices_update_dirty_channels
+            AFTER UPDATE ON indices
+            BEGIN
+                INSERT OR IGNORE INTO dirty_channels(channel_id)
+                VALUES (OLD.channel_id);
+                INSERT OR IGNORE INTO dirty_channels(channel_id)
+                VALUES (NEW.channel_id);
+            END;
+        """)
+
+        # Existing databases without the stations table.
+        if not is_populated:
+            self.db_cursor.execute("INSERT OR IGNORE INTO dirty_channels"
+                "(channel_id) SELECT DISTINCT channel_id FROM indices;")
+            self._refresh_stations()
+
+    def _get_schema_object_names(self):
+        return super(StationCache, self)._get_schema_object_names() + [
+            "stations", "stations_coordinates", "dirty_channels",
+            "indices_insert_dirty_channels", "indices_delete_dirty_channels",
+            "indices_update_dirty_channels"]
+
+    def _before_commit(self):
+        self._refresh_stations()
+
+    def _refresh_stations(self):
+        """
+        Recomputes the rows of the stations table for all stations with
+        changed channels. The coordinates of a station are the ones of its
+        first indexed channel with coordinates.
+        """
+        station_ids = set(".".join(_i[0].split(".")[:2]) for _i in
+            self.db_cursor.execute("SELECT channel_id FROM dirty_channels;")
+            if _i[0])
+        for station_id in station_ids:
+            # Range query on the indexed channel ids of the station. "/"
+            # directly follows "." in ASCII.
+            channels = self.db_cursor.execute("""
+                SELECT channel_id, latitude, longitude, elevation_in_m,
+                    local_depth_in_m
+                FROM indices
+                WHERE channel_id >= ? AND channel_id < ?
+                ORDER BY id;""", (station_id + ".",
+                station_id + "/")).fetchall()
+            if not channels:
+                self.db_cursor.execute("DELETE FROM stations WHERE "
+                    "station_id = ?;", (station_id,))
+                continue
+            coordinates = [None] * 4
+            for channel in channels:
+                if channel[1] is not None and channel[2] is not None:
+                    coordinates = list(channel[1:])
+                    break
+            network, station = (station_id.split(".") + [""])[:2]
+            self.db_cursor.execute("INSERT OR REPLACE INTO stations "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?);", [station_id, network,
+                station] + coordinates + [len(set(_i[0] for _i in
+                channels))])
+        self.db_cursor.execute("DELETE FROM dirty_channels;")
 
     def _find_files_seed(self):
-        seed_files = []
         # Get all dataless SEED files.
-        for filename in glob.iglob(os.path.join(self.seed_folder,
-                "dataless.*")):
-            seed_files.append(filename)
-        return seed_files
+        return self._glob_folder(self.seed_folder, "dataless.*")
 
     def _find_files_resp(self):
-        resp_files = []
         # Get all RESP files
-        for filename in glob.iglob(os.path.join(self.resp_folder, "RESP.*")):
-            resp_files.append(filename)
-        return resp_files
+        return self._glob_folder(self.resp_folder, "RESP.*")
+
+    def _find_files_stationxml(self):
+        # Get all StationXML files.
+        if self.stationxml_folder is None:
+            return []
+        return self._glob_folder(self.stationxml_folder, "*.xml")
 
     def _extract_index_values_seed(self, filename):
         """
@@ -69,21 +200,41 @@ class StationCache(FileInfoCache):
         channels = [[_i["channel_id"], int(_i["start_date"].timestamp),
             int(_i["end_date"].timestamp) if _i["end_date"] else None,
             _i["latitude"], _i["longitude"], _i["elevation_in_m"],
-            _i["local_depth_in_m"]] for _i in channels]
+            _i["local_depth_in_m"], None, None] for _i in channels]
 
         return channels
 
     def _extract_index_values_resp(self, filename):
         try:
             channels = simple_resp_parser.get_inventory(filename,
-                remove_duplicates=True)
+                remove_duplicates=True, include_offsets=True)
         except:
             msg = "Could not read RESP file '%s'." % filename
             raise ValueError(msg)
 
         channels = [[_i["channel_id"], int(_i["start_date"].timestamp),
             int(_i["end_date"].timestamp) if _i["end_date"] else None,
-            None, None, None, None] for _i in channels]
+            None, None, None, None, _i["offset"], _i["length"]]
+            for _i in channels]
+
+        return channels
+
+    def _extract_index_values_stationxml(self, filename):
+        """
+        Streams through StationXML files without creating an inventory.
+        """
+        from lasif.tools import stationxml_parser
+
+        try:
+            channels = list(stationxml_parser.iter_channels(filename))
+        except:
+            msg = "Could not read StationXML file '%s'." % filename
+            raise ValueError(msg)
+
+        channels = [[_i["channel_id"], int(_i["start_date"].timestamp),
+            int(_i["end_date"].timestamp) if _i["end_date"] else None,
+            _i["latitude"], _i["longitude"], _i["elevation_in_m"],
+            _i["local_depth_in_m"], None, None] for _i in channels]
 
         return channels
 
@@ -91,9 +242,11 @@ class StationCache(FileInfoCache):
         """
         Returns a dictionary containing all channels.
         """
+        self._ensure_up_to_date()
         channels = {}
-        for channel in self.db_cursor.execute("SELECT * FROM indices")\
-                .fetchall():
+        for channel in self.db_cursor.execute("SELECT id, channel_id, "
+                "start_date, end_date, latitude, longitude, elevation_in_m, "
+                "local_depth_in_m FROM indices").fetchall():
             channels.setdefault(channel[1], [])
             channels[channel[1]].append({
                 "startime_timestamp": channel[2],
@@ -108,51 +261,172 @@ class StationCache(FileInfoCache):
     def get_stations(self):
         """
         Returns a dictionary containing the coordinates of all stations. For
-        every station, the first matching channel is chosen and the coordinates
-        of the channel are taken.
-        """
-        stations = {}
-        for channel in self.db_cursor.execute("SELECT * FROM indices")\
-                .fetchall():
-            station_id = ".".join(channel[1].split(".")[:2])
-            if station_id in stations:
-                continue
-            stations[station_id] = {
-                "latitude": channel[4],
-                "longitude": channel[5],
-            }
-        return stations
+        every station, the first channel with coordinates is chosen and the
+        coordinates of the channel are taken.
+        """
+        self._ensure_up_to_date()
+        return self._get_stations_dict(self.db_cursor.execute("""
+            SELECT station_id, latitude, longitude, elevation_in_m,
+                local_depth_in_m
+            FROM stations;"""))
+
+    def get_stations_in_bounding_box(self, minimum_latitude,
+            maximum_latitude, minimum_longitude, maximum_longitude):
+        """
+        Returns the same as get_stations() but only for stations within the
+        given bounds. Uses the index on the coordinates of the stations
+        table.
+
+        If minimum_longitude is larger than maximum_longitude, the box is
+        assumed to cross the antimeridian.
+        """
+        self._ensure_up_to_date()
+        if minimum_longitude <= maximum_longitude:
+            longitude_clause = "longitude >= ? AND longitude <= ?"
+        else:
+            longitude_clause = "(longitude >= ? OR longitude <= ?)"
+        return self._get_stations_dict(self.db_cursor.execute("""
+            SELECT station_id, latitude, longitude, elevation_in_m,
+                local_depth_in_m
+            FROM stations
+            WHERE latitude >= ? AND latitude <= ? AND %s;""" %
+            longitude_clause, (minimum_latitude, maximum_latitude,
+            minimum_longitude, maximum_longitude)))
+
+    def _get_stations_dict(self, rows):
+        return {str(_i[0]): {
+            "latitude": _i[1],
+            "longitude": _i[2],
+            "elevation_in_m": _i[3],
+            "local_depth_in_m": _i[4]} for _i in rows}
 
     def get_station_filename(self, channel_id, time):
         """
         Returns the filename for the requested channel and time.
         """
+        self._ensure_up_to_date()
         time = int(time.timestamp)
         sql_query = """
         SELECT files.filename FROM indices
         INNER JOIN files
         ON indices.filepath_id=files.id
-        WHERE (indices.channel_id = '%s') AND (indices.start_date < %i) AND
-            ((indices.end_date IS NULL) OR (indices.end_date > %i))
+        WHERE (indices.channel_id = ?) AND (indices.start_date < ?) AND
+            ((indices.end_date IS NULL) OR (indices.end_date > ?))
         LIMIT 1;
-        """ % (channel_id, time, time)
-        try:
-            return self.db_cursor.execute(sql_query).fetchone()[0]
-        except:
+        """
+        result = self.db_cursor.execute(sql_query,
+            (channel_id, time, time)).fetchone()
+        if result is None:
             return None
+        return result[0]
+
+    def _get_epoch_index(self):
+        """
+        Returns a dictionary mapping every channel id to a tuple of three
+        lists: the start dates, the end dates and the (filename, offset,
+        length) tuples of all its epochs sorted by start date. Open end dates
+        are infinite.
+
+        The index is built with a single query and reused until the cache
+        changes.
+        """
+        token = self.get_change_token()
+        if self._epoch_index is not None and \
+                self._epoch_index_token == token:
+            return self._epoch_index
+
+        infinity = float("inf")
+        index = {}
+        for channel_id, start_date, end_date, offset, length, filename in \
+                self.db_conn.execute("""
+                SELECT indices.channel_id, indices.start_date,
+                    indices.end_date, indices.offset, indices.length,
+                    files.filename
+                FROM indices
+                INNER JOIN files
+                ON indices.filepath_id=files.id
+                ORDER BY indices.channel_id, indices.start_date;"""):
+            try:
+                epochs = index[channel_id]
+            except KeyError:
+                epochs = index[channel_id] = ([], [], [])
+            epochs[0].append(start_date)
+            epochs[1].append(end_date if end_date is not None else infinity)
+            epochs[2].append((filename, offset, length))
+
+        self._epoch_index = index
+        self._epoch_index_token = token
+        return index
+
+    def get_station_filenames(self, channel_ids, times):
+        """
+        Returns the filenames for many channels and times at once. Much
+        faster than calling get_station_filename() for each of them.
+
+        Returns a list with one filename per channel id. It is None for
+        channels without information for the requested time.
+
+        :param channel_ids: The channel ids.
+        :param times: One time per channel id or a single time for all of
+            them. Either UTCDateTime objects or POSIX timestamps.
+        """
+        return [_i[0] if _i is not None else None for _i in
+            self.get_station_file_blocks(channel_ids, times)]
+
+    def get_station_file_blocks(self, channel_ids, times):
+        """
+        Same as get_station_filenames() but returns (filename, offset,
+        length) tuples. For RESP files, offset and length are the location
+        of the channel's block in bytes, see
+        simple_resp_parser.read_block(). They are None for all other files.
+        """
+        index = self._get_epoch_index()
+        if not hasattr(times, "__iter__"):
+            times = repeat(times)
+
+        blocks = []
+        for channel_id, time in izip(channel_ids, times):
+            epochs = index.get(channel_id)
+            if epochs is None:
+                blocks.append(None)
+                continue
+            # Same semantics as get_station_filename().
+            time = int(getattr(time, "timestamp", time))
+            start_dates, end_dates, epoch_files = epochs
+            # Go backwards from the last epoch starting before the time.
+            # Epochs very rarely overlap so this is usually a single step.
+            block = None
+            for _i in xrange(bisect_left(start_dates, time) - 1, -1, -1):
+                if end_dates[_i] > time:
+                    block = epoch_files[_i]
+                    break
+            blocks.append(block)
+        return blocks
+
+    def station_infos_available(self, channel_ids, times):
+        """
+        Checks if information for many channel ids and times is available.
+        Returns a list of booleans.
+
+        Takes the same arguments as get_station_filenames().
+        """
+        return [_i is not None for _i in
+            self.get_station_filenames(channel_ids, times)]
 
     def station_info_available(self, channel_id, time):
         """
         Checks if information for the requested channel_id and time is
         available.
         """
+        self._ensure_up_to_date()
         time = int(time.timestamp)
         sql_query = """
         SELECT id FROM indices
-        WHERE (channel_id = '%s') AND (start_date < %i) AND
-            ((end_date IS NULL) OR (end_date > %i))
+        WHERE (channel_id = ?) AND (start_date < ?) AND
+            ((end_date IS NULL) OR (end_date > ?))
         LIMIT 1;
-        """ % (channel_id, time, time)
-        if self.db_cursor.execute(sql_query).fetchone():
+        """
+        if self.db_cursor.execute(sql_query,
+                (channel_id, time, time)).fetchone():
             return True
         return False
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Streaming parser for FDSN StationXML files.
+
+Only extracts what is needed for the station cache and the instrument
+correction. The file is parsed incrementally and every channel element is
+discarded once it has been processed, so even huge files never have to be
+held in memory completely.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+from lxml import etree
+import math
+from obspy import UTCDateTime
+
+
+def iter_channels(stationxml_file, include_response=False):
+    """
+    Generator yielding one dictionary per channel epoch in the StationXML
+    file with the following keys:
+
+        * network
+        * station
+        * location
+        * channel
+        * channel_id
+        * start_date (UTCDateTime)
+        * end_date (UTCDateTime or None)
+        * latitude
+        * longitude
+        * elevation_in_m
+        * local_depth_in_m
+
+    :param stationxml_file: The StationXML file.
+    :param include_response: If True, every dictionary additionally has a
+        "paz" key with the poles and zeros of the channel in the format
+        returned by obspy.xseed.Parser.getPAZ() or None if the channel has no
+        poles and zeros stage.
+    """
+    network = None
+    station = None
+    for event, element in etree.iterparse(stationxml_file,
+            events=("start", "end")):
+        tag = _get_local_name(element.tag)
+        if event == "start":
+            if tag == "Network":
+                network = element.get("code")
+            elif tag == "Station":
+                station = element.get("code")
+            continue
+
+        if tag == "Channel":
+            location = element.get("locationCode") or ""
+            channel = element.get("code")
+            end_date = element.get("endDate")
+            info = {
+                "network": network,
+                "station": station,
+                "location": location,
+                "channel": channel,
+                "channel_id": "%s.%s.%s.%s" % (network, station, location,
+                    channel),
+                "start_date": UTCDateTime(element.get("startDate")),
+                "end_date": UTCDateTime(end_date) if end_date else None,
+                "latitude": get_float(element, "Latitude"),
+                "longitude": get_float(element, "Longitude"),
+                "elevation_in_m": get_float(element, "Elevation"),
+                "local_depth_in_m": get_float(element, "Depth")}
+            if include_response:
+                info["paz"] = _get_paz(element)
+            yield info
+            # Free the memory of the already processed channel.
+            element.clear()
+        elif tag == "Station":
+            element.clear()
+
+
+def _get_local_name(tag):
+    """
+    Strips the namespace from a tag.
+    """
+    if not isinstance(tag, basestring):
+        # Comments and processing instructions.
+        return None
+    return tag.rsplit("}", 1)[-1]
+
+
+def find_children(element, name):
+    """
+    Returns all direct children of an element with the given local name.
+    """
+    return [_i for _i in element if _get_local_name(_i.tag) == name]
+
+
+def find_child(element, name):
+    """
+    Returns the first direct child with the given local name or None.
+    """
+    children = find_children(element, name)
+    return children[0] if children else None
+
+
+def get_float(element, name):
+    """
+    Returns the text of the first direct child with the given local name as
+    a float or None if it does not exist.
+    """
+    child = find_child(element, name)
+    if child is None or child.text is None:
+        return None
+    return float(child.text)
+
+
+def _get_paz(channel_element):
+    """
+    Extracts the poles and zeros of the first stage and the overall
+    sensitivity. Poles and zeros in Hertz are converted to radians per
+    second and responses to displacement are converted to velocity
+    following the SEED convention.
+    """
+    response = find_child(channel_element, "Response")
+    if response is None:
+        return None
+    sensitivity = find_child(response, "InstrumentSensitivity")
+    if sensitivity is None:
+        return None
+
+    pz_stage = None
+    for stage in find_children(response, "Stage"):
+        pz_stage = find_child(stage, "PolesZeros")
+        if pz_stage is not None:
+            break
+    if pz_stage is None:
+        return None
+
+    def get_complex_numbers(name):
+        return [complex(get_float(_i, "Real"), get_float(_i, "Imaginary"))
+            for _i in find_children(pz_stage, name)]
+
+    poles = get_complex_numbers("Pole")
+    zeros = get_complex_numbers("Zero")
+    gain = get_float(pz_stage, "NormalizationFactor")
+    if gain is None:
+        gain = 1.0
+
+    transfer_function = find_child(pz_stage, "PzTransferFunctionType")
+    if transfer_function is not None and transfer_function.text and \
+            "HERTZ" in transfer_function.text.upper():
+        two_pi = 2.0 * math.pi
+        poles = [_i * two_pi for _i in poles]
+        zeros = [_i * two_pi for _i in zeros]
+        gain *= two_pi ** (len(poles) - len(zeros))
+
+    input_units = find_child(pz_stage, "InputUnits")
+    if input_units is not None:
+        input_units = find_child(input_units, "Name")
+    if input_units is not None and input_units.text and \
+            input_units.text.strip().upper() == "M" and 0j in zeros:
+        zeros.remove(0j)
+
+    stage_gain = None
+    stage = pz_stage.getparent()
+    stage_gain_element = find_child(stage, "StageGain")
+    if stage_gain_element is not None:
+        stage_gain = get_float(stage_gain_element, "Value")
+
+    return {
+        "poles": poles,
+        "zeros": zeros,
+        "gain": gain,
+        "sensitivity": get_float(sensitivity, "Value"),
+        "seismometer_gain": stage_gain}
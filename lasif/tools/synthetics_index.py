@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Index of the synthetic waveform files of one event and simulation.
+
+SES3D names its output files after the station, padded with underscores,
+and the component, e.g. "BW.FURT___.x". The index maps every station id to
+its components and files:
+
+>>> index = get_synthetics_index(folder, cache_folder)
+>>> index["BW.FURT"]  # doctest: +SKIP
+{'X': '.../BW.FURT___.x', 'Y': '.../BW.FURT___.y', 'Z': '.../BW.FURT___.z'}
+
+It is stored as a pickle file in the cache folder and is only built again if
+the modification time, size or inode of the folder changes, which happens
+whenever files are added, removed or renamed. Changing a file in place does
+not require a new index.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import cPickle
+import hashlib
+import os
+import time
+
+from lasif.tools.file_info_cache import get_file_stat, write_pickle
+
+
+# Folders modified less than this many seconds ago are indexed but the index
+# is not stored. Otherwise a file added within the resolution of the
+# modification time after indexing would go unnoticed.
+MTIME_RESOLUTION_IN_S = 2.0
+
+
+def get_synthetics_index(folder, cache_folder=None):
+    """
+    Returns a dictionary mapping the station ids to dictionaries mapping the
+    upper case components to the absolute filenames. Empty if the folder
+    does not exist.
+
+    :param folder: The folder with the synthetics.
+    :param cache_folder: The folder to store the index in. If None, it is
+        not stored.
+    """
+    folder = os.path.abspath(folder)
+    if not os.path.isdir(folder):
+        return {}
+    stat = get_file_stat(folder)
+
+    pickle_file = None
+    if cache_folder is not None:
+        pickle_file = os.path.join(cache_folder, "%s.pickle" %
+            hashlib.md5(folder).hexdigest())
+        if os.path.exists(pickle_file):
+            try:
+                with open(pickle_file, "rb") as open_file:
+                    content = cPickle.load(open_file)
+                if content["folder"] == folder and content["stat"] == stat:
+                    return content["index"]
+            except Exception:
+                # Corrupt or incompatible. Will be overwritten.
+                pass
+
+    index = _index_folder(folder)
+    if pickle_file and \
+            time.time() - stat[1] / 1E9 > MTIME_RESOLUTION_IN_S:
+        write_pickle(pickle_file, {"folder": folder,
+            "stat": stat, "index": index})
+    return index
+
+
+def _index_folder(folder):
+    """
+    Lists the folder and parses the filenames. The underscores are removed
+    from the names. The first two parts separated by dots are the station
+    id, the next non-empty one the component. Further parts, e.g. a file
+    extension, are ignored.
+    """
+    index = {}
+    for filename in os.listdir(folder):
+        if filename.startswith("."):
+            continue
+        parts = filename.replace("_", "").split(".")
+        components = [_i for _i in parts[2:] if _i]
+        if not components:
+            continue
+        station_id = "%s.%s" % (parts[0], parts[1])
+        index.setdefault(station_id, {})[components[0].upper()] = \
+            os.path.join(folder, filename)
+    return index
+
@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """
-Cache taking care of a single waveform directory.
+Caches taking care of waveform files.
+
+The WaveformCache indexes a single waveform directory, the
+ProjectWaveformCache all waveform directories of a project in one database.
 
 :copyright:
     Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
@@ -9,7 +12,6 @@ Cache taking care of a single waveform directory.
     GNU General Public License, Version 3
     (http://www.gnu.org/copyleft/gpl.html)
 """
-import glob
 import obspy
 import os
 import warnings
@@ -17,41 +19,56 @@ import warnings
 from lasif.tools.file_info_cache import FileInfoCache
 
 
+# The values indexed for every trace.
+WAVEFORM_INDEX_VALUES = [
+    ("network", "TEXT"),
+    ("station", "TEXT"),
+    ("location", "TEXT"),
+    ("channel", "TEXT"),
+    ("channel_id", "TEXT"),
+    ("starttime_timestamp", "REAL"),
+    ("endtime_timestamp", "REAL"),
+    ("sampling_rate", "REAL"),
+    ("npts", "INTEGER"),
+    ("latitude", "REAL"),
+    ("longitude", "REAL"),
+    ("elevation_in_m", "REAL"),
+    ("local_depth_in_m", "REAL")]
+
+
 class WaveformCache(FileInfoCache):
     """
     Cache taking care of a single waveform directory.
 
     Supports all waveform files readable with ObsPy.
+
+    All further keyword arguments are passed on to the FileInfoCache.
     """
-    def __init__(self, cache_db_file, waveform_folder):
-        self.index_values = [
-            ("network", "TEXT"),
-            ("station", "TEXT"),
-            ("location", "TEXT"),
-            ("channel", "TEXT"),
-            ("channel_id", "TEXT"),
-            ("starttime_timestamp", "REAL"),
-            ("endtime_timestamp", "REAL"),
-            ("latitude", "REAL"),
-            ("longitude", "REAL"),
-            ("elevation_in_m", "REAL"),
-            ("local_depth_in_m", "REAL")]
+    def __init__(self, cache_db_file, waveform_folder, **kwargs):
+        self.index_values = list(WAVEFORM_INDEX_VALUES)
 
         self.filetypes = ["waveform"]
 
+        self.indexed_columns = [("network", "station"), ("channel_id",),
+            ("starttime_timestamp", "endtime_timestamp")]
+
         self.waveform_folder = waveform_folder
 
-        super(WaveformCache, self).__init__(cache_db_file=cache_db_file)
+        super(WaveformCache, self).__init__(cache_db_file=cache_db_file,
+            **kwargs)
 
     def _find_files_waveform(self):
-        return glob.glob(os.path.join(self.waveform_folder, "*"))
+        return self._glob_folder(self.waveform_folder, "*")
 
     def _extract_index_values_waveform(self, filename):
         """
         Extract all the information from the file.
+
+        Only the headers are read. For MiniSEED and SAC files this means that
+        the samples are never decompressed.
         """
         try:
-            st = obspy.read(filename)
+            st = obspy.read(filename, headonly=True)
         except:
             warnings.warn("Could not read waveform file '%s'." % filename)
             return None
@@ -77,7 +94,160 @@ class WaveformCache(FileInfoCache):
             s = tr.stats
             waveforms.append([
                 s.network, s.station, s.location, s.channel, tr.id,
-                s.starttime.timestamp, s.endtime.timestamp, latitude,
-                longitude, elevation_in_m, local_depth_in_m])
+                s.starttime.timestamp, s.endtime.timestamp,
+                s.sampling_rate, s.npts, latitude, longitude, elevation_in_m,
+                local_depth_in_m])
 
         return waveforms
+
+
+class ProjectWaveformCache(WaveformCache):
+    """
+    Cache taking care of all waveform directories of a project in a single
+    database.
+
+    The waveform files of a project are stored in
+    DATA_FOLDER/EVENT_NAME/TAG/. Every trace is additionally indexed by the
+    name of the event and the tag so the database is partitioned by them.
+    Use get_partition() to get a view of a single event and tag behaving like
+    a WaveformCache for that directory.
+
+    All further keyword arguments are passed on to the FileInfoCache.
+    """
+    def __init__(self, cache_db_file, data_folder, **kwargs):
+        self.index_values = [("event_name", "TEXT"), ("tag", "TEXT")] + \
+            WAVEFORM_INDEX_VALUES
+
+        self.filetypes = ["waveform"]
+
+        self.indexed_columns = [("event_name", "tag"),
+            ("network", "station"), ("channel_id",),
+            ("starttime_timestamp", "endtime_timestamp")]
+
+        self.data_folder = data_folder
+
+        super(WaveformCache, self).__init__(cache_db_file=cache_db_file,
+            **kwargs)
+
+    def _find_files_waveform(self):
+        files = []
+        for event_folder in self._list_subfolders(self.data_folder):
+            for tag_folder in self._list_subfolders(event_folder):
+                files.extend(self._glob_folder(tag_folder, "*"))
+        return files
+
+    def _extract_index_values_waveform(self, filename):
+        """
+        Extract all the information from the file. The event and tag are
+        determined by the location of the file.
+        """
+        waveforms = super(ProjectWaveformCache,
+            self)._extract_index_values_waveform(filename)
+        if not waveforms:
+            return waveforms
+        tag_folder = os.path.dirname(filename)
+        tag = os.path.basename(tag_folder)
+        event_name = os.path.basename(os.path.dirname(tag_folder))
+        return [[event_name, tag] + _i for _i in waveforms]
+
+    def get_partition(self, event_name, tag):
+        """
+        Returns a view of the waveforms of a single event and tag.
+        """
+        return WaveformCachePartition(self, event_name, tag)
+
+    def get_counts(self, tag="raw"):
+        """
+        Returns a dictionary with some counts for every event with waveforms
+        of the given tag, e.g.
+
+        {"event_1": {"files": 30, "channels": 30, "stations": 10,
+                     "samples": 1200000, "size_in_bytes": 2560000}}
+        """
+        self._ensure_up_to_date()
+        counts = {}
+        for event_name, channels, stations, samples in \
+                self.db_cursor.execute("""
+                SELECT event_name, COUNT(DISTINCT channel_id),
+                    COUNT(DISTINCT network || '.' || station),
+                    IFNULL(SUM(npts), 0)
+                FROM indices
+                WHERE tag = ?
+                GROUP BY event_name;""", (tag,)).fetchall():
+            counts[event_name] = {"channels": channels, "stations": stations,
+                "samples": samples}
+        # Files can contain many traces so they are counted separately.
+        for event_name, files, size in self.db_cursor.execute("""
+                SELECT event_name, COUNT(*), IFNULL(SUM(size), 0)
+                FROM files
+                INNER JOIN (SELECT DISTINCT filepath_id, event_name
+                            FROM indices WHERE tag = ?) AS file_events
+                ON files.id = file_events.filepath_id
+                GROUP BY event_name;""", (tag,)).fetchall():
+            counts[event_name]["files"] = files
+            counts[event_name]["size_in_bytes"] = size
+        return counts
+
+    def get_availability_matrix(self, tag="raw"):
+        """
+        Returns which station has waveforms of the given tag for which event.
+
+        Returns a tuple of (station_ids, event_names, matrix). Both lists are
+        sorted and matrix is a boolean NumPy array with one row per station
+        and one column per event.
+        """
+        import numpy as np
+
+        self._ensure_up_to_date()
+        pairs = self.db_cursor.execute("""
+            SELECT DISTINCT network || '.' || station, event_name
+            FROM indices
+            WHERE tag = ?;""", (tag,)).fetchall()
+        station_ids = sorted(set(_i[0] for _i in pairs))
+        event_names = sorted(set(_i[1] for _i in pairs))
+        station_index = {_i: _j for _j, _i in enumerate(station_ids)}
+        event_index = {_i: _j for _j, _i in enumerate(event_names)}
+        matrix = np.zeros((len(station_ids), len(event_names)), dtype=bool)
+        if pairs:
+            rows = [station_index[_i[0]] for _i in pairs]
+            cols = [event_index[_i[1]] for _i in pairs]
+            matrix[rows, cols] = True
+        return station_ids, event_names, matrix
+
+
+class WaveformCachePartition(object):
+    """
+    View of the waveforms of a single event and tag in a
+    ProjectWaveformCache.
+
+    Offers the query methods of the FileInfoCache. All queries are
+    restricted to the event and tag.
+    """
+    def __init__(self, cache, event_name, tag):
+        self.cache = cache
+        self.event_name = event_name
+        self.tag = tag
+
+    def _get_filters(self, filters):
+        filters["event_name"] = self.event_name
+        filters["tag"] = self.tag
+        return filters
+
+    def iter_values(self, columns=None, **filters):
+        return self.cache.iter_values(columns=columns,
+            **self._get_filters(filters))
+
+    def get_values(self, columns=None, **filters):
+        return self.cache.get_values(columns=columns,
+            **self._get_filters(filters))
+
+    def get_column_arrays(self, columns=None, **filters):
+        return self.cache.get_column_arrays(columns=columns,
+            **self._get_filters(filters))
+
+    def get_array(self, columns=None, **filters):
+        return self.cache.get_array(columns=columns,
+            **self._get_filters(filters))
+
+    def get_details(self, filename):
+        return self.get_values(filename=os.path.abspath(filename))
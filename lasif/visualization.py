@@ -13,7 +13,6 @@ Visualization scripts.
 from itertools import izip
 from matplotlib import cm
 import matplotlib.pyplot as plt
-from mpl_toolkits.basemap import Basemap
 import numpy as np
 from obspy.imaging.beachball import Beach
 from obspy.signal.tf_misfit import plotTfr
@@ -27,6 +26,8 @@ def plot_domain(min_latitude, max_latitude, min_longitude, max_longitude,
         plot_simulation_domain=False, zoom=False, resolution=None):
     """
     """
+    from mpl_toolkits.basemap import Basemap
+
     bounds = rotations.get_max_extention_of_domain(min_latitude,
         max_latitude, min_longitude, max_longitude,
         rotation_axis=rotation_axis,
@@ -112,16 +113,28 @@ def plot_domain(min_latitude, max_latitude, min_longitude, max_longitude,
 
 def plot_events(events, map_object):
     """
+    Plots a beachball for every event.
+
+    :param events: A list of event information dictionaries as returned by
+        Project.get_event_info() or of obspy Event objects. Events without a
+        moment tensor are skipped.
     """
+    from lasif.tools.event_catalog import get_moment_tensor
+
     for event in events:
-        org = event.preferred_origin() or event.origins[0]
-        fm = event.preferred_focal_mechanism() or event.focal_mechanisms[0]
-        mt = fm.moment_tensor.tensor
+        if isinstance(event, dict):
+            focmec = event["moment_tensor"]
+            latitude, longitude = event["latitude"], event["longitude"]
+        else:
+            focmec = get_moment_tensor(event)
+            org = event.preferred_origin() or event.origins[0]
+            latitude, longitude = org.latitude, org.longitude
+        if focmec is None:
+            continue
 
         # Add beachball plot.
-        x, y = map_object(org.longitude, org.latitude)
+        x, y = map_object(longitude, latitude)
 
-        focmec = [mt.m_rr, mt.m_tt, mt.m_pp, mt.m_rt, mt.m_rp, mt.m_tp]
         # Attempt to calculate the best beachball size.
         width = max((map_object.xmax - map_object.xmin,
             map_object.ymax - map_object.ymin)) * 0.020
@@ -137,6 +150,10 @@ def plot_raydensity(map_object, station_events, min_lat, max_lat, min_lng,
 
     This function is potentially expensive and will use all CPUs available.
     Does require geographiclib to be installed.
+
+    :param station_events: A list of (event_info, stations) tuples. The
+        stations are a dictionary with latitude and longitude arrays as
+        returned by Project.get_station_coordinate_arrays().
     """
     import ctypes as C
     from lasif.tools.great_circle_binner import GreatCircleBinner, Point
@@ -151,11 +168,10 @@ def plot_raydensity(map_object, station_events, min_lat, max_lat, min_lng,
     # list is then distributed among all processors.
     station_event_list = []
     for event, stations in station_events:
-        org = event.preferred_origin() or event.origins[0]
-        e_point = Point(org.latitude, org.longitude)
-        for station in stations.itervalues():
-            station_event_list.append((e_point, Point(station["latitude"],
-                station["longitude"])))
+        e_point = Point(event["latitude"], event["longitude"])
+        station_event_list.extend([(e_point, Point(lat, lng))
+            for lat, lng in izip(stations["latitude"].tolist(),
+            stations["longitude"].tolist())])
 
     circle_count = len(station_event_list)
 
@@ -277,24 +293,24 @@ def plot_stations_for_event(map_object, station_dict, event_info):
     """
     Plots all stations for one event.
 
-    :param station_dict: A dictionary whose values at least contain latitude
-        and longitude keys.
+    :param station_dict: A dictionary with latitude and longitude arrays as
+        returned by Project.get_station_coordinate_arrays().
     """
+    lats = station_dict["latitude"]
+    lngs = station_dict["longitude"]
     # Plot the stations with scatter.
-    lngs = [_i["longitude"] for _i in station_dict.itervalues()]
-    lats = [_i["latitude"] for _i in station_dict.itervalues()]
     x, y = map_object(lngs, lats)
     map_object.scatter(x, y, color="green", s=35, marker="v", zorder=100,
         edgecolor="black")
 
     # Plot the ray paths.
-    for sta_lng, sta_lat in izip(lngs, lats):
+    for sta_lng, sta_lat in izip(lngs.tolist(), lats.tolist()):
         map_object.drawgreatcircle(event_info["longitude"],
             event_info["latitude"], sta_lng, sta_lat, lw=2, alpha=0.3)
 
     title = "Event in %s, at %s, %.1f Mw, with %i stations." % (
         event_info["region"], str(event_info["origin_time"]),
-        event_info["magnitude"], len(station_dict))
+        event_info["magnitude"], len(lats))
     plt.gca().set_title(title, size="large")
 
 